@@ -1,29 +1,78 @@
+import argparse
 import os
 
-import boto3
-
 PROFILE = os.environ.get("PROFILE")
 REGION = os.environ.get("REGION")
-ec2 = boto3.Session(region_name=REGION, profile_name=PROFILE).resource("ec2")
-
-subnets = ec2.subnets.all()
-subnet_details = dict()
-
-for subnet in list(subnets):
-    free_ips = subnet.available_ip_address_count
-    n = int(subnet.cidr_block.split("/")[1])
-    cidr_ips = 2 ** (32 - n)
-    used_ips = cidr_ips - free_ips
-    subnet_details[subnet.id] = {
-        "az": subnet.meta.data["AvailabilityZone"],
-        "total_ips": cidr_ips,
-        "aws_used": 5,
-        "used_ips": used_ips,
-        "free_ips": free_ips,
-    }
-
-sorted_by_used_ips = sorted(
-    subnet_details, key=lambda x: (subnet_details[x]["used_ips"]), reverse=True
-)
-for id in sorted_by_used_ips:
-    print(f"{id}: {subnet_details[id]}")
+
+
+def _split(value):
+    return [v.strip() for v in value.split(",") if v.strip()] if value else []
+
+
+def parse_args(argv=None):
+    from pkg import history, output
+
+    parser = argparse.ArgumentParser(description="ip capacity of every subnet over several accounts and regions")
+    parser.add_argument("--profile", action="append",
+                        help="aws profile of an account to check, can be repeated, $PROFILE by default")
+    parser.add_argument("--region", action="append", help="region to check, can be repeated, $REGION by default")
+    parser.add_argument("--workers", type=int, help="accounts and regions listed at the same time")
+    parser.add_argument("--format", default="text", choices=output.FORMATS, help="text by default")
+    parser.add_argument("--output", help="file to write to, stdout by default")
+    parser.add_argument("--history", default=history.DEFAULT_HISTORY_PATH, help="sqlite file every sample is added to")
+    parser.add_argument("--no-history", action="store_true", help="don't add this sample to the history")
+    parser.add_argument("--exhaustion", action="store_true",
+                        help="rank subnets, azs and vpcs by predicted time to exhaustion instead of listing subnets")
+    parser.add_argument("--no-collect", action="store_true", help="with --exhaustion, only rank what is in the history")
+    parser.add_argument("--window-days", type=int, default=14, help="days of samples the growth is fitted on")
+    parser.add_argument("--top", type=int, default=20, help="rows shown per ranking")
+    parser.add_argument("--free-space", action="store_true", help="show the largest free blocks of every vpc")
+    parser.add_argument("--prefixlen", type=int, help="with --free-space, only blocks a subnet of this size fits in")
+    parser.add_argument("--plan", type=int, metavar="PREFIXLEN", help="where to carve a new subnet of this size in every az")
+    parser.add_argument("--vpc", action="append", help="only plan or show free space of this vpc, can be repeated")
+    args = parser.parse_args(argv)
+    # comma separated lists in the environment or the flags both work
+    args.profile = [p for value in args.profile or [PROFILE] for p in _split(value)] or [None]
+    args.region = [r for value in args.region or [REGION] for r in _split(value)]
+    if not args.region:
+        parser.error("no region given, set --region or $REGION")
+    if args.no_collect and (args.free_space or args.plan):
+        parser.error("--free-space and --plan need the current vpcs and subnets, drop --no-collect")
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    from pkg import cidr, collector, history, output
+
+    subnet_history = None if args.no_history and not args.exhaustion else history.open_history(args.history)
+    try:
+        if not args.no_collect:
+            targets = collector.new_targets(args.profile, args.region)
+            subnets = collector.collect(targets, workers=args.workers or collector.COLLECT_WORKERS)
+            if not args.no_history:
+                subnet_history.save_sample(subnets)
+            if not (args.exhaustion or args.free_space or args.plan):
+                output.write_subnets(subnets, args.format, args.output)
+        if args.free_space or args.plan:
+            vpcs = collector.collect_vpcs(targets, workers=args.workers or collector.COLLECT_WORKERS)
+            if args.vpc:
+                vpcs = [v for v in vpcs if v.vpc_id in args.vpc]
+            index = cidr.new_cidr_index(vpcs, subnets)
+            if args.free_space:
+                output.write_free_space(index, args.top, args.prefixlen)
+            if args.plan:
+                output.write_plan(index, args.plan)
+        if args.exhaustion:
+            exhaustion = subnet_history.subnet_exhaustion(args.window_days)
+            output.write_exhaustion(
+                exhaustion, subnet_history.rollup(exhaustion, "az"), subnet_history.rollup(exhaustion, "vpc"), args.top
+            )
+    finally:
+        if subnet_history is not None:
+            subnet_history.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+import bisect
+import ipaddress
+from collections import namedtuple
+
+from pkg import collector
+
+# aws only allows subnets from /16 down to /28
+MIN_SUBNET_PREFIXLEN = 16
+MAX_SUBNET_PREFIXLEN = 28
+
+# a free, aligned block of a vpc, usable_ips leaves out the addresses aws reserves in
+# every subnet, so it's what a subnet carved from the whole block could hand out
+FreeBlock = namedtuple("FreeBlock", ["vpc_id", "cidr", "total_ips", "usable_ips"])
+
+
+def _blocks(start, end):
+    # splits [start, end) into the fewest aligned power of two blocks, as (start, size)
+    while start < end:
+        size = start & -start if start else 1 << 32
+        while start + size > end:
+            size >>= 1
+        yield start, size
+        start += size
+
+
+def _network(start, size):
+    return ipaddress.IPv4Network((start, 32 - size.bit_length() + 1))
+
+
+def _free_block(vpc_id, start, size):
+    return FreeBlock(vpc_id, str(_network(start, size)), size, max(size - collector.AWS_RESERVED_IPS, 0))
+
+
+class VpcSpace:
+    # interval index of one vpc: its cidrs and its subnets as sorted, non overlapping
+    # [start, end) address ranges, the free space is every gap between them
+    def __init__(self, vpc, subnets):
+        self.vpc = vpc
+        self.ranges = sorted(_range(cidr) for cidr in vpc.cidrs)
+        allocated = sorted((_range(s.cidr), s.az) for s in subnets)
+        self.starts = [r[0] for r, _ in allocated]
+        self.ends = [r[1] for r, _ in allocated]
+        self.azs = sorted({s.az for s in subnets})
+
+    def free_ranges(self):
+        # [(start, end)] not covered by any subnet, within every cidr of the vpc
+        free = []
+        for start, end in self.ranges:
+            i = bisect.bisect_right(self.ends, start)
+            position = start
+            while i < len(self.starts) and self.starts[i] < end:
+                if self.starts[i] > position:
+                    free.append((position, self.starts[i]))
+                position = max(position, self.ends[i])
+                i += 1
+            if position < end:
+                free.append((position, end))
+        return free
+
+    def free_blocks(self):
+        return [
+            (start, size) for free_start, free_end in self.free_ranges() for start, size in _blocks(free_start, free_end)
+        ]
+
+    def largest_free(self, prefixlen=None, limit=None):
+        # the biggest free blocks first, with prefixlen only the ones a /prefixlen fits in
+        blocks = self.free_blocks()
+        if prefixlen is not None:
+            blocks = [b for b in blocks if b[1] >= 1 << (32 - prefixlen)]
+        blocks.sort(key=lambda b: (-b[1], b[0]))
+        return [_free_block(self.vpc.vpc_id, start, size) for start, size in blocks[:limit]]
+
+    def count_free(self, prefixlen):
+        # how many /prefixlen subnets still fit in the vpc
+        size = 1 << (32 - prefixlen)
+        return sum(block_size // size for _, block_size in self.free_blocks() if block_size >= size)
+
+    def plan(self, prefixlen, azs=None):
+        # one new /prefixlen per az, each taken from the smallest free block it fits in so
+        # the big blocks stay whole. An az gets None once the vpc is out of room
+        if not MIN_SUBNET_PREFIXLEN <= prefixlen <= MAX_SUBNET_PREFIXLEN:
+            raise ValueError(f"subnets have to be between /{MIN_SUBNET_PREFIXLEN} and /{MAX_SUBNET_PREFIXLEN}")
+        size = 1 << (32 - prefixlen)
+        blocks = sorted((b_size, start) for start, b_size in self.free_blocks() if b_size >= size)
+        planned = {}
+        for az in azs or self.azs:
+            if not blocks:
+                planned[az] = None
+                continue
+            block_size, start = blocks.pop(0)
+            planned[az] = _free_block(self.vpc.vpc_id, start, size)
+            # what's left of the block goes back as smaller aligned blocks
+            for rest_start, rest_size in _blocks(start + size, start + block_size):
+                bisect.insort(blocks, (rest_size, rest_start))
+        return planned
+
+
+class CidrIndex:
+    def __init__(self, vpcs, subnets):
+        by_vpc = {}
+        for s in subnets:
+            by_vpc.setdefault(s.vpc_id, []).append(s)
+        self.vpcs = {vpc.vpc_id: VpcSpace(vpc, by_vpc.get(vpc.vpc_id, [])) for vpc in vpcs}
+
+    def __getitem__(self, vpc_id):
+        return self.vpcs[vpc_id]
+
+    def __iter__(self):
+        return iter(self.vpcs.values())
+
+
+def new_cidr_index(vpcs, subnets):
+    return CidrIndex(vpcs, subnets)
+
+
+def _range(cidr):
+    network = ipaddress.IPv4Network(cidr)
+    start = int(network.network_address)
+    return start, start + network.num_addresses
@@ -0,0 +1,95 @@
+import sys
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+COLLECT_WORKERS = 16
+# describe_subnets returns at most this many subnets a page
+SUBNETS_PAGE_SIZE = 1000
+# the network address, vpc router, dns, future use and broadcast of every subnet
+AWS_RESERVED_IPS = 5
+
+Target = namedtuple("Target", ["profile", "region"])
+# used_ips are the addresses taken by interfaces, the aws_used ones are not part of it
+Subnet = namedtuple(
+    "Subnet",
+    ["profile", "region", "vpc_id", "subnet_id", "name", "az", "cidr", "total_ips", "aws_used", "used_ips", "free_ips"]
+)
+# cidrs holds the primary and every associated secondary ipv4 cidr of the vpc
+Vpc = namedtuple("Vpc", ["profile", "region", "vpc_id", "name", "cidrs"])
+
+
+def new_targets(profiles, regions):
+    return [Target(profile, region) for profile in profiles for region in regions]
+
+
+def new_ec2_client(profile, region):
+    import boto3
+
+    return boto3.Session(region_name=region, profile_name=profile).client("ec2")
+
+
+def get_subnets(ec2_client):
+    # the client api returns every attribute in the page, unlike ec2.subnets.all() which
+    # loads them lazily subnet by subnet
+    subnets = []
+    paginator = ec2_client.get_paginator("describe_subnets")
+    for page in paginator.paginate(PaginationConfig={"PageSize": SUBNETS_PAGE_SIZE}):
+        subnets.extend(page["Subnets"])
+    return subnets
+
+
+def get_vpcs(ec2_client):
+    vpcs = []
+    paginator = ec2_client.get_paginator("describe_vpcs")
+    for page in paginator.paginate(PaginationConfig={"PageSize": SUBNETS_PAGE_SIZE}):
+        vpcs.extend(page["Vpcs"])
+    return vpcs
+
+
+def _name(resource):
+    return next((t["Value"] for t in resource.get("Tags", []) if t["Key"] == "Name"), "")
+
+
+def new_vpc(profile, region, vpc):
+    cidrs = [
+        a["CidrBlock"] for a in vpc.get("CidrBlockAssociationSet", [])
+        if a.get("CidrBlockState", {}).get("State", "associated") == "associated"
+    ]
+    return Vpc(profile, region, vpc["VpcId"], _name(vpc), tuple(cidrs or [vpc["CidrBlock"]]))
+
+
+def new_subnet(profile, region, subnet):
+    free_ips = subnet["AvailableIpAddressCount"]
+    n = int(subnet["CidrBlock"].split("/")[1])
+    cidr_ips = 2 ** (32 - n)
+    return Subnet(
+        profile, region, subnet["VpcId"], subnet["SubnetId"], _name(subnet), subnet["AvailabilityZone"],
+        subnet["CidrBlock"], cidr_ips, AWS_RESERVED_IPS, cidr_ips - AWS_RESERVED_IPS - free_ips, free_ips,
+    )
+
+
+def _sweep(targets, client_factory, workers, list_function, new_item, what):
+    # every account and region is listed in parallel, client_factory(profile, region)
+    # can hand out stubbed or mocked clients. A target that can't be listed (expired
+    # credentials, an opt-in region) is reported and left out, the others still count
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [(t, pool.submit(lambda t: list_function(client_factory(t.profile, t.region)), t)) for t in targets]
+        items = []
+        for t, f in futures:
+            # stdout may be carrying the json or csv output
+            try:
+                listed = f.result()
+            except Exception as e:
+                print(f"failed to list {what} of {t.profile} in {t.region}: {e}", file=sys.stderr)
+                continue
+            print(f"listed {len(listed)} {what} of {t.profile} in {t.region}", file=sys.stderr)
+            items.extend(new_item(t.profile, t.region, i) for i in listed)
+    return items
+
+
+def collect(targets, client_factory=new_ec2_client, workers=COLLECT_WORKERS):
+    return _sweep(targets, client_factory, workers, get_subnets, new_subnet, "subnets")
+
+
+def collect_vpcs(targets, client_factory=new_ec2_client, workers=COLLECT_WORKERS):
+    return _sweep(targets, client_factory, workers, get_vpcs, new_vpc, "vpcs")
@@ -0,0 +1,141 @@
+import math
+import os
+import sqlite3
+import time
+from collections import namedtuple
+
+from pkg import collector
+
+DEFAULT_HISTORY_PATH = "subnet-history.sqlite"
+# growth is fitted over the samples of this many days before the latest one
+WINDOW_DAYS = 14
+SECONDS_PER_DAY = 86400
+# stored in PRAGMA user_version, 1 is when used_ips stopped counting the aws reserved addresses
+SCHEMA_VERSION = 1
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS subnet (
+    subnet_id TEXT PRIMARY KEY,
+    profile TEXT,
+    region TEXT NOT NULL,
+    vpc_id TEXT NOT NULL,
+    az TEXT NOT NULL,
+    cidr TEXT NOT NULL,
+    total_ips INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS subnet_sample (
+    taken_at INTEGER NOT NULL,
+    subnet_id TEXT NOT NULL,
+    used_ips INTEGER NOT NULL,
+    PRIMARY KEY (taken_at, subnet_id)
+) WITHOUT ROWID;
+"""
+
+# growth is in used ips per day, days_left is how long the free ips last at that rate
+# and is inf for subnets that aren't growing. samples is the number of samples fitted,
+# or of subnets for an az or vpc rollup
+Exhaustion = namedtuple(
+    "Exhaustion", ["key", "total_ips", "used_ips", "free_ips", "growth", "days_left", "samples"]
+)
+
+
+def open_history(path=DEFAULT_HISTORY_PATH):
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    return History(sqlite3.connect(path))
+
+
+def days_left(free_ips, growth):
+    return free_ips / growth if growth > 0 else math.inf
+
+
+class History:
+    # a sample is just (taken_at, subnet, used ips), the rest of a subnet is stored once.
+    # The fit is summed up by sqlite, so only one row per subnet is read back however
+    # many months of samples there are
+    def __init__(self, conn):
+        self.conn = conn
+        existing = self.conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'subnet_sample'").fetchone()
+        self.conn.executescript(SCHEMA)
+        self._migrate(existing is not None)
+
+    def _migrate(self, existing):
+        version = self.conn.execute("PRAGMA user_version").fetchone()[0]
+        with self.conn:
+            if existing and version < 1:
+                # samples of the first version counted the aws reserved addresses as used
+                self.conn.execute(
+                    "UPDATE subnet_sample SET used_ips = MAX(used_ips - ?, 0)", (collector.AWS_RESERVED_IPS,)
+                )
+            if version < SCHEMA_VERSION:
+                self.conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+    def save_sample(self, subnets, taken_at=None):
+        # taken_at is in epoch seconds, free ips are what's left of total_ips after the aws
+        # reserved and the used ones
+        taken_at = int(taken_at if taken_at is not None else time.time())
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO subnet VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [(s.subnet_id, s.profile, s.region, s.vpc_id, s.az, s.cidr, s.total_ips) for s in subnets]
+            )
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO subnet_sample VALUES (?, ?, ?)",
+                [(taken_at, s.subnet_id, s.used_ips) for s in subnets]
+            )
+        return taken_at
+
+    def latest_sample(self):
+        return self.conn.execute("SELECT MAX(taken_at) FROM subnet_sample").fetchone()[0]
+
+    def subnet_exhaustion(self, window_days=WINDOW_DAYS, end=None):
+        # least squares growth of used ips over the window, for every subnet in the latest
+        # sample, the most urgent first
+        end = end if end is not None else self.latest_sample()
+        if end is None:
+            return []
+        start = end - window_days * SECONDS_PER_DAY
+        rows = self.conn.execute(
+            """
+            WITH fit AS (
+                SELECT subnet_id, COUNT(*) AS n, SUM(x) AS sx, SUM(used_ips) AS sy,
+                       SUM(x * x) AS sxx, SUM(x * used_ips) AS sxy
+                FROM (SELECT subnet_id, used_ips, (taken_at - ?) / 86400.0 AS x
+                      FROM subnet_sample WHERE taken_at BETWEEN ? AND ?)
+                GROUP BY subnet_id
+            )
+            SELECT subnet.subnet_id, profile, region, vpc_id, az, total_ips, latest.used_ips, fit.n,
+                   CASE WHEN fit.n * fit.sxx - fit.sx * fit.sx > 0
+                        THEN (fit.n * fit.sxy - fit.sx * fit.sy) / (fit.n * fit.sxx - fit.sx * fit.sx)
+                        ELSE 0.0 END
+            FROM subnet_sample AS latest
+            JOIN subnet USING (subnet_id)
+            JOIN fit USING (subnet_id)
+            WHERE latest.taken_at = ?
+            """,
+            (start, start, end, end)
+        ).fetchall()
+        exhaustion = []
+        for subnet_id, profile, region, vpc_id, az, total_ips, used_ips, n, growth in rows:
+            free_ips = total_ips - collector.AWS_RESERVED_IPS - used_ips
+            exhaustion.append(Exhaustion(
+                (profile, region, vpc_id, az, subnet_id), total_ips, used_ips, free_ips, growth, days_left(free_ips, growth), n
+            ))
+        return sorted(exhaustion, key=lambda e: (e.days_left, -e.used_ips / e.total_ips))
+
+    def rollup(self, exhaustion, by):
+        # by is "az" or "vpc", growth and free ips add up, so a group runs out when the sum does
+        index = {"az": 3, "vpc": 2}[by]
+        groups = {}
+        for e in exhaustion:
+            key = (e.key[0], e.key[1], e.key[index])
+            total_ips, used_ips, free_ips, growth, samples = groups.get(key, (0, 0, 0, 0.0, 0))
+            groups[key] = (total_ips + e.total_ips, used_ips + e.used_ips, free_ips + e.free_ips, growth + e.growth, samples + 1)
+        rolled_up = [
+            Exhaustion(key, total_ips, used_ips, free_ips, growth, days_left(free_ips, growth), subnets)
+            for key, (total_ips, used_ips, free_ips, growth, subnets) in groups.items()
+        ]
+        return sorted(rolled_up, key=lambda e: (e.days_left, -e.used_ips / e.total_ips))
+
+    def close(self):
+        self.conn.close()
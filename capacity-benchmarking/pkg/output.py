@@ -0,0 +1,90 @@
+import csv
+import json
+import sys
+
+from pkg import collector
+
+FORMATS = ["text", "json", "csv", "parquet"]
+
+
+def write_text(subnets, f):
+    sorted_by_used_ips = sorted(subnets, key=lambda s: s.used_ips, reverse=True)
+    for s in sorted_by_used_ips:
+        print(f"{s.subnet_id}: {dict(az=s.az, total_ips=s.total_ips, aws_used=s.aws_used, used_ips=s.used_ips, free_ips=s.free_ips)}", file=f)
+
+
+def write_json(subnets, f):
+    json.dump([s._asdict() for s in subnets], f, indent=2)
+    f.write("\n")
+
+
+def write_csv(subnets, f):
+    csv_file = csv.writer(f)
+    csv_file.writerow(collector.Subnet._fields)
+    csv_file.writerows(subnets)
+
+
+def write_parquet(subnets, path):
+    # pyarrow is optional, only the parquet output needs it
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise SystemExit("parquet output needs pyarrow, install it with `poetry install -E parquet`")
+    columns = {field: [getattr(s, field) for s in subnets] for field in collector.Subnet._fields}
+    pyarrow.parquet.write_table(pyarrow.table(columns), path)
+
+
+def write_subnets(subnets, output_format, output=None):
+    if output_format == "parquet":
+        if not output:
+            raise SystemExit("parquet output needs --output")
+        write_parquet(subnets, output)
+        return
+    writer = {"text": write_text, "json": write_json, "csv": write_csv}[output_format]
+    if not output:
+        writer(subnets, sys.stdout)
+        return
+    with open(output, "w", newline="") as f:
+        writer(subnets, f)
+
+
+def _days_left(days):
+    return "never" if days == float("inf") else f"{days:.1f}d"
+
+
+def write_exhaustion(subnets, azs, vpcs, top, f=sys.stdout):
+    # subnets, azs and vpcs are history.Exhaustion rows, most urgent first
+    print("Subnets by time to exhaustion:", file=f)
+    for e in subnets[:top]:
+        profile, region, vpc_id, az, subnet_id = e.key
+        print(f"\t{subnet_id}\t{az}\t{vpc_id}\t{profile}\tfree {e.free_ips}/{e.total_ips}"
+              f"\t{e.growth:+.1f} ips/day\t{_days_left(e.days_left)}", file=f)
+    for title, groups in [("Availability zones", azs), ("VPCs", vpcs)]:
+        print(f"{title} by time to exhaustion:", file=f)
+        for e in groups[:top]:
+            profile, region, group = e.key
+            print(f"\t{group}\t{region}\t{profile}\t{e.samples} subnets\tfree {e.free_ips}/{e.total_ips}"
+                  f"\t{e.growth:+.1f} ips/day\t{_days_left(e.days_left)}", file=f)
+
+
+def write_free_space(index, top, prefixlen=None, f=sys.stdout):
+    # index is a cidr.CidrIndex, the vpcs with the most free room first
+    free = sorted(((sum(end - start for start, end in v.free_ranges()), v) for v in index), key=lambda f: -f[0])
+    for free_ips, space in free:
+        vpc = space.vpc
+        print(f"{vpc.vpc_id} {vpc.name} {vpc.region} {vpc.profile} {','.join(vpc.cidrs)}: {free_ips} free ips", file=f)
+        if prefixlen is not None:
+            print(f"\t{space.count_free(prefixlen)} more /{prefixlen} subnets fit", file=f)
+        for block in space.largest_free(prefixlen, top):
+            print(f"\t{block.cidr}\t{block.usable_ips} usable ips", file=f)
+
+
+def write_plan(index, prefixlen, f=sys.stdout):
+    for space in index:
+        print(f"{space.vpc.vpc_id} {space.vpc.name} {space.vpc.region} {space.vpc.profile}: new /{prefixlen} per az", file=f)
+        for az, block in space.plan(prefixlen).items():
+            if block is None:
+                print(f"\t{az}\tno room left", file=f)
+            else:
+                print(f"\t{az}\t{block.cidr}\t{block.usable_ips} usable ips", file=f)
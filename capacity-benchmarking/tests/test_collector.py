@@ -0,0 +1,120 @@
+import contextlib
+import io
+import unittest
+
+import boto3
+from botocore.exceptions import ProfileNotFound
+from botocore.stub import Stubber
+
+from pkg import collector
+
+# usage: python -m unittest discover tests
+# every target gets its own stubbed ec2 client through client_factory, nothing reaches aws
+REGION = "ap-southeast-1"
+PAGE = {"MaxResults": collector.SUBNETS_PAGE_SIZE}
+
+
+def subnet(subnet_id, cidr, free_ips, vpc_id="vpc-1", az="ap-southeast-1a", name=None):
+    s = {
+        "SubnetId": subnet_id, "VpcId": vpc_id, "CidrBlock": cidr, "AvailabilityZone": az,
+        "AvailableIpAddressCount": free_ips,
+    }
+    if name is not None:
+        s["Tags"] = [{"Key": "Name", "Value": name}]
+    return s
+
+
+class CollectorTest(unittest.TestCase):
+    def setUp(self):
+        self.clients = {}
+        self.stubbers = []
+
+    def tearDown(self):
+        for stubber in self.stubbers:
+            stubber.deactivate()
+
+    def stub(self, profile, region=REGION):
+        client = boto3.client(
+            "ec2", region_name=region, aws_access_key_id="testing", aws_secret_access_key="testing"
+        )
+        stubber = Stubber(client)
+        stubber.activate()
+        self.stubbers.append(stubber)
+        self.clients[(profile, region)] = client
+        return stubber
+
+    def client_factory(self, profile, region):
+        if (profile, region) not in self.clients:
+            raise ProfileNotFound(profile=profile)
+        return self.clients[(profile, region)]
+
+    def collect(self, targets, function=collector.collect):
+        errors = io.StringIO()
+        with contextlib.redirect_stderr(errors):
+            items = function(targets, client_factory=self.client_factory, workers=2)
+        for stubber in self.stubbers:
+            stubber.assert_no_pending_responses()
+        return items, errors.getvalue()
+
+    def test_pages_and_targets_are_merged(self):
+        prod = self.stub("prod")
+        prod.add_response(
+            "describe_subnets",
+            {"Subnets": [subnet("subnet-a", "10.0.0.0/24", 200, name="app-a")], "NextToken": "page-2"},
+            PAGE,
+        )
+        prod.add_response(
+            "describe_subnets",
+            {"Subnets": [subnet("subnet-b", "10.0.1.0/28", 3, az="ap-southeast-1b")]},
+            dict(PAGE, NextToken="page-2"),
+        )
+        self.stub("stage").add_response(
+            "describe_subnets", {"Subnets": [subnet("subnet-c", "10.1.0.0/26", 59, vpc_id="vpc-2")]}, PAGE
+        )
+        subnets, errors = self.collect(collector.new_targets(["prod", "stage"], [REGION]))
+        self.assertEqual([(s.profile, s.subnet_id) for s in subnets],
+                         [("prod", "subnet-a"), ("prod", "subnet-b"), ("stage", "subnet-c")])
+        a, b, c = subnets
+        self.assertEqual(a, collector.Subnet(
+            "prod", REGION, "vpc-1", "subnet-a", "app-a", "ap-southeast-1a", "10.0.0.0/24", 256, 5, 51, 200
+        ))
+        # a /28 of 16 addresses, 5 taken by aws and 3 left
+        self.assertEqual((b.total_ips, b.used_ips, b.free_ips, b.name), (16, 8, 3, ""))
+        self.assertEqual((c.vpc_id, c.used_ips), ("vpc-2", 0))
+        self.assertIn("listed 2 subnets of prod in ap-southeast-1", errors)
+
+    def test_failing_target_is_left_out(self):
+        self.stub("prod").add_client_error(
+            "describe_subnets", "UnauthorizedOperation", "not allowed", expected_params=PAGE
+        )
+        self.stub("stage").add_response(
+            "describe_subnets", {"Subnets": [subnet("subnet-c", "10.1.0.0/26", 59)]}, PAGE
+        )
+        # no client at all, as for a profile missing from the config
+        subnets, errors = self.collect(collector.new_targets(["prod", "expired", "stage"], [REGION]))
+        self.assertEqual([(s.profile, s.subnet_id) for s in subnets], [("stage", "subnet-c")])
+        self.assertIn("failed to list subnets of prod in ap-southeast-1", errors)
+        self.assertIn("failed to list subnets of expired in ap-southeast-1", errors)
+
+    def test_collect_vpcs(self):
+        prod = self.stub("prod")
+        prod.add_response("describe_vpcs", {"Vpcs": [{
+            "VpcId": "vpc-1", "CidrBlock": "10.0.0.0/16", "Tags": [{"Key": "Name", "Value": "main"}],
+            "CidrBlockAssociationSet": [
+                {"CidrBlock": "10.0.0.0/16", "CidrBlockState": {"State": "associated"}},
+                {"CidrBlock": "100.64.0.0/16", "CidrBlockState": {"State": "associated"}},
+                {"CidrBlock": "10.9.0.0/16", "CidrBlockState": {"State": "disassociated"}},
+            ],
+        }], "NextToken": "page-2"}, PAGE)
+        prod.add_response(
+            "describe_vpcs", {"Vpcs": [{"VpcId": "vpc-2", "CidrBlock": "10.1.0.0/16"}]}, dict(PAGE, NextToken="page-2")
+        )
+        vpcs, _ = self.collect(collector.new_targets(["prod"], [REGION]), collector.collect_vpcs)
+        self.assertEqual(vpcs, [
+            collector.Vpc("prod", REGION, "vpc-1", "main", ("10.0.0.0/16", "100.64.0.0/16")),
+            collector.Vpc("prod", REGION, "vpc-2", "", ("10.1.0.0/16",)),
+        ])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,177 @@
+import datetime
+import json
+import os
+import re
+from collections import namedtuple
+
+import numpy as np
+from dateutil.tz import tzutc
+
+EXPIRY_WARNING_DAYS = 15
+# size units per instance size, the engines reservations are size flexible for and
+# engine name aliases, see normalization.json
+NORMALIZATION_FILE = os.path.join(os.path.dirname(__file__), "normalization.json")
+# sizes missing from the table still get their units from the xlarge multiple
+XLARGE_SIZE_PATTERN = re.compile(r"^(\d+)xlarge$")
+
+# one row per running instance or reservation, as parallel numpy columns. family is
+# e.g. db.r5 for size flexible engines and the whole class otherwise, units are
+# counted in instances of count_size, so a multi az db.r5.xlarge is 4 db.r5.large
+UnitTable = namedtuple("UnitTable", ["engine", "family", "region", "units"])
+# one row per engine, family and region, coverage is the share of running units
+# covered by a reservation and utilization the share of reserved units in use
+CoverageTable = namedtuple(
+    "CoverageTable", ["engine", "family", "region", "running", "reserved", "covered", "coverage", "utilization"]
+)
+
+
+def load_normalization(path=None):
+    with open(path or NORMALIZATION_FILE) as f:
+        return json.load(f)
+
+
+def normalized_engine(name, normalization=None):
+    normalization = normalization or load_normalization()
+    return normalization["engine_aliases"].get(name, name)
+
+
+def size_units(size, normalization):
+    units = normalization["size_units"].get(size)
+    if units is None:
+        m = XLARGE_SIZE_PATTERN.match(size)
+        if m is not None:
+            units = int(m.group(1)) * normalization["size_units"]["xlarge"]
+    return units
+
+
+def normalize(engines, classes, regions, counts, multi_az, normalization=None):
+    # engines and classes are only looked at once per distinct value, every row after
+    # that is array arithmetic, which keeps an organization wide fleet cheap
+    normalization = normalization or load_normalization()
+    count_units = normalization["size_units"][normalization["count_size"]]
+    flexible_engines = set(normalization["size_flexible_engines"])
+
+    engine_values, engine_index = np.unique(np.asarray(engines, dtype=str), return_inverse=True)
+    engine_names = np.array([normalized_engine(str(e), normalization) for e in engine_values], dtype=object)
+    engine_flexible = np.array([e in flexible_engines for e in engine_names], dtype=bool)
+
+    class_values, class_index = np.unique(np.asarray(classes, dtype=str), return_inverse=True)
+    class_families = np.empty(len(class_values), dtype=object)
+    class_factors = np.full(len(class_values), np.nan)
+    for n, db_instance_class in enumerate(class_values):
+        parts = db_instance_class.split(".")
+        units = size_units(parts[2], normalization) if len(parts) == 3 else None
+        if units is None:
+            # an unknown size only ever matches reservations of exactly the same class
+            print(f"no size units for {db_instance_class}, counting it without size flexibility")
+            class_families[n] = db_instance_class
+        else:
+            class_families[n] = f"{parts[0]}.{parts[1]}"
+            class_factors[n] = units / count_units
+
+    flexible = engine_flexible[engine_index] & ~np.isnan(class_factors[class_index])
+    family = np.where(flexible, class_families[class_index], class_values[class_index].astype(object))
+    units = (
+        np.asarray(counts, dtype=float)
+        * np.where(np.asarray(multi_az, dtype=bool), 2.0, 1.0)
+        * np.where(flexible, class_factors[class_index], 1.0)
+    )
+    return UnitTable(engine_names[engine_index], family, np.asarray(regions, dtype=object), units)
+
+
+def instance_table(instances, normalization=None):
+    # instances are (profile, region, DBInstance) from every swept account
+    engines, classes, regions, multi_az = [], [], [], []
+    for _, region, i in instances:
+        if i["DBInstanceStatus"] != "available":
+            continue
+        if not i["AvailabilityZone"].startswith(region):
+            continue
+        if i["DBInstanceClass"] == "db.serverless":
+            continue
+        engines.append(i["Engine"])
+        classes.append(i["DBInstanceClass"])
+        regions.append(region)
+        multi_az.append(i["MultiAZ"])
+    return normalize(engines, classes, regions, np.ones(len(engines)), multi_az, normalization)
+
+
+def _active_reservations(reservations):
+    # the same reservation can come back from two profiles of one payer account
+    seen = set()
+    for _, region, ri in reservations:
+        if ri["State"] == "retired" or ri["ReservedDBInstanceId"] in seen:
+            continue
+        seen.add(ri["ReservedDBInstanceId"])
+        yield region, ri
+
+
+def reservation_table(reservations, normalization=None):
+    engines, classes, regions, counts, multi_az = [], [], [], [], []
+    for region, ri in _active_reservations(reservations):
+        engines.append(ri["ProductDescription"])
+        classes.append(ri["DBInstanceClass"])
+        regions.append(region)
+        counts.append(ri["DBInstanceCount"])
+        multi_az.append(ri["MultiAZ"])
+    return normalize(engines, classes, regions, counts, multi_az, normalization)
+
+
+def reservation_expiries(reservations, normalization=None):
+    # the active reservations with their normalised units and expiry, as
+    # (ids, engine, family, region, units, expires_at) columns
+    ids, expires_at = [], []
+    for _, ri in _active_reservations(reservations):
+        ids.append(ri["ReservedDBInstanceId"])
+        expires_at.append(ri["StartTime"] + datetime.timedelta(seconds=ri["Duration"]))
+    table = reservation_table(reservations, normalization)
+    return ids, table.engine, table.family, table.region, table.units, expires_at
+
+
+def expiring_reservations(reservations, now=None, expiry_warning_days=EXPIRY_WARNING_DAYS):
+    now = now or datetime.datetime.utcnow().replace(tzinfo=tzutc())
+    soon_expire_ri = {}
+    for region, ri in _active_reservations(reservations):
+        expire_time = ri["StartTime"] + datetime.timedelta(seconds=ri["Duration"])
+        if (expire_time - now) < datetime.timedelta(days=expiry_warning_days):
+            soon_expire_ri[ri["ReservedDBInstanceId"]] = (ri["DBInstanceClass"], ri["ProductDescription"], region, expire_time)
+    return soon_expire_ri
+
+
+def group_index(*columns):
+    # one integer group per distinct combination of the columns, without a python loop
+    codes = np.zeros(len(columns[0]), dtype=np.int64)
+    for column in columns:
+        values, index = np.unique(column.astype(str), return_inverse=True)
+        codes = codes * len(values) + index
+    _, first, group = np.unique(codes, return_index=True, return_inverse=True)
+    return first, group
+
+
+def coverage(running_table, reserved_table):
+    engine = np.concatenate([running_table.engine, reserved_table.engine])
+    family = np.concatenate([running_table.family, reserved_table.family])
+    region = np.concatenate([running_table.region, reserved_table.region])
+    is_running = np.arange(len(engine)) < len(running_table.engine)
+    units = np.concatenate([running_table.units, reserved_table.units])
+    if not len(engine):
+        empty = np.array([], dtype=float)
+        return CoverageTable(empty.astype(object), empty.astype(object), empty.astype(object), *[empty] * 5)
+
+    first, group = group_index(engine, family, region)
+    running = np.bincount(group, weights=np.where(is_running, units, 0.0), minlength=len(first))
+    reserved = np.bincount(group, weights=np.where(is_running, 0.0, units), minlength=len(first))
+    covered = np.minimum(running, reserved)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        coverage_ratio = np.where(running > 0, covered / running, np.nan)
+        utilization = np.where(reserved > 0, covered / reserved, np.nan)
+    return CoverageTable(engine[first], family[first], region[first], running, reserved, covered, coverage_ratio, utilization)
+
+
+def counts(coverage_table, values):
+    # {(engine, family, region): value} for the rows where values is above zero
+    return {
+        (e, f, r): float(v)
+        for e, f, r, v in zip(coverage_table.engine, coverage_table.family, coverage_table.region, values)
+        if v > 0
+    }
@@ -0,0 +1,144 @@
+import datetime
+import os
+import sqlite3
+from collections import namedtuple
+
+import numpy as np
+
+from pkg import coverage
+
+DEFAULT_HISTORY_PATH = "ri-history.sqlite"
+FORECAST_MONTHS = 6
+# fleet growth is fitted over this many days of snapshots
+GROWTH_DAYS = 90
+DAYS_PER_MONTH = 30
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS daily_coverage (
+    day TEXT NOT NULL,
+    engine TEXT NOT NULL,
+    family TEXT NOT NULL,
+    region TEXT NOT NULL,
+    running REAL NOT NULL,
+    reserved REAL NOT NULL,
+    covered REAL NOT NULL,
+    PRIMARY KEY (day, engine, family, region)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS reservation (
+    reserved_db_instance_id TEXT PRIMARY KEY,
+    engine TEXT NOT NULL,
+    family TEXT NOT NULL,
+    region TEXT NOT NULL,
+    units REAL NOT NULL,
+    expires_at TEXT NOT NULL,
+    last_seen TEXT NOT NULL
+);
+"""
+
+# one row per engine, family and region of the latest snapshot. growth is the fitted
+# change in running units per day, the *_forecast and uncovered columns are arrays
+# with one value per month from the snapshot
+ForecastRow = namedtuple(
+    "ForecastRow", ["key", "running", "reserved", "growth", "running_forecast", "reserved_forecast", "uncovered"]
+)
+
+
+def open_history(path=DEFAULT_HISTORY_PATH):
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    return History(sqlite3.connect(path))
+
+
+class History:
+    # one compact row per engine, family, region and day, so a year of an organization's
+    # daily snapshots is a few hundred thousand rows
+    def __init__(self, conn):
+        self.conn = conn
+        self.conn.executescript(SCHEMA)
+
+    def save_day(self, day, coverage_table, reservations, normalization=None):
+        # a second run on the same day replaces that day's snapshot
+        ids, engines, families, regions, units, expires_at = coverage.reservation_expiries(reservations, normalization)
+        with self.conn:
+            self.conn.execute("DELETE FROM daily_coverage WHERE day = ?", (day,))
+            self.conn.executemany(
+                "INSERT INTO daily_coverage VALUES (?, ?, ?, ?, ?, ?, ?)",
+                zip(
+                    [day] * len(coverage_table.engine), map(str, coverage_table.engine), map(str, coverage_table.family),
+                    map(str, coverage_table.region), map(float, coverage_table.running),
+                    map(float, coverage_table.reserved), map(float, coverage_table.covered),
+                )
+            )
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO reservation VALUES (?, ?, ?, ?, ?, ?, ?)",
+                zip(
+                    ids, map(str, engines), map(str, families), map(str, regions), map(float, units),
+                    [e.astimezone(datetime.timezone.utc).isoformat() for e in expires_at], [day] * len(ids),
+                )
+            )
+
+    def latest_day(self):
+        return self.conn.execute("SELECT MAX(day) FROM daily_coverage").fetchone()[0]
+
+    def coverage_trend(self, start_day, end_day):
+        # [(day, running, reserved, covered)] summed over the whole fleet, oldest first
+        return self.conn.execute(
+            "SELECT day, SUM(running), SUM(reserved), SUM(covered) FROM daily_coverage"
+            " WHERE day BETWEEN ? AND ? GROUP BY day ORDER BY day",
+            (start_day, end_day)
+        ).fetchall()
+
+    def running_growth(self, end_day, days=GROWTH_DAYS):
+        # least squares slope of the daily running units of every group, in units per day.
+        # sqlite sums what the fit needs, so only one row per group comes back
+        start_day = (datetime.date.fromisoformat(end_day) - datetime.timedelta(days=days)).isoformat()
+        rows = self.conn.execute(
+            "SELECT engine, family, region, COUNT(*), SUM(x), SUM(running), SUM(x * x), SUM(x * running)"
+            " FROM (SELECT *, julianday(day) - julianday(?) AS x FROM daily_coverage WHERE day BETWEEN ? AND ?)"
+            " GROUP BY engine, family, region",
+            (start_day, start_day, end_day)
+        ).fetchall()
+        if not rows:
+            return {}
+        n, sx, sy, sxx, sxy = (np.array(column, dtype=float) for column in list(zip(*rows))[3:])
+        denominator = n * sxx - sx * sx
+        with np.errstate(divide="ignore", invalid="ignore"):
+            slope = np.where(denominator > 0, (n * sxy - sx * sy) / denominator, 0.0)
+        return {(engine, family, region): float(g) for (engine, family, region, *_), g in zip(rows, slope)}
+
+    def forecast(self, months=FORECAST_MONTHS, growth_days=GROWTH_DAYS):
+        # projects every group of the latest snapshot month by month: running units grow
+        # along the fitted trend, reserved units drop as their reservations expire
+        day = self.latest_day()
+        if day is None:
+            return day, []
+        start = datetime.datetime.fromisoformat(day).replace(tzinfo=datetime.timezone.utc)
+        growth = self.running_growth(day, growth_days)
+        offsets = np.arange(1, months + 1) * DAYS_PER_MONTH
+        horizons = [(start + datetime.timedelta(days=int(o))).isoformat() for o in offsets]
+
+        expiring = {}
+        rows = self.conn.execute(
+            "SELECT engine, family, region, units, expires_at FROM reservation WHERE last_seen = ?", (day,)
+        )
+        for engine, family, region, units, expires_at in rows:
+            still_reserved = np.array([expires_at > h for h in horizons], dtype=float) * units
+            key = (engine, family, region)
+            expiring[key] = expiring.get(key, 0.0) + still_reserved
+
+        forecast = []
+        rows = self.conn.execute(
+            "SELECT engine, family, region, running, reserved FROM daily_coverage WHERE day = ?", (day,)
+        )
+        for engine, family, region, running, reserved in rows:
+            key = (engine, family, region)
+            running_forecast = np.maximum(running + growth.get(key, 0.0) * offsets, 0.0)
+            reserved_forecast = expiring.get(key, np.zeros(months))
+            uncovered = running_forecast - np.minimum(running_forecast, reserved_forecast)
+            forecast.append(
+                ForecastRow(key, running, reserved, growth.get(key, 0.0), running_forecast, reserved_forecast, uncovered)
+            )
+        return day, forecast
+
+    def close(self):
+        self.conn.close()
@@ -0,0 +1,79 @@
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+SWEEP_WORKERS = 8
+
+# instances are read with profile, reservations with ri_profile, usually the payer
+# account since reservations there apply to every linked account
+Target = namedtuple("Target", ["profile", "ri_profile", "region"])
+# instances are (profile, region, DBInstance), reservations (ri_profile, region, ReservedDBInstance)
+Inventory = namedtuple("Inventory", ["instances", "reservations"])
+
+
+def new_targets(profiles, regions, ri_profile=None):
+    # every account in every region, with ri_profile falling back to the account itself
+    return [Target(profile, ri_profile or profile, region) for profile in profiles for region in regions]
+
+
+def new_rds_client(profile, region):
+    import boto3
+
+    return boto3.Session(region_name=region, profile_name=profile).client("rds")
+
+
+def paginate(rds_client, operation, result_key):
+    # describe calls return at most 100 records, anything after that is on later pages
+    items = []
+    for page in rds_client.get_paginator(operation).paginate():
+        items.extend(page[result_key])
+    return items
+
+
+def get_db_instances(rds_client):
+    return paginate(rds_client, "describe_db_instances", "DBInstances")
+
+
+def get_reserved_db_instances(rds_client):
+    return paginate(rds_client, "describe_reserved_db_instances", "ReservedDBInstances")
+
+
+def new_inventory_cache(ttl=None):
+    # the snapshots are shared with the other rds tools, see rds-inventory
+    from rds_inventory import cache
+
+    return cache.new_inventory_cache(ttl=ttl)
+
+
+def sweep(targets, client_factory=new_rds_client, workers=SWEEP_WORKERS, inventory_cache=None):
+    # every account and region is listed in parallel, client_factory(profile, region) can
+    # hand out recorded clients to run offline. Reservations are only listed once per
+    # ri_profile and region, however many accounts share them. With inventory_cache a
+    # fresh snapshot is used instead of aws, and no client is even created for it
+    ri_targets = sorted({(t.ri_profile, t.region) for t in targets})
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        instance_futures = [
+            (t, pool.submit(_list, client_factory, inventory_cache, t.profile, t.region, get_db_instances))
+            for t in targets
+        ]
+        ri_futures = [
+            (ri_target, pool.submit(_list, client_factory, inventory_cache, *ri_target, get_reserved_db_instances))
+            for ri_target in ri_targets
+        ]
+        instances = []
+        for t, f in instance_futures:
+            listed = f.result()
+            print(f"listed {len(listed)} db instances of {t.profile} in {t.region}")
+            instances.extend((t.profile, t.region, i) for i in listed)
+        reservations = []
+        for (ri_profile, region), f in ri_futures:
+            listed = f.result()
+            print(f"listed {len(listed)} reserved db instances of {ri_profile} in {region}")
+            reservations.extend((ri_profile, region, ri) for ri in listed)
+    return Inventory(instances, reservations)
+
+
+def _list(client_factory, inventory_cache, profile, region, list_function):
+    if inventory_cache is None:
+        return list_function(client_factory(profile, region))
+    operation = list_function.__name__.replace("get_", "describe_", 1)
+    return inventory_cache.get(profile, region, operation, lambda: list_function(client_factory(profile, region)))
@@ -0,0 +1,96 @@
+import datetime
+import json
+import os
+import threading
+
+# describe responses of every profile and region are kept page by page in
+# <directory>/<profile>-<region>.json, so a sweep can be recorded once against aws and
+# replayed offline afterwards, paginators included
+OPERATIONS = ["describe_db_instances", "describe_reserved_db_instances"]
+
+
+def recording_path(directory, profile, region):
+    return os.path.join(directory, f"{profile}-{region}.json")
+
+
+def _encode(value):
+    if isinstance(value, datetime.datetime):
+        return {"__datetime__": value.isoformat()}
+    raise TypeError(f"can't record {type(value)}")
+
+
+def _decode(value):
+    if "__datetime__" in value:
+        return datetime.datetime.fromisoformat(value["__datetime__"])
+    return value
+
+
+def new_recorded_client_factory(directory):
+    def client_factory(profile, region):
+        with open(recording_path(directory, profile, region)) as f:
+            return RecordedRDSClient(json.load(f, object_hook=_decode))
+    return client_factory
+
+
+def new_recording_client_factory(directory, client_factory):
+    # wraps a live client_factory, every page it returns is also written to directory
+    os.makedirs(directory, exist_ok=True)
+    recordings = {}
+    lock = threading.Lock()
+
+    def recording_client_factory(profile, region):
+        path = recording_path(directory, profile, region)
+        with lock:
+            recording = recordings.setdefault(path, {})
+        return RecordingRDSClient(client_factory(profile, region), recording, path, lock)
+    return recording_client_factory
+
+
+class RecordedRDSClient:
+    def __init__(self, pages):
+        self.pages = pages
+
+    def get_paginator(self, operation):
+        return RecordedPaginator(self.pages.get(operation, []))
+
+
+class RecordedPaginator:
+    def __init__(self, pages):
+        self.pages = pages
+
+    def paginate(self, **kwargs):
+        return iter(self.pages)
+
+
+class RecordingRDSClient:
+    def __init__(self, rds_client, recording, path, lock):
+        self.rds_client = rds_client
+        self.recording = recording
+        self.path = path
+        self.lock = lock
+
+    def get_paginator(self, operation):
+        return RecordingPaginator(self, operation, self.rds_client.get_paginator(operation))
+
+    def save(self, operation, pages):
+        # the instance and reservation listings of a profile and region can run at the same time
+        with self.lock:
+            self.recording[operation] = pages
+            with open(f"{self.path}-new", "w") as f:
+                json.dump(self.recording, f, default=_encode)
+            os.replace(f"{self.path}-new", self.path)
+
+
+class RecordingPaginator:
+    def __init__(self, client, operation, paginator):
+        self.client = client
+        self.operation = operation
+        self.paginator = paginator
+
+    def paginate(self, **kwargs):
+        pages = []
+        for page in self.paginator.paginate(**kwargs):
+            page = {k: v for k, v in page.items() if k != "ResponseMetadata"}
+            pages.append(page)
+            yield page
+        self.client.save(self.operation, pages)
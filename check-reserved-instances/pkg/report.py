@@ -0,0 +1,130 @@
+import csv
+import os
+
+from pkg import coverage
+
+
+def instance_header():
+    return "\t(%s)\t%12s\t%s\t%s" % ("Count", "Engine", "Family", "Region")
+
+
+def _print_counts(title, counts):
+    print(title)
+    print(instance_header())
+    for k, v in sorted(counts.items(), key=lambda x: x[0]):
+        print("\t(%s)\t%12s\t%s\t%s" % (round(v, 2), k[0], k[1], k[2]))
+    if not counts:
+        print("\tNone")
+    print("")
+
+
+def _percent(ratio):
+    return "-" if ratio != ratio else "%.0f%%" % (ratio * 100)
+
+
+def print_report(coverage_table, soon_expire_ri, expiry_warning_days, count_size="large"):
+    # counts are in size flexible units of one <family>.<count_size> instance, multi az counting twice
+    running_instances = coverage.counts(coverage_table, coverage_table.running)
+    reserved_instances = coverage.counts(coverage_table, coverage_table.reserved)
+    print("Counts are in %s instances of each family, multi-AZ counts twice" % count_size)
+    print("")
+    _print_counts("Reserved RDS instances:", reserved_instances)
+    _print_counts("Unused reserved RDS instances:", coverage.counts(coverage_table, coverage_table.reserved - coverage_table.covered))
+
+    print("Expiring soon (less than %sd) reserved RDS instances:" % expiry_warning_days)
+    for k, v in sorted(soon_expire_ri.items(), key=lambda x: x[1][:2]):
+        print("\t%s\t%12s\t%s\t%s\t%s" % (k, v[0], v[1], v[2], v[3].strftime("%Y-%m-%d")))
+    if not soon_expire_ri:
+        print("\tNone")
+    print("")
+
+    _print_counts(
+        "On-demand RDS instances, which haven't got a reserved RDS instance:",
+        coverage.counts(coverage_table, coverage_table.running - coverage_table.covered)
+    )
+    _print_counts("Total Running RDS instances:", running_instances)
+
+    print("Coverage and utilization of reserved RDS instances:")
+    print("\t%12s\t%s\t%s\t%s\t%s\t%s\t%s" % ("Engine", "Family", "Region", "Running", "Reserved", "Coverage", "Utilization"))
+    rows = zip(*coverage_table)
+    for engine, family, region, running, reserved, _, coverage_ratio, utilization in sorted(rows, key=lambda x: x[:3]):
+        print("\t%12s\t%s\t%s\t%s\t%s\t%s\t%s" % (
+            engine, family, region, round(running, 2), round(reserved, 2), _percent(coverage_ratio), _percent(utilization)
+        ))
+    if not len(coverage_table.engine):
+        print("\tNone")
+    print("")
+
+    total_running = coverage_table.running.sum()
+    total_reserved = coverage_table.reserved.sum()
+    total_covered = coverage_table.covered.sum()
+    print("Running on-demand RDS instances: %s" % round(total_running, 2))
+    print("Reserved RDS instances:          %s" % round(total_reserved, 2))
+    print("Coverage:                        %s" % _percent(total_covered / total_running if total_running else float("nan")))
+    print("Utilization:                     %s" % _percent(total_covered / total_reserved if total_reserved else float("nan")))
+    print("")
+
+
+def print_forecast(day, forecast, trend=None):
+    # forecast is history.forecast() output, trend an optional history.coverage_trend()
+    if trend:
+        first, last = trend[0], trend[-1]
+        print("Coverage from %s to %s: %s -> %s, running %s -> %s" % (
+            first[0], last[0], _percent(first[3] / first[1] if first[1] else float("nan")),
+            _percent(last[3] / last[1] if last[1] else float("nan")), round(first[1], 2), round(last[1], 2)
+        ))
+        print("")
+    if not forecast:
+        print("No snapshot to forecast from")
+        return
+    months = len(forecast[0].uncovered)
+    print("Forecast of on-demand RDS instances from %s, by month:" % day)
+    print("\t%12s\t%s\t%s\t%s\t%s\t%s" % (
+        "Engine", "Family", "Region", "Growth/30d", "Now", "\t".join("+%sm" % (m + 1) for m in range(months))
+    ))
+    for row in sorted(forecast, key=lambda r: -r.uncovered[-1]):
+        print("\t%12s\t%s\t%s\t%s\t%s\t%s" % (
+            row.key[0], row.key[1], row.key[2], round(row.growth * 30, 2),
+            round(row.running - min(row.running, row.reserved), 2), "\t".join(str(round(u, 2)) for u in row.uncovered)
+        ))
+    totals = sum(row.uncovered for row in forecast)
+    print("\t%12s\t%s\t%s\t%s\t%s\t%s" % (
+        "Total", "", "", "", round(sum(row.running - min(row.running, row.reserved) for row in forecast), 2),
+        "\t".join(str(round(u, 2)) for u in totals)
+    ))
+    print("")
+
+
+def write_instance_csv(instances, output_dir="."):
+    # one <region>-rds-list.csv per region, with the instances of every swept account
+    by_region = {}
+    for profile, region, rds in instances:
+        by_region.setdefault(region, []).append((profile, rds))
+    for region, region_instances in by_region.items():
+        with open(os.path.join(output_dir, f"{region}-rds-list.csv"), "w", newline="") as f:
+            csv_file = csv.writer(f)
+            csv_file.writerow(
+                [
+                    "Name",
+                    "Status",
+                    "Engine",
+                    "Version",
+                    "MultiAZ",
+                    "Class",
+                    "ClassType",
+                    "Profile",
+                ]
+            )
+            for profile, rds in region_instances:
+                csv_file.writerow(
+                    [
+                        rds["DBInstanceIdentifier"],
+                        rds["DBInstanceStatus"],
+                        rds["Engine"],
+                        rds["EngineVersion"],
+                        rds["MultiAZ"],
+                        rds["DBInstanceClass"],
+                        rds["DBInstanceClass"].split(".")[1],
+                        profile,
+                    ]
+                )
@@ -0,0 +1,105 @@
+import contextlib
+import datetime
+import importlib.util
+import io
+import os
+import tempfile
+import unittest
+
+import numpy as np
+from dateutil.tz import tzutc
+
+from pkg import coverage, inventory, recorded
+
+# usage: python -m unittest discover tests
+# tests/recording holds the describe pages of two accounts in one region, as --record writes
+# them. Both accounts see the same postgres reservation, as linked accounts of one payer do
+RECORDING_DIR = os.path.join(os.path.dirname(__file__), "recording")
+REGION = "ap-southeast-1"
+
+
+def counting_client_factory(calls):
+    client_factory = recorded.new_recorded_client_factory(RECORDING_DIR)
+
+    def factory(profile, region):
+        calls.append((profile, region))
+        return client_factory(profile, region)
+    return factory
+
+
+class SweepTest(unittest.TestCase):
+    def sweep(self, ri_profile=None):
+        self.calls = []
+        targets = inventory.new_targets(["prod", "stage"], [REGION], ri_profile)
+        return inventory.sweep(targets, counting_client_factory(self.calls), workers=2)
+
+    def test_pages_and_targets_are_merged(self):
+        swept = self.sweep()
+        self.assertEqual(
+            [(p, r, i["DBInstanceIdentifier"]) for p, r, i in swept.instances],
+            [("prod", REGION, "orders"), ("prod", REGION, "users"), ("prod", REGION, "billing"),
+             ("prod", REGION, "archive"), ("prod", REGION, "reports"), ("stage", REGION, "stage-orders")]
+        )
+        self.assertEqual(
+            [(p, ri["ReservedDBInstanceId"]) for p, _, ri in swept.reservations],
+            [("prod", "ri-postgres"), ("prod", "ri-retired"), ("prod", "ri-mysql"),
+             ("stage", "ri-postgres"), ("stage", "ri-sqlserver")]
+        )
+
+    def test_reservations_listed_once_per_ri_profile(self):
+        swept = self.sweep(ri_profile="prod")
+        self.assertEqual(sorted(self.calls), [("prod", REGION), ("prod", REGION), ("stage", REGION)])
+        self.assertEqual([ri["ReservedDBInstanceId"] for _, _, ri in swept.reservations],
+                         ["ri-postgres", "ri-retired", "ri-mysql"])
+
+    def test_coverage(self):
+        swept = self.sweep()
+        table = coverage.coverage(coverage.instance_table(swept.instances), coverage.reservation_table(swept.reservations))
+        rows = {
+            (e, f, r): (running, reserved, covered)
+            for e, f, r, running, reserved, covered in zip(
+                table.engine, table.family, table.region, table.running, table.reserved, table.covered
+            )
+        }
+        self.assertEqual(rows, {
+            # orders is a multi az xlarge, 4 large, plus users and stage-orders. ri-postgres counts
+            # once however many accounts list it, the retired one not at all
+            ("postgresql", "db.r5", REGION): (6.0, 4.0, 4.0),
+            # a 2xlarge against one xlarge reservation
+            ("mysql", "db.r5", REGION): (4.0, 2.0, 2.0),
+            # sqlserver isn't size flexible, it stays its own class
+            ("sqlserver-se(li)", "db.m5.large", REGION): (0.0, 1.0, 0.0),
+        })
+        coverage_ratio = dict(zip(table.engine, table.coverage))
+        self.assertAlmostEqual(coverage_ratio["postgresql"], 4 / 6)
+        self.assertTrue(np.isnan(coverage_ratio["sqlserver-se(li)"]))
+
+    def test_expiring_reservations(self):
+        swept = self.sweep()
+        now = datetime.datetime(2022, 12, 25, tzinfo=tzutc())
+        self.assertEqual(sorted(coverage.expiring_reservations(swept.reservations, now)),
+                         ["ri-mysql", "ri-postgres", "ri-sqlserver"])
+        self.assertEqual(coverage.expiring_reservations(swept.reservations, now - datetime.timedelta(days=60)), {})
+
+
+class ReplayTest(unittest.TestCase):
+    def test_main_replays_offline(self):
+        spec = importlib.util.spec_from_file_location(
+            "check_rds_ri", os.path.join(os.path.dirname(__file__), "..", "check-rds-ri.py")
+        )
+        check_rds_ri = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(check_rds_ri)
+        with tempfile.TemporaryDirectory() as output_dir:
+            output = io.StringIO()
+            with contextlib.redirect_stdout(output):
+                check_rds_ri.main([
+                    "--profile", "prod,stage", "--region", REGION, "--replay", RECORDING_DIR, "--no-history",
+                    "--output-dir", output_dir,
+                ])
+            self.assertTrue(os.path.exists(os.path.join(output_dir, f"{REGION}-rds-list.csv")))
+        self.assertIn("listed 5 db instances of prod in ap-southeast-1", output.getvalue())
+        self.assertIn("(1.0)\tsqlserver-se(li)\tdb.m5.large", output.getvalue())
+
+
+if __name__ == "__main__":
+    unittest.main()
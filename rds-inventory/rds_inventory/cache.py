@@ -0,0 +1,99 @@
+import datetime
+import fcntl
+import json
+import os
+import time
+
+# snapshots live in $RDS_INVENTORY_CACHE_DIR, one json file per profile, region and
+# describe call, and are served for $RDS_INVENTORY_TTL seconds before aws is asked again
+DEFAULT_CACHE_DIR = os.environ.get(
+    "RDS_INVENTORY_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "rds-inventory")
+)
+DEFAULT_TTL = int(os.environ.get("RDS_INVENTORY_TTL", "900"))
+DB_INSTANCES = "describe_db_instances"
+RESERVED_DB_INSTANCES = "describe_reserved_db_instances"
+RESULT_KEYS = {
+    DB_INSTANCES: "DBInstances",
+    RESERVED_DB_INSTANCES: "ReservedDBInstances",
+}
+
+
+def new_inventory_cache(cache_dir=None, ttl=None):
+    return InventoryCache(os.path.expanduser(cache_dir or DEFAULT_CACHE_DIR), DEFAULT_TTL if ttl is None else ttl)
+
+
+def paginate(rds_client, operation):
+    items = []
+    for page in rds_client.get_paginator(operation).paginate():
+        items.extend(page[RESULT_KEYS[operation]])
+    return items
+
+
+def _encode(value):
+    if isinstance(value, datetime.datetime):
+        return {"__datetime__": value.isoformat()}
+    raise TypeError(f"can't store {type(value)} in an inventory snapshot")
+
+
+def _decode(value):
+    if "__datetime__" in value:
+        return datetime.datetime.fromisoformat(value["__datetime__"])
+    return value
+
+
+class InventoryCache:
+    # a ttl of 0 always goes to aws but still refreshes the snapshot for the other tools.
+    # Once read, a snapshot is kept for the life of the cache, so every step of one run
+    # sees the same instances
+    def __init__(self, cache_dir, ttl):
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.snapshots = {}
+
+    def snapshot_path(self, profile, region, operation):
+        return os.path.join(self.cache_dir, f"{profile or 'default'}-{region or 'default'}-{operation}.json")
+
+    def _load(self, path):
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path) as f:
+                snapshot = json.load(f, object_hook=_decode)
+        except ValueError:
+            print(f"ignoring unreadable inventory snapshot {path}")
+            return None
+        if time.time() - snapshot["fetched_at"] > self.ttl:
+            return None
+        return snapshot
+
+    def get(self, profile, region, operation, fetch):
+        # fetch() is only called when there is no fresh snapshot. The lock makes tools that
+        # run at the same time wait for one fetch instead of each calling aws
+        path = self.snapshot_path(profile, region, operation)
+        snapshot = self.snapshots.get(path)
+        if snapshot is not None:
+            return snapshot["items"]
+        os.makedirs(self.cache_dir, exist_ok=True)
+        with open(f"{path}.lock", "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            snapshot = self._load(path)
+            if snapshot is None:
+                snapshot = {"fetched_at": time.time(), "items": fetch()}
+                with open(f"{path}-new", "w") as f:
+                    json.dump(snapshot, f, default=_encode)
+                os.replace(f"{path}-new", path)
+                print(f"saved {len(snapshot['items'])} {RESULT_KEYS.get(operation, operation)} of {profile} in {region} to {path}")
+        self.snapshots[path] = snapshot
+        return snapshot["items"]
+
+    def db_instances(self, rds_client, profile, region):
+        return self.get(profile, region, DB_INSTANCES, lambda: paginate(rds_client, DB_INSTANCES))
+
+    def reserved_db_instances(self, rds_client, profile, region):
+        return self.get(profile, region, RESERVED_DB_INSTANCES, lambda: paginate(rds_client, RESERVED_DB_INSTANCES))
+
+    def invalidate(self, profile, region, operation=DB_INSTANCES):
+        path = self.snapshot_path(profile, region, operation)
+        self.snapshots.pop(path, None)
+        if os.path.exists(path):
+            os.remove(path)
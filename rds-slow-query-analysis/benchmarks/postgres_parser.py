@@ -0,0 +1,128 @@
+import os
+import random
+import re
+import resource
+import time
+
+from parsers import postgres
+from pkg import analysis
+
+# usage: python -m benchmarks.postgres_parser
+BENCH_LOG_FILE = os.getenv("BENCH_LOG_FILE", "./data/bench/postgresql.log")
+BENCH_LOG_SIZE_MB = int(os.getenv("BENCH_LOG_SIZE_MB", "2048"))
+# run a single benchmark in this process, peak rss is only meaningful that way
+BENCH_ONLY = os.getenv("BENCH_ONLY")
+BENCH_DATE = "2022-08-09"
+
+LOG_LINES = [
+    BENCH_DATE + " 04:00:{s:02d} UTC:10.0.{a}.{b}(5432):app@orders:[1234]:LOG:  duration: {d:.3f} ms  statement: SELECT * FROM orders WHERE id = {b}\n",
+    BENCH_DATE + " 04:00:{s:02d} UTC:10.0.{a}.{b}(5432):pgwatch_monitor@orders:[1234]:LOG:  duration: {d:.3f} ms  statement: SELECT 1\n",
+    BENCH_DATE + " 04:00:{s:02d} UTC:10.0.{a}.{b}(5432):app@orders:[1234]:LOG:  connection authorized: user=app database=orders\n",
+    BENCH_DATE + " 04:00:{s:02d} UTC:10.0.{a}.{b}(5432):app@orders:[1234]:LOG:  checkpoint complete: wrote {b} buffers\n",
+    "\tAND created_at > now() - interval '1 day'\n",
+]
+
+
+def generate_log_file(path, size_mb):
+    if os.path.exists(path) and os.path.getsize(path) >= size_mb * 1024 * 1024:
+        print(f"reusing {path}")
+        return
+    if not os.path.exists(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    print(f"generating {size_mb}MB synthetic log at {path}")
+    rnd = random.Random(42)
+    block = "".join(
+        rnd.choice(LOG_LINES).format(s=rnd.randint(0, 59), a=rnd.randint(0, 255), b=rnd.randint(0, 255), d=rnd.uniform(0, 200))
+        for _ in range(10000)
+    ).encode("utf-8")
+    written = 0
+    with open(path, "wb") as fp:
+        while written < size_mb * 1024 * 1024:
+            fp.write(block)
+            written += len(block)
+
+
+def count_lines(path):
+    lines = 0
+    with open(path, "rb") as fp:
+        for chunk in iter(lambda: fp.read(1 << 20), b""):
+            lines += chunk.count(b"\n")
+    return lines
+
+
+def bench_findall(path):
+    # per line re.findall, as parse_log_line did before the precompiled fast path
+    matched = 0
+    with open(path) as fp:
+        for line in fp:
+            if line.startswith(BENCH_DATE):
+                parsed_data = re.findall(postgres.POSTGRES_LOG_REGEX, line)
+                if len(parsed_data) and parsed_data[0][2] not in postgres.IGNORED_USERS:
+                    float(parsed_data[0][4])
+                    matched += 1
+    return matched
+
+
+def bench_parse_log_line(path):
+    matched = 0
+    with open(path) as fp:
+        for line in fp:
+            pdata = postgres.parse_log_line(BENCH_DATE, line)
+            if pdata is not None:
+                pdata.get_duration()
+                matched += 1
+    return matched
+
+
+def bench_scan_log(path):
+    matched = 0
+    with open(path, "rb") as fp:
+        for _ in postgres.scan_log(fp, BENCH_DATE):
+            matched += 1
+    return matched
+
+
+def bench_scan_log_file(path):
+    matched = 0
+    for _ in postgres.scan_log_file(path, BENCH_DATE):
+        matched += 1
+    return matched
+
+
+def bench_analyse_log_file(path):
+    _, _, fingerprints = analysis.analyse_log_file("postgres", path, BENCH_DATE)
+    fingerprints.top(10)
+    return sum(e[0] for e in fingerprints.fingerprints.values())
+
+
+def run(name, func, path, lines):
+    start = time.perf_counter()
+    matched = func(path)
+    elapsed = time.perf_counter() - start
+    # ru_maxrss is in KB on linux, it only ever grows so later runs can't report lower than earlier ones
+    max_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f"{name:<20} {matched:>12} records {elapsed:>10.2f}s {lines / elapsed:>14,.0f} lines/sec {max_rss_mb:>8.1f}MB peak rss")
+
+
+BENCHES = {
+    "findall": bench_findall,
+    "parse_log_line": bench_parse_log_line,
+    "scan_log": bench_scan_log,
+    "scan_log_file": bench_scan_log_file,
+    "analyse_log_file": bench_analyse_log_file,
+}
+
+
+if __name__ == "__main__":
+    generate_log_file(BENCH_LOG_FILE, BENCH_LOG_SIZE_MB)
+    if BENCH_ONLY:
+        lines = count_lines(BENCH_LOG_FILE)
+        run(BENCH_ONLY, BENCHES[BENCH_ONLY], BENCH_LOG_FILE, lines)
+        raise SystemExit(0)
+    lines = count_lines(BENCH_LOG_FILE)
+    print(f"{BENCH_LOG_FILE}: {lines} lines")
+    run("findall", bench_findall, BENCH_LOG_FILE, lines)
+    run("parse_log_line", bench_parse_log_line, BENCH_LOG_FILE, lines)
+    run("scan_log", bench_scan_log, BENCH_LOG_FILE, lines)
+    run("scan_log_file", bench_scan_log_file, BENCH_LOG_FILE, lines)
+    run("analyse_log_file", bench_analyse_log_file, BENCH_LOG_FILE, lines)
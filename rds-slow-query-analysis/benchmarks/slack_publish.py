@@ -0,0 +1,80 @@
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from pkg import slack
+
+# usage: python -m benchmarks.slack_publish
+# publishes through a local fake slack api that is slow and rate limits every few calls
+BENCH_MESSAGES = int(os.getenv("BENCH_MESSAGES", "50"))
+# every nth call is answered with a 429 and this Retry-After
+BENCH_RATE_LIMIT_EVERY = int(os.getenv("BENCH_RATE_LIMIT_EVERY", "10"))
+BENCH_RETRY_AFTER = os.getenv("BENCH_RETRY_AFTER", "1")
+BENCH_LATENCY_MS = float(os.getenv("BENCH_LATENCY_MS", "20"))
+BENCH_THREAD = os.getenv("BENCH_THREAD", "") != ""
+
+
+class FakeSlackHandler(BaseHTTPRequestHandler):
+    calls = 0
+    lock = threading.Lock()
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if self.path.startswith("/upload/"):
+            # where files.getUploadURLExternal sends the file, not an api call
+            return self._reply(200, {"ok": True})
+        with self.lock:
+            FakeSlackHandler.calls += 1
+            rate_limited = BENCH_RATE_LIMIT_EVERY and FakeSlackHandler.calls % BENCH_RATE_LIMIT_EVERY == 0
+        time.sleep(BENCH_LATENCY_MS / 1000)
+        if rate_limited:
+            self._reply(429, {"ok": False, "error": "ratelimited"}, {"Retry-After": BENCH_RETRY_AFTER})
+        elif self.path.endswith("/chat.postMessage"):
+            self._reply(200, {"ok": True, "ts": f"{time.time():.6f}"})
+        elif self.path.endswith("/files.getUploadURLExternal"):
+            upload_url = f"http://{self.headers['Host']}/upload/F0"
+            self._reply(200, {"ok": True, "upload_url": upload_url, "file_id": "F0"})
+        elif self.path.endswith("/files.completeUploadExternal"):
+            self._reply(200, {"ok": True, "files": [{"id": "F0"}]})
+        else:
+            self._reply(404, {"ok": False, "error": "unknown_method"})
+
+    def _reply(self, status, body, headers=None):
+        payload = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *args):
+        pass
+
+
+if __name__ == "__main__":
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeSlackHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    client = slack.new_slack_client("xoxb-fake", f"http://127.0.0.1:{server.server_port}/api/")
+
+    with tempfile.NamedTemporaryFile(suffix=".png") as image:
+        image.write(b"\x89PNG fake")
+        image.flush()
+        start = time.perf_counter()
+        publisher = slack.new_slack_publisher(client, "C0", "benchmark run" if BENCH_THREAD else None)
+        for i in range(BENCH_MESSAGES):
+            publisher.publish(f"instance-{i}", f"report {i}", image.name)
+        queued = time.perf_counter() - start
+        results = publisher.close()
+        elapsed = time.perf_counter() - start
+
+    server.shutdown()
+    print(f"queued {BENCH_MESSAGES} messages in {queued * 1000:.1f}ms, all sent after {elapsed:.2f}s, "
+          f"{FakeSlackHandler.calls} api calls")
+    print(slack.summarize_results(results))
+    sys.exit(0 if all(r.ok for r in results) else 1)
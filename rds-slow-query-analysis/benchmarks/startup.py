@@ -0,0 +1,46 @@
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+# usage: python -m benchmarks.startup
+STARTUP_RUNS = int(os.getenv("STARTUP_RUNS", "10"))
+# fails the run when the median import time of the library goes over this
+STARTUP_BUDGET_MS = float(os.getenv("STARTUP_BUDGET_MS", "250"))
+HEAVY_MODULES = ["boto3", "botocore", "matplotlib", "slack_sdk", "requests", "yaml"]
+
+CHECKS = {
+    "main --help": [sys.executable, "main.py", "--help"],
+    "import pkg.runner": [
+        sys.executable, "-c",
+        "import sys, main, pkg.runner; "
+        f"loaded = [m for m in {HEAVY_MODULES!r} if m in sys.modules]; "
+        "print(','.join(loaded)); sys.exit(1 if loaded else 0)"
+    ],
+}
+
+
+def measure(command):
+    timings = []
+    for _ in range(STARTUP_RUNS):
+        start = time.perf_counter()
+        result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        timings.append((time.perf_counter() - start) * 1000)
+        if result.returncode:
+            return None, result.stdout.decode("utf-8").strip()
+    return statistics.median(timings), None
+
+
+if __name__ == "__main__":
+    failed = False
+    for name, command in CHECKS.items():
+        median_ms, error = measure(command)
+        if median_ms is None:
+            print(f"{name:<20} failed: {error}")
+            failed = True
+            continue
+        over_budget = median_ms > STARTUP_BUDGET_MS
+        failed = failed or over_budget
+        print(f"{name:<20} {median_ms:>8.1f}ms median of {STARTUP_RUNS}{'  over budget' if over_budget else ''}")
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,189 @@
+import mmap
+import os
+import re
+from collections import namedtuple
+
+# a slow query log record looks like
+#   # Time: 2022-08-09T04:00:01.123456Z
+#   # User@Host: app[app] @  [10.0.0.1]  Id:   123
+#   # Query_time: 0.045123  Lock_time: 0.000012 Rows_sent: 1  Rows_examined: 100
+#   use orders;
+#   SET timestamp=1660017601;
+#   SELECT * FROM orders WHERE id = 1;
+QUERY_TIME_MARKER = b"# Query_time:"
+TIME_PREFIX = b"# Time:"
+USER_HOST_PREFIX = b"# User@Host:"
+QUERY_TIME_PATTERN = re.compile(rb'# Query_time:\s+(\d+(?:\.\d+)?)')
+USER_HOST_PATTERN = re.compile(rb'# User@Host:\s+([^\[\s]*)\[[^\]]*\]\s+@\s+\S*\s*\[[^\]]*\](?:\s+Id:\s+(\d+))?')
+USE_PATTERN = re.compile(rb'use\s+`?([^`;\s]+)`?;', re.IGNORECASE)
+SET_TIMESTAMP_PREFIX = b"SET timestamp="
+# every mysqld start writes a banner into the log, it ends the record in front of it
+#   /rdsdbbin/mysql/bin/mysqld, Version: 8.0.28 (Source distribution). started with:
+#   Tcp port: 3306  Unix socket: /tmp/mysql.sock
+#   Time                 Id Command    Argument
+BANNER_PATTERN = re.compile(rb'[^\n]*, Version: [^\n]*started with:[ \t\r]*$', re.MULTILINE)
+BANNER_MARKER = b"started with:"
+
+IGNORED_USERS = ["rdsadmin"]
+IGNORED_USERS_BYTES = [u.encode("utf-8") for u in IGNORED_USERS]
+
+# files are mapped a window at a time so resident memory stays bounded
+MMAP_WINDOW_SIZE = 64 * 1024 * 1024
+
+# duration is in ms like the postgres records, statement is only filled in when asked for
+MysqlDurationRecord = namedtuple(
+    "MysqlDurationRecord", ["duration", "user", "database", "offset", "statement"], defaults=[None]
+)
+
+
+def scan_log(source, date, with_statement=False):
+    # source can either be a binary file object or a bytes like buffer
+    if isinstance(source, (bytes, bytearray, mmap.mmap)):
+        return scan_log_buffer(source, date, with_statement=with_statement)
+    return scan_log_stream(source, date, with_statement)
+
+
+def scan_log_file(path, date, window_size=MMAP_WINDOW_SIZE, with_statement=False):
+    databases = {}
+    with open(path, "rb") as fp:
+        size = os.fstat(fp.fileno()).st_size
+        start = 0
+        while start < size:
+            map_offset = start - start % mmap.ALLOCATIONGRANULARITY
+            length = min(window_size, size - map_offset)
+            with mmap.mmap(fp.fileno(), length, access=mmap.ACCESS_READ, offset=map_offset) as buf:
+                if hasattr(buf, "madvise"):
+                    buf.madvise(mmap.MADV_SEQUENTIAL)
+                scan_start = start - map_offset
+                scan_end = length
+                if map_offset + length < size:
+                    # stop before the header of the last record, it may continue past the window
+                    last = buf.rfind(b"\n" + QUERY_TIME_MARKER, scan_start)
+                    scan_end = _record_start(buf, scan_start, last + 1) if last != -1 else scan_start
+                    if scan_end <= scan_start:
+                        window_size *= 2
+                        continue
+                yield from scan_log_buffer(buf, date, scan_start, scan_end, map_offset, with_statement, databases)
+            start = map_offset + scan_end
+
+
+def scan_log_buffer(buf, date, start=0, end=None, base_offset=0, with_statement=False, databases=None):
+    # start has to point at the beginning of a line, databases carries the current
+    # database of each connection over from a previous buffer of the same file
+    date = date.encode("utf-8") if isinstance(date, str) else date
+    end = len(buf) if end is None else end
+    databases = {} if databases is None else databases
+    pos = buf.find(QUERY_TIME_MARKER, start, end)
+    while pos != -1:
+        line_end = buf.find(b"\n", pos, end)
+        if line_end == -1:
+            line_end = end
+        if pos != start and buf[pos - 1:pos] != b"\n":
+            pos = buf.find(QUERY_TIME_MARKER, line_end, end)
+            continue
+        body_end = buf.find(b"\n#", line_end, end)
+        body_end = end if body_end == -1 else body_end + 1
+        if buf.find(BANNER_MARKER, line_end, body_end) != -1:
+            banner = BANNER_PATTERN.search(buf, line_end + 1, body_end)
+            if banner is not None:
+                body_end = banner.start()
+        m = QUERY_TIME_PATTERN.match(buf, pos, line_end)
+        if m is not None:
+            record_time, user, connection_id = _parse_header(buf, _record_start(buf, start, pos), pos)
+            body = buf[line_end + 1:body_end] if line_end < body_end else b""
+            record = _make_record(
+                m.group(1), record_time, user, connection_id, body, base_offset + line_end + 1,
+                date, databases, with_statement
+            )
+            if record is not None:
+                yield record
+        pos = buf.find(QUERY_TIME_MARKER, body_end, end)
+
+
+def scan_log_stream(fp, date, with_statement=False):
+    date = date.encode("utf-8") if isinstance(date, str) else date
+    databases = {}
+    record_time = user = connection_id = query_time = None
+    body = []
+    body_offset = offset = 0
+    for line in fp:
+        offset += len(line)
+        banner = BANNER_MARKER in line and BANNER_PATTERN.match(line) is not None
+        if not line.startswith(b"#") and not banner:
+            if query_time is not None:
+                body.append(line)
+            continue
+        if query_time is not None:
+            record = _make_record(
+                query_time, record_time, user, connection_id, b"".join(body), body_offset,
+                date, databases, with_statement
+            )
+            if record is not None:
+                yield record
+            record_time = user = connection_id = query_time = None
+            body = []
+        if line.startswith(TIME_PREFIX):
+            record_time = line[len(TIME_PREFIX):].strip()
+        elif line.startswith(USER_HOST_PREFIX):
+            m = USER_HOST_PATTERN.match(line)
+            if m is not None:
+                user, connection_id = m.group(1), m.group(2)
+        elif line.startswith(QUERY_TIME_MARKER):
+            m = QUERY_TIME_PATTERN.match(line)
+            if m is not None:
+                query_time = m.group(1)
+                body_offset = offset
+    if query_time is not None:
+        record = _make_record(
+            query_time, record_time, user, connection_id, b"".join(body), body_offset,
+            date, databases, with_statement
+        )
+        if record is not None:
+            yield record
+
+
+def _record_start(buf, start, pos):
+    # walks back over the "# ..." header lines in front of the Query_time line at pos
+    while pos > start:
+        prev_start = buf.rfind(b"\n", start, pos - 1) + 1 or start
+        if buf[prev_start:prev_start + 1] != b"#":
+            break
+        pos = prev_start
+    return pos
+
+
+def _parse_header(buf, header_start, pos):
+    record_time = user = connection_id = None
+    for line in buf[header_start:pos].splitlines():
+        if line.startswith(TIME_PREFIX):
+            record_time = line[len(TIME_PREFIX):].strip()
+        elif line.startswith(USER_HOST_PREFIX):
+            m = USER_HOST_PATTERN.match(line)
+            if m is not None:
+                user, connection_id = m.group(1), m.group(2)
+    return record_time, user, connection_id
+
+
+def _make_record(query_time, record_time, user, connection_id, body, offset, date, databases, with_statement):
+    # "use db;" only shows up when a connection switches database, so it is remembered per connection
+    database = databases.get(connection_id)
+    statement_lines = []
+    for line in body.splitlines():
+        m = USE_PATTERN.match(line)
+        if m is not None:
+            database = m.group(1)
+            databases[connection_id] = database
+        elif with_statement and not line.startswith(SET_TIMESTAMP_PREFIX):
+            statement_lines.append(line)
+    # only ISO timestamps (5.7 and later) can be compared, 5.6 writes "220809  4:00:01"
+    if record_time is not None and record_time[4:5] == b"-" and not record_time.startswith(date):
+        return None
+    if user in IGNORED_USERS_BYTES:
+        return None
+    return MysqlDurationRecord(
+        float(query_time) * 1000.0,
+        user.decode("utf-8") if user is not None else None,
+        database.decode("utf-8") if database is not None else None,
+        offset,
+        b" ".join(statement_lines).decode("utf-8", "replace") if with_statement else None,
+    )
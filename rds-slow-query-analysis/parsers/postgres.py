@@ -1,17 +1,119 @@
+import mmap
+import os
 import re
+from collections import namedtuple
 
 POSTGRES_LOG_REGEX = r'(\d+-\d+-\d+\s+\d+:\d+:\d+\s+UTC):(\d+.\d+.\d+.\d+)\(\d+\):(\w+)@(\w+):\[\d+\]:\w+:\s+duration:\s+(\d+.\d+)\s+ms\s+(.*)'
+POSTGRES_LOG_PATTERN = re.compile(POSTGRES_LOG_REGEX)
+
+# bytes variant of the same line format, the statement itself is not captured
+# and only its offset is reported back so callers can seek to it when needed
+POSTGRES_DURATION_PATTERN = re.compile(
+    rb'\d+-\d+-\d+\s+\d+:\d+:\d+\s+UTC:\d+.\d+.\d+.\d+\(\d+\):(\w+)@(\w+):\[\d+\]:\w+:\s+duration:\s+(\d+.\d+)\s+ms\s+'
+)
+
+DURATION_MARKER = "duration:"
+DURATION_MARKER_BYTES = DURATION_MARKER.encode("utf-8")
+IGNORED_USERS = ["pgwatch_monitor"]
+IGNORED_USERS_BYTES = [u.encode("utf-8") for u in IGNORED_USERS]
+
+# files are mapped a window at a time so resident memory stays bounded
+MMAP_WINDOW_SIZE = 64 * 1024 * 1024
+
+# statement is only filled in when asked for, and only holds the first line of it
+PostgresDurationRecord = namedtuple(
+    "PostgresDurationRecord", ["duration", "user", "database", "offset", "statement"], defaults=[None]
+)
+
 
 def parse_log_line(date, line):
-    if line.startswith(date):
-        parsed_data = re.findall(POSTGRES_LOG_REGEX, line)
-        if len(parsed_data):
-            p = PostgresLogModel(*parsed_data[0])
+    if line.startswith(date) and DURATION_MARKER in line:
+        parsed_data = POSTGRES_LOG_PATTERN.match(line)
+        if parsed_data is not None:
+            p = PostgresLogModel(*parsed_data.groups())
             if p.should_consider():
                 return p
     return None
 
 
+def scan_log(source, date, with_statement=False):
+    # source can either be a binary file object or a bytes like buffer
+    if isinstance(source, (bytes, bytearray, mmap.mmap)):
+        return scan_log_buffer(source, date, with_statement=with_statement)
+    return scan_log_stream(source, date, with_statement)
+
+
+def scan_log_file(path, date, window_size=MMAP_WINDOW_SIZE, with_statement=False):
+    with open(path, "rb") as fp:
+        size = os.fstat(fp.fileno()).st_size
+        start = 0
+        while start < size:
+            map_offset = start - start % mmap.ALLOCATIONGRANULARITY
+            length = min(window_size, size - map_offset)
+            with mmap.mmap(fp.fileno(), length, access=mmap.ACCESS_READ, offset=map_offset) as buf:
+                if hasattr(buf, "madvise"):
+                    buf.madvise(mmap.MADV_SEQUENTIAL)
+                scan_start = start - map_offset
+                scan_end = length
+                if map_offset + length < size:
+                    # stop at the last complete line, the rest goes to the next window
+                    scan_end = buf.rfind(b"\n", scan_start) + 1
+                    if scan_end <= scan_start:
+                        window_size *= 2
+                        continue
+                yield from scan_log_buffer(buf, date, scan_start, scan_end, map_offset, with_statement)
+            start = map_offset + scan_end
+
+
+def scan_log_buffer(buf, date, start=0, end=None, base_offset=0, with_statement=False):
+    # start has to point at the beginning of a line
+    date = date.encode("utf-8") if isinstance(date, str) else date
+    date_len = len(date)
+    end = len(buf) if end is None else end
+    match = POSTGRES_DURATION_PATTERN.match
+    pos = buf.find(DURATION_MARKER_BYTES, start, end)
+    while pos != -1:
+        line_start = buf.rfind(b"\n", start, pos) + 1 or start
+        line_end = buf.find(b"\n", pos, end)
+        if line_end == -1:
+            line_end = end
+        if buf[line_start:line_start + date_len] == date:
+            m = match(buf, line_start, line_end)
+            if m is not None:
+                user = m.group(1)
+                if user not in IGNORED_USERS_BYTES:
+                    statement = None
+                    if with_statement:
+                        statement = buf[m.end():line_end].decode("utf-8", "replace")
+                    yield PostgresDurationRecord(
+                        float(m.group(3)), user.decode("utf-8"), m.group(2).decode("utf-8"), base_offset + m.end(), statement
+                    )
+        pos = buf.find(DURATION_MARKER_BYTES, line_end, end)
+
+
+def scan_log_stream(fp, date, with_statement=False):
+    date = date.encode("utf-8") if isinstance(date, str) else date
+    match = POSTGRES_DURATION_PATTERN.match
+    offset = 0
+    for line in fp:
+        line_offset = offset
+        offset += len(line)
+        if not line.startswith(date) or DURATION_MARKER_BYTES not in line:
+            continue
+        m = match(line)
+        if m is None:
+            continue
+        user = m.group(1)
+        if user in IGNORED_USERS_BYTES:
+            continue
+        statement = None
+        if with_statement:
+            statement = line[m.end():].rstrip(b"\r\n").decode("utf-8", "replace")
+        yield PostgresDurationRecord(
+            float(m.group(3)), user.decode("utf-8"), m.group(2).decode("utf-8"), line_offset + m.end(), statement
+        )
+
+
 class PostgresLogModel:
     def __init__(self, *args):
         self.time = args[0]
@@ -20,12 +122,12 @@ class PostgresLogModel:
         self.database = args[3]
         self.duration = args[4]
         self.statement = args[5]
-    
+
     def should_consider(self):
-        if self.user in ["pgwatch_monitor"]:
+        if self.user in IGNORED_USERS:
             return False
         return True
-    
+
     def get_statement(self):
         return self.statement
 
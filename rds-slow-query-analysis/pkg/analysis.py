@@ -0,0 +1,78 @@
+from parsers import mysql, postgres
+from pkg import fingerprint, sketch, storage
+
+POSTGRES_ENGINES = ["postgres", "aurora-postgresql"]
+MYSQL_ENGINES = ["mysql", "aurora", "aurora-mysql"]
+# lower bounds of the report buckets in ms, each bucket counts up to the next one
+DURATION_BUCKETS = [("30ms", 30.00), ("40ms", 40.00), ("50ms", 50.00), ("100ms", 100.00)]
+SKETCH_DIMENSIONS = ["user", "database", "fingerprint"]
+
+
+def new_duration_bucket():
+    return {name: 0 for name, _ in DURATION_BUCKETS}
+
+
+def merge_duration_buckets(duration_bucket, other):
+    for k, v in other.items():
+        duration_bucket[k] = duration_bucket.get(k, 0) + v
+    return duration_bucket
+
+
+def analyse_log_file(engine, log_file, fetch_date, sketch_dimensions=()):
+    # runs inside the worker processes, so it only takes and returns picklable values.
+    # duration_bucket holds exact counts, the sketches only give the percentiles. sketches
+    # holds the whole instance under "instance" and, for each of the sketch_dimensions,
+    # one sketch per value under "<dimension>:<value>"
+    duration_bucket = new_duration_bucket()
+    sketches = {"instance": sketch.LatencySketch()}
+    fingerprints = fingerprint.FingerprintAggregator()
+    if engine in POSTGRES_ENGINES:
+        parser = postgres
+    elif engine in MYSQL_ENGINES:
+        parser = mysql
+    else:
+        return duration_bucket, sketches, fingerprints
+    for dimension in sketch_dimensions:
+        if dimension not in SKETCH_DIMENSIONS:
+            raise ValueError(f"unsupported sketch dimension {dimension}")
+    instance_sketch = sketches["instance"]
+    by_user = "user" in sketch_dimensions
+    by_database = "database" in sketch_dimensions
+    by_fingerprint = "fingerprint" in sketch_dimensions
+    for record in _scan_log(parser, log_file, fetch_date):
+        d = record.duration
+        if d > 100.00:
+            duration_bucket["100ms"] += 1
+        elif d > 50.00:
+            duration_bucket["50ms"] += 1
+        elif d > 40.00:
+            duration_bucket["40ms"] += 1
+        elif d > 30.00:
+            duration_bucket["30ms"] += 1
+        instance_sketch.add(d)
+        fingerprints.add(record.statement, d)
+        if by_user:
+            _dimension_sketch(sketches, f"user:{record.user}").add(d)
+        if by_database:
+            _dimension_sketch(sketches, f"database:{record.database}").add(d)
+        if by_fingerprint:
+            key, _ = fingerprint.fingerprint(record.statement)
+            _dimension_sketch(sketches, f"fingerprint:{key:016x}").add(d)
+    return duration_bucket, sketches, fingerprints
+
+
+def _dimension_sketch(sketches, key):
+    s = sketches.get(key)
+    if s is None:
+        s = sketches[key] = sketch.LatencySketch()
+    return s
+
+
+def _scan_log(parser, log_file, fetch_date):
+    # parser is one of the parsers modules, they all share the same scan_* interface
+    if storage.is_compressed(log_file):
+        with storage.open_log_file(log_file) as fp:
+            yield from parser.scan_log_stream(fp, fetch_date, with_statement=True)
+    else:
+        # scans the raw bytes through mmap, only the fields in use get decoded
+        yield from parser.scan_log_file(log_file, fetch_date, with_statement=True)
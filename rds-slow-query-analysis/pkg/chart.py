@@ -1,13 +1,104 @@
-from matplotlib import pyplot
+import math
+
+FLEET_GRID_COLUMNS = 4
+FLEET_CHARTS_PER_IMAGE = 24
+SUBPLOT_SIZE = (4, 3)
+
+_renderer = None
+
+
+def new_bar_chart_renderer():
+    return BarChartRenderer()
 
 
 def plot_bar_chart(title, yaxis_label, xaxis_label, yaxis, xaxis, colors, output_file):
-    print(f"initiating chart creation at {output_file}")
-    pyplot.bar(xaxis, yaxis, color=colors)
-    pyplot.title(title, fontsize=14)
-    pyplot.xlabel(xaxis_label, fontsize=14)
-    pyplot.ylabel(yaxis_label, fontsize=14)
-    pyplot.grid(True)
-    pyplot.savefig(output_file, bbox_inches='tight')
-    pyplot.close()
-    print(f"successfully generated chart at {output_file}")
+    # kept for single charts, every call goes through one shared renderer
+    global _renderer
+    if _renderer is None:
+        _renderer = new_bar_chart_renderer()
+    _renderer.plot_bar_chart(title, yaxis_label, xaxis_label, yaxis, xaxis, colors, output_file)
+
+
+def _draw_bars(ax, title, yaxis_label, xaxis_label, yaxis, xaxis, colors, fontsize):
+    # bars already on ax with the same x labels are updated in place, which is much
+    # cheaper than clearing the axes and drawing them again
+    xaxis = list(xaxis)
+    yaxis = list(yaxis)
+    bars = ax.patches
+    if getattr(ax, "_bar_xaxis", None) == xaxis and len(bars) == len(xaxis):
+        for bar, height, color in zip(bars, yaxis, colors):
+            bar.set_height(height)
+            bar.set_color(color)
+        ax.relim()
+        ax.autoscale_view()
+    else:
+        ax.clear()
+        ax.bar(xaxis, yaxis, color=colors)
+        ax.set_xlabel(xaxis_label, fontsize=fontsize)
+        ax.set_ylabel(yaxis_label, fontsize=fontsize)
+        ax.grid(True)
+        ax._bar_xaxis = xaxis
+    ax.set_title(title, fontsize=fontsize)
+    ax.set_visible(True)
+
+
+class BarChartRenderer:
+    # draws on the Agg canvas directly instead of the pyplot state machine, and keeps
+    # one figure and its axes around so rendering many instances only updates the bars.
+    # matplotlib is only imported here, when a chart is actually drawn
+    def __init__(self):
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+        from matplotlib.figure import Figure
+
+        self.figure = Figure()
+        self.canvas = FigureCanvasAgg(self.figure)
+        self.default_size = tuple(self.figure.get_size_inches())
+        self.layout = None
+        self.axes = None
+
+    def _set_layout(self, rows, columns):
+        if self.layout == (rows, columns):
+            return
+        self.figure.clear()
+        if (rows, columns) == (1, 1):
+            self.figure.set_size_inches(self.default_size)
+        else:
+            self.figure.set_size_inches(SUBPLOT_SIZE[0] * columns, SUBPLOT_SIZE[1] * rows)
+        self.axes = list(self.figure.subplots(rows, columns, squeeze=False).flat)
+        self.layout = (rows, columns)
+
+    def _save(self, output_file):
+        # laid out again for every chart, its labels and titles can be longer than the last one's
+        self.figure.tight_layout()
+        self.figure.savefig(output_file, bbox_inches="tight")
+
+    def plot_bar_chart(self, title, yaxis_label, xaxis_label, yaxis, xaxis, colors, output_file):
+        print(f"initiating chart creation at {output_file}")
+        self._set_layout(1, 1)
+        _draw_bars(self.axes[0], title, yaxis_label, xaxis_label, yaxis, xaxis, colors, fontsize=14)
+        self._save(output_file)
+        print(f"successfully generated chart at {output_file}")
+
+    def plot_fleet_grid(self, charts, yaxis_label, xaxis_label, colors, output_file, columns=FLEET_GRID_COLUMNS, rows=None):
+        # charts is a list of (title, yaxis, xaxis), all drawn as subplots of one image
+        print(f"initiating fleet chart creation of {len(charts)} instances at {output_file}")
+        self._set_layout(rows or math.ceil(len(charts) / columns), columns)
+        for i, ax in enumerate(self.axes):
+            if i >= len(charts):
+                ax.set_visible(False)
+                continue
+            title, yaxis, xaxis = charts[i]
+            _draw_bars(ax, title, yaxis_label, xaxis_label, yaxis, xaxis, colors, fontsize=9)
+        self._save(output_file)
+        print(f"successfully generated fleet chart at {output_file}")
+
+    def plot_fleet_grids(self, charts, yaxis_label, xaxis_label, colors, output_prefix, per_image=FLEET_CHARTS_PER_IMAGE):
+        # splits a large fleet over a few grid images, returns their paths
+        output_files = []
+        # every image gets the same grid, so the axes are reused from one image to the next
+        rows = math.ceil(min(per_image, len(charts)) / FLEET_GRID_COLUMNS)
+        for n, i in enumerate(range(0, len(charts), per_image)):
+            output_file = f"{output_prefix}-{n}.png"
+            self.plot_fleet_grid(charts[i:i + per_image], yaxis_label, xaxis_label, colors, output_file, rows=rows)
+            output_files.append(output_file)
+        return output_files
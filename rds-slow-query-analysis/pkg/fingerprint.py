@@ -0,0 +1,83 @@
+import hashlib
+import heapq
+import re
+from functools import lru_cache
+
+FINGERPRINT_CACHE_SIZE = 65536
+SAMPLE_STATEMENT_LENGTH = 500
+
+# "statement: ", "execute <unnamed>: ", "execute S_1/C_2: " and friends in front of the query
+STATEMENT_PREFIX_PATTERN = re.compile(r'^\s*(?:statement|execute|parse|bind)[^:]*:\s*', re.IGNORECASE)
+COMMENT_PATTERN = re.compile(r'/\*.*?\*/|--[^\n]*')
+STRING_PATTERN = re.compile(r"[eE]?'(?:[^']|'')*'")
+NUMBER_PATTERN = re.compile(r'(?<![\w$])-?\d+(?:\.\d+)?(?:[eE][-+]?\d+)?\b')
+PARAMETER_PATTERN = re.compile(r'\$\d+')
+IN_LIST_PATTERN = re.compile(r'\bin\s*\(\s*\?(?:\s*,\s*\?)*\s*\)', re.IGNORECASE)
+VALUES_LIST_PATTERN = re.compile(r'\bvalues\s*\(\s*\?(?:\s*,\s*\?)*\s*\)(?:\s*,\s*\(\s*\?(?:\s*,\s*\?)*\s*\))*', re.IGNORECASE)
+WHITESPACE_PATTERN = re.compile(r'\s+')
+OPERATOR_SPACING_PATTERN = re.compile(r'\s*([(),=<>!]+)\s*')
+
+# positions in the per fingerprint aggregate list, a list keeps the state smaller than an object per query
+COUNT = 0
+TOTAL = 1
+MAX = 2
+NORMALIZED = 3
+SAMPLE = 4
+
+
+def normalize(statement):
+    s = STATEMENT_PREFIX_PATTERN.sub("", statement, count=1)
+    s = COMMENT_PATTERN.sub(" ", s)
+    s = STRING_PATTERN.sub("?", s)
+    s = PARAMETER_PATTERN.sub("?", s)
+    s = NUMBER_PATTERN.sub("?", s)
+    s = WHITESPACE_PATTERN.sub(" ", s).strip().lower()
+    s = OPERATOR_SPACING_PATTERN.sub(r"\1", s)
+    s = IN_LIST_PATTERN.sub("in(...)", s)
+    s = VALUES_LIST_PATTERN.sub("values(...)", s)
+    return s.rstrip(";").rstrip()
+
+
+@lru_cache(maxsize=FINGERPRINT_CACHE_SIZE)
+def fingerprint(statement):
+    # the same raw statements show up over and over, so they only get normalized once
+    normalized = normalize(statement)
+    return int.from_bytes(hashlib.blake2b(normalized.encode("utf-8"), digest_size=8).digest(), "big"), normalized
+
+
+class FingerprintAggregator:
+    def __init__(self):
+        self.fingerprints = {}
+
+    def add(self, statement, duration):
+        key, normalized = fingerprint(statement)
+        entry = self.fingerprints.get(key)
+        if entry is None:
+            self.fingerprints[key] = [
+                1, duration, duration, normalized[:SAMPLE_STATEMENT_LENGTH], statement[:SAMPLE_STATEMENT_LENGTH]
+            ]
+            return
+        entry[COUNT] += 1
+        entry[TOTAL] += duration
+        if duration > entry[MAX]:
+            entry[MAX] = duration
+
+    def merge(self, other):
+        for key, other_entry in other.fingerprints.items():
+            entry = self.fingerprints.get(key)
+            if entry is None:
+                self.fingerprints[key] = list(other_entry)
+                continue
+            entry[COUNT] += other_entry[COUNT]
+            entry[TOTAL] += other_entry[TOTAL]
+            entry[MAX] = max(entry[MAX], other_entry[MAX])
+        return self
+
+    def top(self, n, sort_by="total"):
+        # returns (count, total, mean, max, normalized, sample) tuples of the n heaviest fingerprints
+        index = {"count": COUNT, "total": TOTAL, "max": MAX}[sort_by]
+        entries = heapq.nlargest(n, self.fingerprints.values(), key=lambda e: e[index])
+        return [(e[COUNT], e[TOTAL], e[TOTAL] / e[COUNT], e[MAX], e[NORMALIZED], e[SAMPLE]) for e in entries]
+
+    def __len__(self):
+        return len(self.fingerprints)
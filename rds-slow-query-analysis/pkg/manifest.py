@@ -0,0 +1,76 @@
+import hashlib
+import json
+import os
+import threading
+
+MANIFEST_FILE_NAME = "manifest.json"
+CHECKSUM_CHUNK_SIZE = 1024 * 1024
+
+COMPLETE = "complete"
+PARTIAL = "partial"
+CORRUPT = "corrupt"
+
+
+def load_manifest(directory):
+    return Manifest(os.path.join(directory, MANIFEST_FILE_NAME))
+
+
+def file_checksum(path):
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHECKSUM_CHUNK_SIZE), b""):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+class Manifest:
+    # keeps track of downloaded log files of one instance and date, so reruns
+    # only fetch what is missing or has grown since the last run
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.files = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                self.files = json.load(f).get("files", {})
+
+    def status(self, name, local_path, size, last_written, verify_checksum=False):
+        if not os.path.exists(local_path):
+            return PARTIAL
+        entry = self.files.get(name)
+        if entry is None:
+            # left behind by a crash or by a run without manifest, resume from it
+            return PARTIAL
+        local_size = os.path.getsize(local_path)
+        if local_size < entry["downloaded_size"]:
+            return CORRUPT
+        if local_size > entry["downloaded_size"]:
+            # an append was interrupted after the last record
+            return PARTIAL
+        if verify_checksum and file_checksum(local_path) != entry["sha256"]:
+            return CORRUPT
+        if entry["size"] != size or entry["last_written"] != last_written:
+            # log file is still being written to on the instance
+            return PARTIAL
+        return COMPLETE
+
+    def record(self, name, local_path, size, last_written):
+        checksum = file_checksum(local_path)
+        with self.lock:
+            self.files[name] = {
+                "size": size,
+                "last_written": last_written,
+                "downloaded_size": os.path.getsize(local_path),
+                "sha256": checksum,
+            }
+            self._save()
+
+    def discard(self, name):
+        with self.lock:
+            if self.files.pop(name, None) is not None:
+                self._save()
+
+    def _save(self):
+        with open(f"{self.path}-new", "w") as f:
+            json.dump({"files": self.files}, f, indent=2, sort_keys=True)
+        os.replace(f"{self.path}-new", self.path)
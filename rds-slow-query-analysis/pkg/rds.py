@@ -2,24 +2,66 @@ import datetime
 import hashlib
 import hmac
 import os
-import urllib
+import random
+import time
+import urllib.parse
 
 import requests
-
-
-def new_rds_client(boto_session):
+from requests.adapters import HTTPAdapter
+
+from pkg import storage
+
+DOWNLOAD_WORKERS = 8
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+DOWNLOAD_MAX_ATTEMPTS = 5
+DOWNLOAD_BACKOFF_BASE = 1.0
+DOWNLOAD_BACKOFF_MAX = 30.0
+DOWNLOAD_RETRY_STATUS_CODES = [429, 500, 502, 503, 504]
+EMPTY_PAYLOAD_HASH = hashlib.sha256(b"").hexdigest()
+# postgres writes durations to its error log, mysql has a separate slow query log
+LOG_FILE_PREFIXES = {
+    "mysql": "slowquery/",
+    "aurora": "slowquery/",
+    "aurora-mysql": "slowquery/",
+}
+DEFAULT_LOG_FILE_PREFIX = "error/"
+
+
+def new_rds_client(boto_session, endpoint_url=None, max_connections=DOWNLOAD_WORKERS, inventory_cache=None):
     rds_client = boto_session.client("rds")
     print("successfully initialised rds client")
-    return RDS(rds_client, boto_session)
+    return RDS(rds_client, boto_session, endpoint_url, max_connections, inventory_cache)
 
 
 class RDS:
-    def __init__(self, rds_client, boto_session):
+    def __init__(self, rds_client, boto_session, endpoint_url=None, max_connections=DOWNLOAD_WORKERS,
+                 inventory_cache=None):
         self.rds_client = rds_client
         self.boto_session = boto_session
+        # rds_inventory snapshots shared with the other rds tools, listed from aws when unset
+        self.inventory_cache = inventory_cache
+        # endpoint_url overrides https://rds.<region>.amazonaws.com, e.g. for a local stand-in
+        self.endpoint_url = endpoint_url
+        self.credentials = None
+        self.signing_keys = {}
+        # one pooled session shared by every download so connections get reused
+        self.http_session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=max_connections, pool_maxsize=max_connections)
+        self.http_session.mount("https://", adapter)
+        self.http_session.mount("http://", adapter)
     
+    def get_db_instances(self):
+        if self.inventory_cache is not None:
+            return self.inventory_cache.db_instances(
+                self.rds_client, self.boto_session.profile_name, self.boto_session.region_name
+            )
+        instances = []
+        for page in self.rds_client.get_paginator("describe_db_instances").paginate():
+            instances.extend(page["DBInstances"])
+        return instances
+
     def get_instance_engine_dict(self, rds_config):
-        instances = self.rds_client.describe_db_instances()["DBInstances"]
+        instances = self.get_db_instances()
         instance_engine_dict = {}
         for i in instances:
             if i["DBInstanceStatus"] != "available":
@@ -32,46 +74,109 @@ class RDS:
                     instance_engine_dict[i["DBInstanceIdentifier"]] = i["Engine"]
         return instance_engine_dict
 
-    def get_log_file_names(self, db_instance_identifier, sub_string):
+    def get_log_file_names(self, db_instance_identifier, sub_string, engine=None):
+        return [f["LogFileName"] for f in self.get_log_files(db_instance_identifier, sub_string, engine)]
+
+    def get_log_files(self, db_instance_identifier, sub_string, engine=None):
         selected_files = []
+        prefix = LOG_FILE_PREFIXES.get(engine, DEFAULT_LOG_FILE_PREFIX)
         files = self.rds_client.describe_db_log_files(DBInstanceIdentifier = db_instance_identifier)
         for file in files["DescribeDBLogFiles"]:
             file_name = file["LogFileName"]
-            if not file_name.startswith("error/"):
+            if not file_name.startswith(prefix):
                 continue
             if sub_string is None:
-                selected_files.append(file_name)
+                selected_files.append(file)
                 continue
             if sub_string in file_name:
-                selected_files.append(file_name)
+                selected_files.append(file)
         return selected_files
 
-    def download_log_file(self, filename, db_instance_identifier, output_file, region):
-        def sign(key, msg):
-            return hmac.new(key, msg.encode('utf-8'), hashlib.sha256).digest()
-
+    def download_log_file(self, filename, db_instance_identifier, output_file, region, resume=False):
+        # with resume, bytes already in output_file are kept and only the rest is requested,
+        # output_file ending in .gz or .zst is compressed while the chunks are written
+        for attempt in range(DOWNLOAD_MAX_ATTEMPTS):
+            if attempt:
+                backoff = min(DOWNLOAD_BACKOFF_MAX, DOWNLOAD_BACKOFF_BASE * 2 ** (attempt - 1))
+                backoff = random.uniform(backoff / 2, backoff)
+                print(f"retrying download of {db_instance_identifier} {filename} in {backoff:.2f}s")
+                time.sleep(backoff)
+
+            request_url = self._presign_download_url(filename, db_instance_identifier, region)
+            if request_url is None:
+                return False
+
+            offset = 0
+            if resume and os.path.exists(output_file):
+                offset = storage.uncompressed_size(output_file) or 0
+            headers = {"Range": f"bytes={offset}-"} if offset else None
+
+            print(f"initiating download of {db_instance_identifier} {filename} to {output_file} from byte {offset}")
+            try:
+                with self.http_session.get(request_url, headers=headers, stream=True, allow_redirects=True) as r:
+                    if self._is_throttled(r):
+                        print(f"download throttled, request status code {r.status_code}")
+                        continue
+                    if r.status_code == 416:
+                        print(f"{output_file} is already up to date")
+                        return True
+                    if r.status_code != 200 and r.status_code != 206:
+                        print(f"something went wrong, request status code {r.status_code}")
+                        return False
+                    # a 200 means the server ignored the range and sent the whole file
+                    with storage.open_log_file_for_write(output_file, append=r.status_code == 206) as f:
+                        for chunk in r.iter_content(DOWNLOAD_CHUNK_SIZE):
+                            if chunk:
+                                f.write(chunk)
+            except requests.RequestException as e:
+                print(f"failed to download file {output_file}, {e}")
+                if not resume and os.path.exists(output_file):
+                    os.remove(output_file)
+                continue
+            print(f"successfully downloaded {db_instance_identifier} {filename} to {output_file}")
+            return True
+
+        print(f"giving up download of {db_instance_identifier} {filename} after {DOWNLOAD_MAX_ATTEMPTS} attempts")
+        return False
+
+    def _is_throttled(self, r):
+        if r.status_code in DOWNLOAD_RETRY_STATUS_CODES:
+            return True
+        return r.status_code == 400 and b"Throttling" in r.content
+
+    def _get_credentials(self):
+        # refreshable credentials are fetched once, the frozen copy refreshes itself when they expire
+        if self.credentials is None:
+            self.credentials = self.boto_session.get_credentials()
+        if self.credentials is None:
+            return None
+        return self.credentials.get_frozen_credentials()
+
+    def _get_signature_key(self, key, date_stamp, region_name, service_name):
         # http://docs.aws.amazon.com/general/latest/gr/signature-v4-examples.html#signature-v4-examples-python
-        def getSignatureKey(key, dateStamp, regionName, serviceName):
-            kDate = sign(('AWS4' + key).encode('utf-8'), dateStamp)
-            kRegion = sign(kDate, regionName)
-            kService = sign(kRegion, serviceName)
-            kSigning = sign(kService, 'aws4_request')
-            return kSigning
-
+        cache_key = (key, date_stamp, region_name, service_name)
+        signing_key = self.signing_keys.get(cache_key)
+        if signing_key is None:
+            k_date = _sign(('AWS4' + key).encode('utf-8'), date_stamp)
+            k_region = _sign(k_date, region_name)
+            k_service = _sign(k_region, service_name)
+            signing_key = _sign(k_service, 'aws4_request')
+            self.signing_keys[cache_key] = signing_key
+        return signing_key
+
+    def _presign_download_url(self, filename, db_instance_identifier, region):
         method = 'GET'
         service = 'rds'
-        region = region
-        host = 'rds.'+ region +'.amazonaws.com'
-        endpoint = 'https://' + host
+        endpoint = self.endpoint_url or 'https://rds.' + region + '.amazonaws.com'
+        host = urllib.parse.urlparse(endpoint).netloc
 
-        # creating new session for every file download
-        credentials = self.boto_session.get_credentials()
+        credentials = self._get_credentials()
+        if credentials is None or credentials.access_key is None or credentials.secret_key is None:
+            print('No access key is available in current environment. Exiting ..')
+            return None
         access_key = credentials.access_key
         secret_key = credentials.secret_key
         session_token = credentials.token
-        if access_key is None or secret_key is None:
-            print('No access key is available in current environment. Exiting ..')
-            return False
 
         t = datetime.datetime.utcnow()
         amz_date = t.strftime('%Y%m%dT%H%M%SZ') # Format date as YYYYMMDD'T'HHMMSS'Z'
@@ -97,37 +202,18 @@ class RDS:
             canonical_querystring += '&X-Amz-Security-Token=' + urllib.parse.quote_plus(session_token)
         canonical_querystring += '&X-Amz-SignedHeaders=' + signed_headers
 
-        payload_hash = hashlib.sha256(''.encode("utf-8")).hexdigest()
-
-        canonical_request = method + '\n' + canonical_uri + '\n' + canonical_querystring + '\n' + canonical_headers + '\n' + signed_headers + '\n' + payload_hash
+        canonical_request = method + '\n' + canonical_uri + '\n' + canonical_querystring + '\n' + canonical_headers + '\n' + signed_headers + '\n' + EMPTY_PAYLOAD_HASH
 
         string_to_sign = algorithm + '\n' +  amz_date + '\n' +  credential_scope + '\n' +  hashlib.sha256(canonical_request.encode("utf-8")).hexdigest()
 
-        signing_key = getSignatureKey(secret_key, datestamp, region, service)
+        signing_key = self._get_signature_key(secret_key, datestamp, region, service)
 
         signature = hmac.new(signing_key, (string_to_sign).encode("utf-8"), hashlib.sha256).hexdigest()
 
         canonical_querystring += '&X-Amz-Signature=' + signature
 
-        request_url = endpoint + canonical_uri + "?" + canonical_querystring
-
-        print(f"initiating download of {db_instance_identifier} {filename} to {output_file}")
-        r = requests.get(request_url, stream=True, allow_redirects=True)
-        if r.status_code != 200:
-            print(f"something went wrong, request status code {r.status_code}")
-            return False
-
-        error = False
-        with open(output_file, "wb") as f:
-            for chunk in r.iter_content(100000):
-                if r.status_code !=200:
-                    error = True
-                    break
-                if chunk:
-                    f.write(chunk)
-        if error:
-            os.remove(output_file)
-            print(f"failed to download file {output_file}, request status code {r.status_code}")
-            return False
-        print(f"successfully downloaded {db_instance_identifier} {filename} to {output_file}") 
-        return True
+        return endpoint + canonical_uri + "?" + canonical_querystring
+
+
+def _sign(key, msg):
+    return hmac.new(key, msg.encode('utf-8'), hashlib.sha256).digest()
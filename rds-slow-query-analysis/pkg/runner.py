@@ -0,0 +1,330 @@
+import multiprocessing
+import os
+from concurrent.futures import (FIRST_COMPLETED, ProcessPoolExecutor,
+                                ThreadPoolExecutor, wait)
+from concurrent.futures.process import BrokenProcessPool
+
+from pkg import analysis, fingerprint, manifest, sketch, storage, store
+
+
+# the parse processes are started from a clean server process, forking this one while the
+# download threads hold locks can leave a child stuck on a lock nobody will release
+PARSE_START_METHOD = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+
+
+def load_config(config_path):
+    import yaml
+
+    with open(config_path) as c:
+        return yaml.safe_load(c)
+
+
+def new_runner(config, fetch_date, publish=True):
+    return Runner(config, fetch_date, publish)
+
+
+class Runner:
+    # boto3, slack_sdk and matplotlib are only imported once something needs them,
+    # so a run that has nothing to do or doesn't publish never pays for them
+    def __init__(self, config, fetch_date, publish=True):
+        self.config = config
+        self.fetch_date = fetch_date
+        self.publish = publish
+        self._rds_client = None
+        self._slack_client = None
+        self._chart_renderer = None
+        self.publisher = None
+        # with report.fleet_chart every instance goes into a few shared grid images,
+        # posted once the whole run is done, instead of a chart and upload per instance
+        self.fleet_chart = config.get("report", {}).get("fleet_chart", False)
+        self.fleet_reports = []
+
+    @property
+    def rds_client(self):
+        if self._rds_client is None:
+            import boto3
+
+            from pkg import rds
+
+            session = boto3.Session(region_name=self.config["aws"]["region"], profile_name=self.config["aws"]["profile"])
+            self._rds_client = rds.new_rds_client(
+                session, max_connections=max(self.config.get("workers", 1), rds.DOWNLOAD_WORKERS),
+                inventory_cache=self.new_inventory_cache()
+            )
+        return self._rds_client
+
+    def new_inventory_cache(self):
+        inventory_config = self.config.get("inventory", {})
+        if not inventory_config.get("enabled", True):
+            return None
+        from rds_inventory import cache
+
+        return cache.new_inventory_cache(inventory_config.get("cache_dir"), inventory_config.get("ttl"))
+
+    @property
+    def slack_client(self):
+        if self._slack_client is None:
+            from pkg import slack
+
+            self._slack_client = slack.new_slack_client(self.config["slack"]["token"], self.config["slack"].get("base_url"))
+        return self._slack_client
+
+    @property
+    def chart_renderer(self):
+        # one figure is reused for every chart of the run
+        if self._chart_renderer is None:
+            from pkg import chart
+
+            self._chart_renderer = chart.new_bar_chart_renderer()
+        return self._chart_renderer
+
+    def run(self, identifiers=None):
+        # identifiers restricts the run to those instances, e.g. for one-off checks
+        config = self.config
+        if config.get("storage", {}).get("retention_days"):
+            storage.prune_datadir(config["datadir"], config["storage"]["retention_days"])
+        aggregate_store = store.open_store(config.get("store", {}).get("path", f"{config['datadir']}/aggregates.sqlite"))
+        try:
+            rds_config = config["rds"]
+            if identifiers:
+                rds_config = {"enableFilter": True, "filter": {"identifier": identifiers}}
+            instance_engine_dict = self.rds_client.get_instance_engine_dict(rds_config)
+            if self.publish:
+                self.start_publisher()
+            failed = self.analyse_instances(instance_engine_dict, config.get("workers", 1), aggregate_store)
+            if self.fleet_reports:
+                self.publish_fleet_report()
+            for identifier, errors in failed.items():
+                print(f"{identifier} failed: {'; '.join(errors)}")
+            return failed
+        finally:
+            aggregate_store.close()
+            if self.publisher is not None:
+                self.close_publisher()
+
+    def start_publisher(self):
+        from pkg import slack
+
+        thread_title = None
+        if self.config["slack"].get("thread", False):
+            thread_title = f"*{self.fetch_date}* queries analysis"
+        self.publisher = slack.new_slack_publisher(self.slack_client, self.config["slack"]["channel_id"], thread_title)
+
+    def close_publisher(self):
+        from pkg import slack
+
+        results = self.publisher.close()
+        self.publisher = None
+        print(slack.summarize_results(results))
+        return results
+
+    def download_log_file(self, identifier, rds_log_file, log_manifest):
+        config = self.config
+        rds_log_file_name = rds_log_file["LogFileName"]
+        local_log_file_path = storage.log_file_path(
+            f"{config['datadir']}/{identifier}/{self.fetch_date}/{rds_log_file_name}",
+            config.get("storage", {}).get("compression")
+        )
+
+        status = log_manifest.status(
+            rds_log_file_name, local_log_file_path, rds_log_file["Size"], rds_log_file["LastWritten"],
+            verify_checksum=config.get("verify_checksums", False)
+        )
+        if status == manifest.COMPLETE:
+            print(f"{local_log_file_path} already exists")
+            return local_log_file_path
+        if status == manifest.CORRUPT:
+            print(f"{local_log_file_path} failed validation, downloading it again")
+            log_manifest.discard(rds_log_file_name)
+            os.remove(local_log_file_path)
+        os.makedirs(os.path.dirname(local_log_file_path), exist_ok=True)
+
+        if self.rds_client.download_log_file(rds_log_file_name, identifier, local_log_file_path, config["aws"]["region"], resume=True):
+            log_manifest.record(rds_log_file_name, local_log_file_path, rds_log_file["Size"], rds_log_file["LastWritten"])
+            return local_log_file_path
+        print(f"failed to download log file {rds_log_file_name} of {identifier}")
+        return None
+
+    def report_message(self, identifier, aggregate_store):
+        fetch_date = self.fetch_date
+        sketches = aggregate_store.load_sketches(identifier, fetch_date, fetch_date, "instance")
+        fingerprints = aggregate_store.load_fingerprints(identifier, fetch_date, fetch_date)
+        instance_sketch = sketches.get("instance", sketch.LatencySketch())
+        duration_bucket = aggregate_store.load_duration_bucket(identifier, fetch_date, fetch_date)
+        print(f"{identifier} buckets -  {duration_bucket}")
+
+        message = f"[[ *{identifier}* ]] *{fetch_date}* queries analysis:\n"\
+                    f"*queries taken time more than 100ms: {duration_bucket['100ms']}*\n"\
+                    f"*queries taken time more than 50ms:  {duration_bucket['50ms']}*\n"\
+                    f"queries taken time more than 40ms:   {duration_bucket['40ms']}\n"\
+                    f"queries taken time more than 30ms:   {duration_bucket['30ms']}\n"
+        if instance_sketch.count:
+            message += f"p50 {instance_sketch.quantile(0.5):.1f}ms, p95 {instance_sketch.quantile(0.95):.1f}ms, "\
+                        f"p99 {instance_sketch.quantile(0.99):.1f}ms over {instance_sketch.count} logged queries\n"
+        top_queries = fingerprints.top(self.config.get("report", {}).get("top_queries", 5))
+        if top_queries:
+            message += f"top {len(top_queries)} of {len(fingerprints)} queries by total time:\n"
+            for count, total, mean, max_duration, normalized, _ in top_queries:
+                message += f"{count} calls, total {total:.1f}ms, mean {mean:.1f}ms, max {max_duration:.1f}ms `{normalized}`\n"
+        this_week, last_week = aggregate_store.week_over_week(identifier, fetch_date, weeks=2)
+        if this_week["count"] and last_week["count"]:
+            message += f"week over week: p95 {this_week['p95']:.1f}ms vs {last_week['p95']:.1f}ms, "\
+                        f"queries over 100ms {this_week['duration_bucket']['100ms']} vs {last_week['duration_bucket']['100ms']}\n"
+        return duration_bucket, message
+
+    def publish_report(self, identifier, aggregate_store):
+        duration_bucket, message = self.report_message(identifier, aggregate_store)
+        if not self.publish:
+            print(message)
+            return
+        if self.fleet_chart:
+            self.fleet_reports.append((identifier, duration_bucket))
+            print(message)
+            return
+
+        report_dir = f"{self.config['datadir']}/{identifier}/{self.fetch_date}"
+        os.makedirs(report_dir, exist_ok=True)
+        chart_output_image = f"{report_dir}/chart.png"
+        self.chart_renderer.plot_bar_chart(
+            title=f"{identifier} queries analysis",
+            yaxis_label="queries count",
+            xaxis_label="queries duration",
+            yaxis=duration_bucket.values(),
+            xaxis=[ f"> {k}" for k in duration_bucket.keys()],
+            colors=["teal", "orange", "brown", "red"],
+            output_file=chart_output_image
+        )
+
+        # uploaded by the publisher thread while the analysis goes on
+        self.publisher.publish(identifier, message, chart_output_image)
+
+    def publish_fleet_report(self):
+        fleet_reports = sorted(self.fleet_reports, key=lambda r: r[1]["100ms"], reverse=True)
+        report_dir = f"{self.config['datadir']}/fleet/{self.fetch_date}"
+        os.makedirs(report_dir, exist_ok=True)
+        chart_output_images = self.chart_renderer.plot_fleet_grids(
+            charts=[(identifier, list(b.values()), [f"> {k}" for k in b.keys()]) for identifier, b in fleet_reports],
+            yaxis_label="queries count",
+            xaxis_label="queries duration",
+            colors=["teal", "orange", "brown", "red"],
+            output_prefix=f"{report_dir}/chart"
+        )
+
+        message = f"*{self.fetch_date}* queries analysis of {len(fleet_reports)} instances, "\
+                    f"most queries over 100ms first:\n"
+        for identifier, duration_bucket in fleet_reports[:10]:
+            message += f"*{identifier}*: {duration_bucket['100ms']} over 100ms, {duration_bucket['50ms']} over 50ms\n"
+        for n, chart_output_image in enumerate(chart_output_images):
+            image_message = message if n == 0 else f"*{self.fetch_date}* queries analysis {n + 1}/{len(chart_output_images)}"
+            self.publisher.publish(f"fleet chart {n + 1}", image_message, chart_output_image)
+        self.fleet_reports = []
+
+    def save_aggregates(self, identifier, engine, duration_bucket, sketches, fingerprints, local_log_files,
+                        aggregate_store, complete):
+        config = self.config
+        store_config = config.get("store", {})
+        aggregate_store.save_day(
+            identifier, self.fetch_date, engine, duration_bucket, sketches, fingerprints,
+            store_config.get("stored_fingerprints", store.STORED_FINGERPRINTS), complete
+        )
+        if not complete:
+            # the next run lists the day again, it needs the files downloaded so far
+            print(f"{identifier} {self.fetch_date} is missing log files, it will be aggregated again next run")
+        elif store_config.get("delete_raw_logs", False):
+            for local_log_file in local_log_files:
+                print(f"removing {local_log_file}, {identifier} {self.fetch_date} is aggregated")
+                os.remove(local_log_file)
+            manifest_path = f"{config['datadir']}/{identifier}/{self.fetch_date}/{manifest.MANIFEST_FILE_NAME}"
+            if os.path.exists(manifest_path):
+                os.remove(manifest_path)
+
+    def analyse_instances(self, instance_engine_dict, workers, aggregate_store):
+        # log listing and downloads run on threads, parsing runs on processes, each
+        # finished download is handed to the process pool straight away so both overlap
+        config = self.config
+        fetch_date = self.fetch_date
+        duration_buckets = {identifier: analysis.new_duration_bucket() for identifier in instance_engine_dict}
+        sketches = {identifier: {"instance": sketch.LatencySketch()} for identifier in instance_engine_dict}
+        sketch_dimensions = config.get("report", {}).get("sketch_dimensions", [])
+        fingerprints = {identifier: fingerprint.FingerprintAggregator() for identifier in instance_engine_dict}
+        local_log_files = {identifier: [] for identifier in instance_engine_dict}
+        remaining_files = {}
+        # log files of an instance that couldn't be downloaded, the day isn't complete without them
+        failed_files = {identifier: 0 for identifier in instance_engine_dict}
+        # the errors of every instance that failed, one instance failing doesn't stop the others
+        failed = {}
+        parse_context = multiprocessing.get_context(PARSE_START_METHOD)
+        with ThreadPoolExecutor(max_workers=workers) as io_pool, \
+                ProcessPoolExecutor(max_workers=workers, mp_context=parse_context) as parse_pool:
+            pending = {}
+            for identifier in instance_engine_dict:
+                if aggregate_store.has_day(identifier, fetch_date):
+                    # already aggregated by an earlier run, the raw logs may even be gone
+                    print(f"{identifier} {fetch_date} is already aggregated")
+                    self.publish_report(identifier, aggregate_store)
+                    continue
+                f = io_pool.submit(self.rds_client.get_log_files, identifier, fetch_date, instance_engine_dict[identifier])
+                pending[f] = ("list", identifier)
+
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for f in done:
+                    step, identifier = pending.pop(f)
+                    engine = instance_engine_dict[identifier]
+                    error = f.exception()
+                    if error is not None:
+                        print(f"{step} of {identifier} failed: {error!r}")
+                        failed.setdefault(identifier, []).append(f"{step}: {error!r}")
+                        if step == "list":
+                            # nothing to aggregate, the day is listed again next run
+                            continue
+                        # a file that couldn't be downloaded or parsed leaves the day incomplete
+                        remaining_files[identifier] -= 1
+                        failed_files[identifier] += 1
+                    elif step == "list":
+                        rds_log_files = f.result()
+                        remaining_files[identifier] = len(rds_log_files)
+                        if not rds_log_files:
+                            # the logs of the day may not be there yet, a later run lists them again
+                            failed_files[identifier] += 1
+                        log_manifest = manifest.load_manifest(f"{config['datadir']}/{identifier}/{fetch_date}")
+                        for rds_log_file in rds_log_files:
+                            df = io_pool.submit(self.download_log_file, identifier, rds_log_file, log_manifest)
+                            pending[df] = ("download", identifier)
+                    elif step == "download":
+                        local_log_file = f.result()
+                        if local_log_file is None:
+                            remaining_files[identifier] -= 1
+                            failed_files[identifier] += 1
+                        else:
+                            local_log_files[identifier].append(local_log_file)
+                            try:
+                                pf = parse_pool.submit(
+                                    analysis.analyse_log_file, engine, local_log_file, fetch_date, sketch_dimensions
+                                )
+                                pending[pf] = ("parse", identifier)
+                            except BrokenProcessPool as e:
+                                # a parse process died, nothing more can be parsed this run
+                                print(f"parse of {identifier} failed: {e!r}")
+                                failed.setdefault(identifier, []).append(f"parse: {e!r}")
+                                remaining_files[identifier] -= 1
+                                failed_files[identifier] += 1
+                    elif step == "parse":
+                        file_duration_bucket, file_sketches, file_fingerprints = f.result()
+                        analysis.merge_duration_buckets(duration_buckets[identifier], file_duration_bucket)
+                        sketch.merge_sketch_dicts(sketches[identifier], file_sketches)
+                        fingerprints[identifier].merge(file_fingerprints)
+                        remaining_files[identifier] -= 1
+
+                    if remaining_files[identifier] == 0:
+                        try:
+                            self.save_aggregates(
+                                identifier, engine, duration_buckets.pop(identifier), sketches.pop(identifier),
+                                fingerprints.pop(identifier), local_log_files.pop(identifier), aggregate_store,
+                                failed_files[identifier] == 0
+                            )
+                            self.publish_report(identifier, aggregate_store)
+                        except Exception as e:
+                            print(f"report of {identifier} failed: {e!r}")
+                            failed.setdefault(identifier, []).append(f"report: {e!r}")
+        return failed
@@ -0,0 +1,101 @@
+import math
+
+RELATIVE_ACCURACY = 0.01
+# durations at or below this go into a single zero bin, they don't matter for slow queries
+MIN_TRACKED_VALUE = 0.001
+
+
+class LatencySketch:
+    # log bucketed histogram (DDSketch style): every quantile is within RELATIVE_ACCURACY
+    # of the true value, and two sketches with the same accuracy merge exactly
+    def __init__(self, relative_accuracy=RELATIVE_ACCURACY):
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.bins = {}
+        self.zero_count = 0
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def _index(self, value):
+        return math.ceil(math.log(value) / self.log_gamma)
+
+    def _value(self, index):
+        return 2 * self.gamma ** index / (self.gamma + 1)
+
+    def add(self, value):
+        self.count += 1
+        self.total += value
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+        if value <= MIN_TRACKED_VALUE:
+            self.zero_count += 1
+            return
+        index = self._index(value)
+        self.bins[index] = self.bins.get(index, 0) + 1
+
+    def merge(self, other):
+        if other.relative_accuracy != self.relative_accuracy:
+            raise ValueError("can't merge sketches with different relative accuracy")
+        for index, count in other.bins.items():
+            self.bins[index] = self.bins.get(index, 0) + count
+        self.zero_count += other.zero_count
+        self.count += other.count
+        self.total += other.total
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        return self
+
+    def quantile(self, q):
+        if self.count == 0:
+            return None
+        rank = q * (self.count - 1)
+        seen = self.zero_count
+        if rank < seen:
+            return 0.0
+        for index in sorted(self.bins):
+            seen += self.bins[index]
+            if rank < seen:
+                return min(max(self._value(index), self.min), self.max)
+        return self.max
+
+    def mean(self):
+        return self.total / self.count if self.count else None
+
+    def to_dict(self):
+        return {
+            "relative_accuracy": self.relative_accuracy,
+            "bins": {str(index): count for index, count in self.bins.items()},
+            "zero_count": self.zero_count,
+            "count": self.count,
+            "total": self.total,
+            "min": self.min if self.count else None,
+            "max": self.max if self.count else None,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        s = cls(data["relative_accuracy"])
+        s.bins = {int(index): count for index, count in data["bins"].items()}
+        s.zero_count = data["zero_count"]
+        s.count = data["count"]
+        s.total = data["total"]
+        if s.count:
+            s.min = data["min"]
+            s.max = data["max"]
+        return s
+
+
+def merge_sketch_dicts(sketches, other):
+    # sketches are kept as {"instance": sketch, "user:<name>": sketch, ...}
+    for key, s in other.items():
+        if key in sketches:
+            sketches[key].merge(s)
+        else:
+            sketches[key] = s
+    return sketches
+
@@ -1,22 +1,140 @@
-from slack_sdk.web import WebClient
+import queue
+import threading
+import time
+from collections import namedtuple
 
+MAX_ATTEMPTS = 5
+# used when a rate limited response comes without a usable Retry-After header
+DEFAULT_RETRY_AFTER = 1.0
+MAX_RETRY_AFTER = 60.0
 
-def new_slack_client(token):
-    return Slack(WebClient(token))
+# latency is the time spent sending, retries and Retry-After waits included
+PublishResult = namedtuple("PublishResult", ["key", "ok", "latency", "attempts", "error"])
+
+
+def new_slack_client(token, base_url=None):
+    # base_url points the client at another endpoint, e.g. a local fake slack for testing
+    from slack_sdk.web import WebClient
+
+    if base_url is None:
+        return Slack(WebClient(token))
+    return Slack(WebClient(token, base_url=base_url))
+
+
+def new_slack_publisher(slack, channel_id, thread_title=None):
+    return SlackPublisher(slack, channel_id, thread_title)
 
 
 class Slack:
-    def __init__(self, client):
+    def __init__(self, client, max_attempts=MAX_ATTEMPTS):
         self.client = client
+        self.max_attempts = max_attempts
+
+    def _retry_after(self, error):
+        # only rate limits are retried, anything else is raised straight away
+        response = getattr(error, "response", None)
+        if response is None or response.status_code != 429:
+            return None
+        headers = response.headers or {}
+        retry_after = headers.get("Retry-After", headers.get("retry-after"))
+        if isinstance(retry_after, list):
+            retry_after = retry_after[0] if retry_after else None
+        try:
+            return min(float(retry_after), MAX_RETRY_AFTER)
+        except (TypeError, ValueError):
+            return DEFAULT_RETRY_AFTER
+
+    def _call(self, method, **kwargs):
+        # returns the response and the number of attempts it took
+        from slack_sdk.errors import SlackApiError
+
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                return getattr(self.client, method)(**kwargs), attempt
+            except SlackApiError as e:
+                retry_after = self._retry_after(e)
+                if retry_after is None or attempt == self.max_attempts:
+                    e.attempts = attempt
+                    raise
+                print(f"slack {method} rate limited, retrying in {retry_after}s")
+                time.sleep(retry_after)
+
+    def post_message(self, channel_id, message, thread_ts=None):
+        response, _ = self._call("chat_postMessage", channel=channel_id, text=message, thread_ts=thread_ts)
+        return response["ts"]
+
+    def upload_image(self, channel_id, message, image_path, thread_ts=None):
+        # files.upload is retired, v2 gets an upload url, sends the file there and completes
+        # the upload in the channel. A rate limit at any step retries the whole upload
+        _, attempts = self._call(
+            "files_upload_v2", channel=channel_id, initial_comment=message, file=image_path, thread_ts=thread_ts
+        )
+        return attempts
 
     def publish_image_with_message(self, channel_id, message, image_path):
         try:
-            image = self.client.files_upload(
-                channels = channel_id,
-                initial_comment = message,
-                file = image_path
-            )
+            self.upload_image(channel_id, message, image_path)
         except Exception as e:
             print(e)
             return False
         return True
+
+
+class SlackPublisher:
+    # uploads run on a background thread so a slow or rate limited slack never holds
+    # up the analysis. With thread_title every upload goes as a reply to one parent
+    # message, posted along with the first upload, instead of to the channel
+    def __init__(self, slack, channel_id, thread_title=None):
+        self.slack = slack
+        self.channel_id = channel_id
+        self.thread_title = thread_title
+        self.thread_ts = None
+        self.results = []
+        self.queue = queue.Queue()
+        self.worker = threading.Thread(target=self._run, name="slack-publisher", daemon=True)
+        self.worker.start()
+
+    def publish(self, key, message, image_path):
+        self.queue.put((key, message, image_path))
+
+    def close(self):
+        # waits for everything queued so far and returns one PublishResult per upload
+        self.queue.put(None)
+        self.worker.join()
+        return self.results
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            self.results.append(self._send(*item))
+
+    def _send(self, key, message, image_path):
+        start = time.perf_counter()
+        attempts = 1
+        try:
+            if self.thread_title is not None and self.thread_ts is None:
+                self.thread_ts = self.slack.post_message(self.channel_id, self.thread_title)
+            attempts = self.slack.upload_image(self.channel_id, message, image_path, self.thread_ts)
+        except Exception as e:
+            result = PublishResult(key, False, time.perf_counter() - start, getattr(e, "attempts", attempts), str(e))
+            print(f"failed to send slack message for {key} to {self.channel_id}: {e}")
+            return result
+        result = PublishResult(key, True, time.perf_counter() - start, attempts, None)
+        print(f"successfully sent slack message for {key} to {self.channel_id} in {result.latency:.2f}s")
+        return result
+
+
+def summarize_results(results):
+    # one line for the end of a run: how many went out, how long they took, what failed
+    if not results:
+        return "no slack messages published"
+    latencies = sorted(r.latency for r in results)
+    failed = [r.key for r in results if not r.ok]
+    summary = f"published {len(results) - len(failed)}/{len(results)} slack messages, "\
+                f"latency p50 {latencies[len(latencies) // 2]:.2f}s max {latencies[-1]:.2f}s, "\
+                f"{sum(r.attempts for r in results) - len(results)} retries"
+    if failed:
+        summary += f", failed: {', '.join(failed)}"
+    return summary
@@ -0,0 +1,90 @@
+import gzip
+import io
+import os
+import shutil
+from datetime import date, datetime, timedelta
+
+COMPRESSION_SUFFIXES = {
+    None: "",
+    "none": "",
+    "gzip": ".gz",
+    "zstd": ".zst",
+}
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 3
+READ_BUFFER_SIZE = 1024 * 1024
+
+
+def _zstandard():
+    # zstandard is optional, gzip works with the standard library alone
+    try:
+        import zstandard
+    except ImportError:
+        raise RuntimeError("zstd compression needs the zstandard package, install it or use gzip") from None
+    return zstandard
+
+
+def log_file_path(path, compression):
+    if compression not in COMPRESSION_SUFFIXES:
+        raise ValueError(f"unsupported compression {compression}")
+    return path + COMPRESSION_SUFFIXES[compression]
+
+
+def is_compressed(path):
+    return path.endswith(COMPRESSION_SUFFIXES["gzip"]) or path.endswith(COMPRESSION_SUFFIXES["zstd"])
+
+
+def open_log_file_for_write(path, append=False):
+    # appending starts a new gzip member / zstd frame, readers decode them as one stream
+    mode = "ab" if append else "wb"
+    if path.endswith(COMPRESSION_SUFFIXES["gzip"]):
+        return gzip.open(path, mode, compresslevel=GZIP_LEVEL)
+    if path.endswith(COMPRESSION_SUFFIXES["zstd"]):
+        cctx = _zstandard().ZstdCompressor(level=ZSTD_LEVEL)
+        return cctx.stream_writer(open(path, mode), closefd=True)
+    return open(path, mode)
+
+
+def open_log_file(path):
+    if path.endswith(COMPRESSION_SUFFIXES["gzip"]):
+        return gzip.open(path, "rb")
+    if path.endswith(COMPRESSION_SUFFIXES["zstd"]):
+        dctx = _zstandard().ZstdDecompressor()
+        reader = dctx.stream_reader(open(path, "rb"), read_across_frames=True, closefd=True)
+        return io.BufferedReader(reader, READ_BUFFER_SIZE)
+    return open(path, "rb")
+
+
+def uncompressed_size(path):
+    # returns None when the file ends in a truncated gzip member / zstd frame
+    if not is_compressed(path):
+        return os.path.getsize(path)
+    size = 0
+    try:
+        with open_log_file(path) as f:
+            for chunk in iter(lambda: f.read(READ_BUFFER_SIZE), b""):
+                size += len(chunk)
+    except (EOFError, OSError) as e:
+        print(f"{path} is not a complete compressed stream, {e}")
+        return None
+    return size
+
+
+def prune_datadir(datadir, retention_days, today=None):
+    # datadir is laid out as <identifier>/<YYYY-MM-DD>/, anything older than the retention goes
+    today = today or date.today()
+    oldest = today - timedelta(days=retention_days)
+    if not os.path.isdir(datadir):
+        return
+    for identifier in os.listdir(datadir):
+        identifier_dir = os.path.join(datadir, identifier)
+        if not os.path.isdir(identifier_dir):
+            continue
+        for day in os.listdir(identifier_dir):
+            try:
+                day_date = datetime.strptime(day, "%Y-%m-%d").date()
+            except ValueError:
+                continue
+            if day_date < oldest:
+                print(f"removing {identifier_dir}/{day}, older than {retention_days} days")
+                shutil.rmtree(os.path.join(identifier_dir, day))
@@ -0,0 +1,168 @@
+import heapq
+import json
+import os
+import sqlite3
+from datetime import datetime, timedelta
+
+from pkg import analysis, fingerprint, sketch
+
+STORED_FINGERPRINTS = 100
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS daily_instance (
+    identifier TEXT NOT NULL,
+    day TEXT NOT NULL,
+    engine TEXT,
+    count INTEGER NOT NULL,
+    total REAL NOT NULL,
+    max REAL,
+    p50 REAL,
+    p95 REAL,
+    p99 REAL,
+    bucket_30ms INTEGER NOT NULL,
+    bucket_40ms INTEGER NOT NULL,
+    bucket_50ms INTEGER NOT NULL,
+    bucket_100ms INTEGER NOT NULL,
+    complete INTEGER NOT NULL DEFAULT 1,
+    PRIMARY KEY (identifier, day)
+);
+CREATE TABLE IF NOT EXISTS daily_sketch (
+    identifier TEXT NOT NULL,
+    day TEXT NOT NULL,
+    sketch_key TEXT NOT NULL,
+    sketch TEXT NOT NULL,
+    PRIMARY KEY (identifier, day, sketch_key)
+);
+CREATE TABLE IF NOT EXISTS daily_fingerprint (
+    identifier TEXT NOT NULL,
+    day TEXT NOT NULL,
+    fingerprint TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    total REAL NOT NULL,
+    max REAL NOT NULL,
+    normalized TEXT NOT NULL,
+    sample TEXT NOT NULL,
+    PRIMARY KEY (identifier, day, fingerprint)
+);
+"""
+
+
+def open_store(path):
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    return AggregateStore(sqlite3.connect(path))
+
+
+class AggregateStore:
+    # per instance and day aggregates, so reports and trends never need the raw logs again
+    def __init__(self, conn):
+        self.conn = conn
+        self.conn.executescript(SCHEMA)
+        columns = [row[1] for row in self.conn.execute("PRAGMA table_info(daily_instance)")]
+        if "complete" not in columns:
+            # stores from before the flag, their days were all saved as complete
+            with self.conn:
+                self.conn.execute("ALTER TABLE daily_instance ADD COLUMN complete INTEGER NOT NULL DEFAULT 1")
+
+    def has_day(self, identifier, day):
+        # only complete days count, a day saved with logs missing is aggregated again
+        row = self.conn.execute(
+            "SELECT 1 FROM daily_instance WHERE identifier = ? AND day = ? AND complete", (identifier, day)
+        ).fetchone()
+        return row is not None
+
+    def save_day(self, identifier, day, engine, duration_bucket, sketches, fingerprints,
+                 stored_fingerprints=STORED_FINGERPRINTS, complete=True):
+        # complete is False when some log files of the day couldn't be downloaded or parsed
+        instance_sketch = sketches["instance"]
+        top = heapq.nlargest(
+            stored_fingerprints, fingerprints.fingerprints.items(), key=lambda kv: kv[1][fingerprint.TOTAL]
+        )
+        with self.conn:
+            for table in ["daily_instance", "daily_sketch", "daily_fingerprint"]:
+                self.conn.execute(f"DELETE FROM {table} WHERE identifier = ? AND day = ?", (identifier, day))
+            self.conn.execute(
+                "INSERT INTO daily_instance VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    identifier, day, engine, instance_sketch.count, instance_sketch.total,
+                    instance_sketch.max if instance_sketch.count else None,
+                    instance_sketch.quantile(0.5), instance_sketch.quantile(0.95), instance_sketch.quantile(0.99),
+                    duration_bucket["30ms"], duration_bucket["40ms"], duration_bucket["50ms"], duration_bucket["100ms"],
+                    int(complete),
+                )
+            )
+            self.conn.executemany(
+                "INSERT INTO daily_sketch VALUES (?, ?, ?, ?)",
+                [(identifier, day, key, json.dumps(s.to_dict())) for key, s in sketches.items()]
+            )
+            self.conn.executemany(
+                "INSERT INTO daily_fingerprint VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (identifier, day, f"{key:016x}", e[fingerprint.COUNT], e[fingerprint.TOTAL], e[fingerprint.MAX],
+                     e[fingerprint.NORMALIZED], e[fingerprint.SAMPLE])
+                    for key, e in top
+                ]
+            )
+
+    def load_duration_bucket(self, identifier, start_day, end_day):
+        # the exact bucket counts summed over every stored day from start_day to end_day
+        row = self.conn.execute(
+            "SELECT SUM(bucket_30ms), SUM(bucket_40ms), SUM(bucket_50ms), SUM(bucket_100ms) FROM daily_instance"
+            " WHERE identifier = ? AND day BETWEEN ? AND ?",
+            (identifier, start_day, end_day)
+        ).fetchone()
+        return {name: count or 0 for (name, _), count in zip(analysis.DURATION_BUCKETS, row)}
+
+    def load_sketches(self, identifier, start_day, end_day, sketch_key=None):
+        # merged over every stored day from start_day to end_day, both included
+        sketches = {}
+        query = "SELECT sketch_key, sketch FROM daily_sketch WHERE identifier = ? AND day BETWEEN ? AND ?"
+        params = (identifier, start_day, end_day)
+        if sketch_key is not None:
+            query += " AND sketch_key = ?"
+            params += (sketch_key,)
+        rows = self.conn.execute(query, params)
+        for key, data in rows:
+            sketch.merge_sketch_dicts(sketches, {key: sketch.LatencySketch.from_dict(json.loads(data))})
+        return sketches
+
+    def load_fingerprints(self, identifier, start_day, end_day):
+        aggregator = fingerprint.FingerprintAggregator()
+        rows = self.conn.execute(
+            "SELECT fingerprint, SUM(count), SUM(total), MAX(max), MIN(normalized), MIN(sample) FROM daily_fingerprint"
+            " WHERE identifier = ? AND day BETWEEN ? AND ? GROUP BY fingerprint",
+            (identifier, start_day, end_day)
+        )
+        for key, count, total, max_duration, normalized, sample in rows:
+            aggregator.fingerprints[int(key, 16)] = [count, total, max_duration, normalized, sample]
+        return aggregator
+
+    def week_over_week(self, identifier, end_day, weeks=2):
+        # one row per week ending at end_day, newest first, buckets summed from the daily rows
+        # and percentiles from the merged daily sketches
+        end = datetime.strptime(end_day, "%Y-%m-%d").date()
+        trend = []
+        for week in range(weeks):
+            week_end = (end - timedelta(days=7 * week)).strftime("%Y-%m-%d")
+            week_start = (end - timedelta(days=7 * week + 6)).strftime("%Y-%m-%d")
+            row = self.conn.execute(
+                "SELECT COUNT(*), SUM(count), SUM(bucket_30ms), SUM(bucket_40ms), SUM(bucket_50ms), SUM(bucket_100ms)"
+                " FROM daily_instance WHERE identifier = ? AND day BETWEEN ? AND ?",
+                (identifier, week_start, week_end)
+            ).fetchone()
+            days, count, b30, b40, b50, b100 = row
+            week_sketch = self.load_sketches(identifier, week_start, week_end, "instance").get("instance")
+            trend.append({
+                "start": week_start,
+                "end": week_end,
+                "days": days,
+                "count": count or 0,
+                "duration_bucket": {"30ms": b30 or 0, "40ms": b40 or 0, "50ms": b50 or 0, "100ms": b100 or 0},
+                "p50": week_sketch.quantile(0.5) if week_sketch else None,
+                "p95": week_sketch.quantile(0.95) if week_sketch else None,
+                "p99": week_sketch.quantile(0.99) if week_sketch else None,
+            })
+        return trend
+
+    def close(self):
+        self.conn.close()
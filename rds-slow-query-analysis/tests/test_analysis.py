@@ -0,0 +1,68 @@
+import os
+import random
+import sqlite3
+import tempfile
+import unittest
+
+from pkg import analysis, store
+
+DATE = "2022-08-09"
+# right on, just under and just over every bucket bound, where a sketch bin gets split
+DURATIONS = [29.99, 30.0, 30.01, 39.9, 40.0, 40.001, 49.5, 50.0, 50.2, 99.99, 100.0, 100.01, 250.0, 12.0]
+
+
+def log_line(duration):
+    return f"{DATE} 04:00:00 UTC:10.0.0.1(5432):app@orders:[123]:LOG:  duration: {duration:.3f} ms  statement: select 1\n"
+
+
+def exact_bucket(durations):
+    return {
+        "30ms": sum(30 < d <= 40 for d in durations),
+        "40ms": sum(40 < d <= 50 for d in durations),
+        "50ms": sum(50 < d <= 100 for d in durations),
+        "100ms": sum(d > 100 for d in durations),
+    }
+
+
+class DurationBucketTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def write_log(self, name, durations):
+        path = os.path.join(self.dir.name, name)
+        with open(path, "w") as f:
+            f.writelines(log_line(d) for d in durations)
+        return path
+
+    def test_counts_are_exact_at_the_bounds(self):
+        duration_bucket, sketches, _ = analysis.analyse_log_file("postgres", self.write_log("a.log", DURATIONS), DATE)
+        self.assertEqual(duration_bucket, exact_bucket(DURATIONS))
+        self.assertEqual(duration_bucket, {"30ms": 3, "40ms": 3, "50ms": 3, "100ms": 2})
+        self.assertEqual(sketches["instance"].count, len(DURATIONS))
+
+    def test_counts_merge_and_store_exactly(self):
+        rng = random.Random(8)
+        files = [[round(rng.lognormvariate(3.6, 0.6), 3) for _ in range(2000)] for _ in range(3)]
+        duration_bucket = analysis.new_duration_bucket()
+        sketches = None
+        for n, durations in enumerate(files):
+            file_bucket, file_sketches, fingerprints = analysis.analyse_log_file(
+                "postgres", self.write_log(f"{n}.log", durations), DATE
+            )
+            analysis.merge_duration_buckets(duration_bucket, file_bucket)
+            sketches = sketches or file_sketches
+        expected = exact_bucket([d for durations in files for d in durations])
+        self.assertEqual(duration_bucket, expected)
+
+        aggregate_store = store.AggregateStore(sqlite3.connect(":memory:"))
+        aggregate_store.save_day("db-1", DATE, "postgres", duration_bucket, sketches, fingerprints)
+        self.assertEqual(aggregate_store.load_duration_bucket("db-1", DATE, DATE), expected)
+        self.assertEqual(aggregate_store.load_duration_bucket("db-2", DATE, DATE),
+                         {"30ms": 0, "40ms": 0, "50ms": 0, "100ms": 0})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,70 @@
+import io
+import os
+import tempfile
+import unittest
+
+from parsers import mysql
+
+DATE = "2022-08-09"
+# a restart between the two records, as rds writes it into the slow query log
+LOG = b"""/rdsdbbin/mysql/bin/mysqld, Version: 8.0.28 (Source distribution). started with:
+Tcp port: 3306  Unix socket: /tmp/mysql.sock
+Time                 Id Command    Argument
+# Time: 2022-08-09T04:00:01.123456Z
+# User@Host: app[app] @  [10.0.0.1]  Id:   123
+# Query_time: 0.045123  Lock_time: 0.000012 Rows_sent: 1  Rows_examined: 100
+use orders;
+SET timestamp=1660017601;
+SELECT * FROM orders
+WHERE id = 1;
+/rdsdbbin/mysql/bin/mysqld, Version: 8.0.28 (Source distribution). started with:
+Tcp port: 3306  Unix socket: /tmp/mysql.sock
+Time                 Id Command    Argument
+# Time: 2022-08-09T04:05:00.000001Z
+# User@Host: app[app] @  [10.0.0.2]  Id:     7
+# Query_time: 1.500000  Lock_time: 0.000000 Rows_sent: 0  Rows_examined: 0
+SET timestamp=1660017900;
+select sleep(1.5);
+# Time: 2022-08-09T04:06:00.000001Z
+# User@Host: app[app] @  [10.0.0.2]  Id:     7
+# Query_time: 0.031000  Lock_time: 0.000000 Rows_sent: 0  Rows_examined: 0
+SET timestamp=1660017960;
+select 1;
+/rdsdbbin/mysql/bin/mysqld, Version: 8.0.28 (Source distribution). started with:
+Tcp port: 3306  Unix socket: /tmp/mysql.sock
+Time                 Id Command    Argument
+"""
+EXPECTED = [
+    (45.123, "app", "orders", "SELECT * FROM orders WHERE id = 1;"),
+    (1500.0, "app", None, "select sleep(1.5);"),
+    (31.0, "app", None, "select 1;"),
+]
+
+
+class RestartBannerTest(unittest.TestCase):
+    def check(self, records):
+        self.assertEqual(
+            [(round(r.duration, 3), r.user, r.database, r.statement) for r in records], EXPECTED
+        )
+
+    def test_scan_log_buffer(self):
+        self.check(list(mysql.scan_log_buffer(LOG, DATE, with_statement=True)))
+
+    def test_scan_log_stream(self):
+        self.check(list(mysql.scan_log_stream(io.BytesIO(LOG), DATE, with_statement=True)))
+
+    def test_scan_log_file(self):
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, "mysql-slowquery.log")
+            with open(path, "wb") as f:
+                f.write(LOG)
+            self.check(list(mysql.scan_log_file(path, DATE, with_statement=True)))
+
+    def test_offsets_point_at_the_body(self):
+        for record in mysql.scan_log_buffer(LOG, DATE):
+            self.assertNotEqual(LOG[record.offset:record.offset + 1], b"#")
+            self.assertEqual(LOG[record.offset - 1:record.offset], b"\n")
+
+
+if __name__ == "__main__":
+    unittest.main()
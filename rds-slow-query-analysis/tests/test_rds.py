@@ -0,0 +1,158 @@
+import os
+import tempfile
+import threading
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+
+from botocore.credentials import Credentials
+
+from pkg import rds
+
+# usage: python -m unittest discover tests
+LOG = b"".join(f"2022-08-09 04:00:{i % 60:02d} UTC:duration: {i}.000 ms\n".encode() for i in range(1000))
+
+
+class FakeSession:
+    profile_name = "test"
+    region_name = "eu-west-1"
+
+    def get_credentials(self):
+        return Credentials("AKIDEXAMPLE", "secret")
+
+
+class FakeLogHandler(BaseHTTPRequestHandler):
+    # answers the first entries of server.failures with that status, then serves LOG and
+    # honours the Range header like the rds download endpoint
+    def do_GET(self):
+        self.server.requests.append((self.path, self.headers.get("Range")))
+        try:
+            status, body = self.server.failures.pop(0)
+        except IndexError:
+            pass
+        else:
+            return self._reply(status, body)
+        range_header = self.headers.get("Range")
+        if range_header is None:
+            return self._reply(200, LOG)
+        offset = int(range_header[len("bytes="):-1])
+        if offset >= len(LOG):
+            return self._reply(416, b"")
+        self._reply(206, LOG[offset:], {"Content-Range": f"bytes {offset}-{len(LOG) - 1}/{len(LOG)}"})
+
+    def _reply(self, status, body, headers=None):
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class DownloadLogFileTest(unittest.TestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), FakeLogHandler)
+        self.server.requests = []
+        self.server.failures = []
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.client = rds.RDS(None, FakeSession(), f"http://127.0.0.1:{self.server.server_port}")
+        self.dir = tempfile.TemporaryDirectory()
+        self.output_file = os.path.join(self.dir.name, "postgresql.log.2022-08-09-04")
+        patcher = mock.patch.object(rds, "DOWNLOAD_BACKOFF_BASE", 0)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.dir.cleanup()
+
+    def download(self, resume=False):
+        return self.client.download_log_file(
+            "error/postgresql.log.2022-08-09-04", "db-1", self.output_file, "eu-west-1", resume
+        )
+
+    def read_output(self):
+        with open(self.output_file, "rb") as f:
+            return f.read()
+
+    def test_download(self):
+        self.assertTrue(self.download())
+        self.assertEqual(self.read_output(), LOG)
+        path, range_header = self.server.requests[0]
+        self.assertTrue(path.startswith("/v13/downloadCompleteLogFile/db-1/error/postgresql.log.2022-08-09-04?"))
+        self.assertIn("X-Amz-Signature=", path)
+        self.assertIsNone(range_header)
+
+    def test_retries_throttling(self):
+        self.server.failures = [(400, b"<Code>Throttling</Code>"), (503, b""), (429, b"")]
+        self.assertTrue(self.download())
+        self.assertEqual(len(self.server.requests), 4)
+        self.assertEqual(self.read_output(), LOG)
+
+    def test_gives_up_after_max_attempts(self):
+        self.server.failures = [(503, b"")] * rds.DOWNLOAD_MAX_ATTEMPTS
+        self.assertFalse(self.download())
+        self.assertEqual(len(self.server.requests), rds.DOWNLOAD_MAX_ATTEMPTS)
+
+    def test_does_not_retry_other_errors(self):
+        self.server.failures = [(403, b"<Code>AccessDenied</Code>")]
+        self.assertFalse(self.download())
+        self.assertEqual(len(self.server.requests), 1)
+
+    def test_resume_requests_the_rest(self):
+        with open(self.output_file, "wb") as f:
+            f.write(LOG[:1234])
+        self.assertTrue(self.download(resume=True))
+        self.assertEqual(self.server.requests[0][1], "bytes=1234-")
+        self.assertEqual(self.read_output(), LOG)
+
+    def test_resume_after_throttling(self):
+        with open(self.output_file, "wb") as f:
+            f.write(LOG[:100])
+        self.server.failures = [(400, b"Throttling")]
+        self.assertTrue(self.download(resume=True))
+        self.assertEqual([r for _, r in self.server.requests], ["bytes=100-", "bytes=100-"])
+        self.assertEqual(self.read_output(), LOG)
+
+    def test_resume_of_a_complete_file(self):
+        with open(self.output_file, "wb") as f:
+            f.write(LOG)
+        self.assertTrue(self.download(resume=True))
+        self.assertEqual(self.server.requests[0][1], f"bytes={len(LOG)}-")
+        self.assertEqual(self.read_output(), LOG)
+
+    def test_without_resume_the_file_is_replaced(self):
+        with open(self.output_file, "wb") as f:
+            f.write(b"stale")
+        self.assertTrue(self.download())
+        self.assertIsNone(self.server.requests[0][1])
+        self.assertEqual(self.read_output(), LOG)
+
+    def test_concurrent_downloads(self):
+        # the runner downloads every log file of the run from its io pool through one RDS client
+        # and its pooled session, some of the requests get throttled on the way
+        self.server.failures = [(400, b"Throttling"), (503, b""), (429, b"")]
+        output_files = [os.path.join(self.dir.name, f"postgresql.log.2022-08-09-{hour:02d}") for hour in range(12)]
+        with ThreadPoolExecutor(max_workers=rds.DOWNLOAD_WORKERS) as pool:
+            results = list(pool.map(
+                lambda output_file: self.client.download_log_file(
+                    f"error/{os.path.basename(output_file)}", "db-1", output_file, "eu-west-1", True
+                ),
+                output_files
+            ))
+        self.assertEqual(results, [True] * len(output_files))
+        self.assertEqual(len(self.server.requests), len(output_files) + 3)
+        for output_file in output_files:
+            with open(output_file, "rb") as f:
+                self.assertEqual(f.read(), LOG)
+        requested = {path.split("?")[0].rsplit("/", 1)[-1] for path, _ in self.server.requests}
+        self.assertEqual(requested, {os.path.basename(output_file) for output_file in output_files})
+
+
+if __name__ == "__main__":
+    unittest.main()
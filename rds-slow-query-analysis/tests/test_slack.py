@@ -0,0 +1,143 @@
+import json
+import os
+import tempfile
+import threading
+import time
+import unittest
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+
+from slack_sdk.errors import SlackApiError
+
+from pkg import slack
+
+
+class FakeSlackHandler(BaseHTTPRequestHandler):
+    # answers the first api calls with the entries of server.failures, as (status, body, headers)
+    # or None to answer like slack does. Every call is kept in server.calls as (method, params)
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if self.path.startswith("/upload/"):
+            self.server.uploads.append(body)
+            return self._reply(200, {"ok": True})
+        method = self.path.rsplit("/", 1)[-1]
+        self.server.calls.append((method, dict(urllib.parse.parse_qsl(body.decode()))))
+        failure = self.server.failures.pop(0) if self.server.failures else None
+        if failure:
+            return self._reply(*failure)
+        if method == "chat.postMessage":
+            self._reply(200, {"ok": True, "ts": "1660000000.000100"})
+        elif method == "files.getUploadURLExternal":
+            self._reply(200, {"ok": True, "upload_url": f"http://{self.headers['Host']}/upload/F0", "file_id": "F0"})
+        elif method == "files.completeUploadExternal":
+            self._reply(200, {"ok": True, "files": [{"id": "F0"}]})
+        else:
+            self._reply(404, {"ok": False, "error": "unknown_method"})
+
+    def _reply(self, status, body, headers=None):
+        payload = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *args):
+        pass
+
+
+RATE_LIMITED = (429, {"ok": False, "error": "ratelimited"}, {"Retry-After": "0.2"})
+
+
+class SlackTest(unittest.TestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), FakeSlackHandler)
+        self.server.calls = []
+        self.server.uploads = []
+        self.server.failures = []
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.slack = slack.new_slack_client("xoxb-fake", f"http://127.0.0.1:{self.server.server_port}/api/")
+        image = tempfile.NamedTemporaryFile(suffix=".png", delete=False)
+        image.write(b"\x89PNG fake")
+        image.close()
+        self.image = image.name
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        os.remove(self.image)
+
+    def methods(self):
+        return [method for method, _ in self.server.calls]
+
+    def test_upload_image(self):
+        attempts = self.slack.upload_image("C0", "report", self.image, "1660000000.000100")
+        self.assertEqual(attempts, 1)
+        self.assertEqual(self.methods(), ["files.getUploadURLExternal", "files.completeUploadExternal"])
+        self.assertEqual(self.server.uploads, [b"\x89PNG fake"])
+        complete = self.server.calls[1][1]
+        self.assertEqual(complete["channel_id"], "C0")
+        self.assertEqual(complete["initial_comment"], "report")
+        self.assertEqual(complete["thread_ts"], "1660000000.000100")
+
+    def test_rate_limit_waits_for_retry_after(self):
+        self.server.failures = [RATE_LIMITED]
+        start = time.perf_counter()
+        attempts = self.slack.upload_image("C0", "report", self.image)
+        self.assertGreaterEqual(time.perf_counter() - start, 0.2)
+        self.assertEqual(attempts, 2)
+        self.assertEqual(len(self.server.uploads), 1)
+
+    def test_rate_limit_on_a_later_step_retries_the_upload(self):
+        self.server.failures = [None, RATE_LIMITED]
+        attempts = self.slack.upload_image("C0", "report", self.image)
+        self.assertEqual(attempts, 2)
+        self.assertEqual(self.methods(), ["files.getUploadURLExternal", "files.completeUploadExternal"] * 2)
+
+    def test_retry_after_without_a_value(self):
+        self.server.failures = [(429, {"ok": False, "error": "ratelimited"})]
+        with mock.patch.object(slack, "DEFAULT_RETRY_AFTER", 0.05):
+            self.assertEqual(self.slack.upload_image("C0", "report", self.image), 2)
+
+    def test_retry_after_is_capped(self):
+        self.server.failures = [(429, {"ok": False, "error": "ratelimited"}, {"Retry-After": "3600"})]
+        start = time.perf_counter()
+        with mock.patch.object(slack, "MAX_RETRY_AFTER", 0.05):
+            self.assertEqual(self.slack.upload_image("C0", "report", self.image), 2)
+        self.assertLess(time.perf_counter() - start, 5)
+
+    def test_gives_up_after_max_attempts(self):
+        self.slack.max_attempts = 3
+        self.server.failures = [(429, {"ok": False, "error": "ratelimited"}, {"Retry-After": "0"})] * 3
+        with self.assertRaises(SlackApiError) as raised:
+            self.slack.upload_image("C0", "report", self.image)
+        self.assertEqual(raised.exception.attempts, 3)
+        self.assertEqual(len(self.server.calls), 3)
+
+    def test_other_errors_are_not_retried(self):
+        self.server.failures = [(200, {"ok": False, "error": "channel_not_found"})]
+        with self.assertRaises(SlackApiError) as raised:
+            self.slack.upload_image("C0", "report", self.image)
+        self.assertEqual(raised.exception.attempts, 1)
+        self.assertEqual(len(self.server.calls), 1)
+
+    def test_publisher_threads_uploads_and_reports_failures(self):
+        publisher = slack.new_slack_publisher(self.slack, "C0", "run")
+        # the parent message is rate limited once, then posted
+        self.server.failures = [RATE_LIMITED]
+        publisher.publish("db-1", "report 1", self.image)
+        publisher.publish("db-2", "report 2", self.image)
+        results = publisher.close()
+        self.assertEqual([(r.key, r.ok) for r in results], [("db-1", True), ("db-2", True)])
+        self.assertEqual(self.methods().count("chat.postMessage"), 2)
+        self.assertEqual(self.methods().count("files.completeUploadExternal"), 2)
+        threads = {params.get("thread_ts") for method, params in self.server.calls
+                   if method == "files.completeUploadExternal"}
+        self.assertEqual(threads, {"1660000000.000100"})
+
+
+if __name__ == "__main__":
+    unittest.main()
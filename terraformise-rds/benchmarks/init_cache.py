@@ -0,0 +1,77 @@
+import os
+import sys
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+# usage: python -m benchmarks.init_cache
+# inits every group with benchmarks/fake_terraform twice, the provider has to be downloaded once
+# for all of them, the inits after that run at the same time and the second round is skipped,
+# with the cli config of the user kept
+BENCH_GROUPS = int(os.getenv("BENCH_GROUPS", "8"))
+FAKE_TERRAFORM = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fake_terraform")
+USER_CONFIG = 'disable_checkpoint = true\nplugin_cache_dir = "/somewhere/else"\n'
+PROVIDERS_TF = """terraform {
+  required_providers {
+    aws = {
+      source  = "hashicorp/aws"
+      version = "~> 4.5.0"
+    }
+  }
+}
+"""
+
+
+def check(name, ok):
+    print(f"{'ok' if ok else 'FAILED'}\t{name}")
+    return ok
+
+
+if __name__ == "__main__":
+    work = tempfile.mkdtemp()
+    user_config = os.path.join(work, "terraformrc")
+    with open(user_config, "w") as f:
+        f.write(USER_CONFIG)
+    log = os.path.join(work, "calls.log")
+    os.environ.update(
+        TERRAFORM013=FAKE_TERRAFORM, TF_CLI_CONFIG_FILE=user_config, FAKE_TERRAFORM_LOG=log,
+        TF_PLUGIN_CACHE_DIR=os.path.join(work, "plugin-cache")
+    )
+    # the settings are read when the module is imported
+    import upgrade_terraform
+
+    groups = []
+    for n in range(BENCH_GROUPS):
+        group = os.path.join(work, "groups", f"group-{n}")
+        os.makedirs(group)
+        with open(os.path.join(group, "providers.tf"), "w") as f:
+            f.write(PROVIDERS_TF)
+        groups.append(group)
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        first = list(executor.map(upgrade_terraform.do_tf013_init, groups))
+        second = list(executor.map(upgrade_terraform.do_tf013_init, groups))
+    with open(log) as f:
+        calls = [line.split()[0] for line in f]
+    running = most_running = 0
+    for call in calls:
+        running += {"init": 1, "done": -1}.get(call, 0)
+        most_running = max(most_running, running)
+    with open(f"{upgrade_terraform.PLUGIN_CACHE_DIR}.tfrc") as f:
+        run_config = f.read()
+    with open(user_config) as f:
+        kept_config = f.read()
+
+    results = [
+        check("every init succeeded", not any(first + second)),
+        check(f"one init per group, got {calls.count('init')}", calls.count("init") == BENCH_GROUPS),
+        check(f"one provider download, got {calls.count('download')}", calls.count("download") == 1),
+        check(f"inits ran at the same time, at most {most_running}", most_running > 1),
+        check("cli config built once", upgrade_terraform._cli_config.cache_info().misses == 1),
+        check("user config left as it was", kept_config == USER_CONFIG),
+        check("run config keeps the user settings", "disable_checkpoint = true" in run_config),
+        check(
+            "run config points at the plugin cache",
+            run_config.count("plugin_cache_dir") == 1 and upgrade_terraform.PLUGIN_CACHE_DIR in run_config
+        ),
+    ]
+    sys.exit(0 if all(results) else 1)
@@ -0,0 +1,211 @@
+import os
+import re
+import tempfile
+
+ATTRIBUTE = re.compile(r"\s*([A-Za-z_][\w-]*)\s*=(?!=)")
+BLOCK = re.compile(r"\s*([A-Za-z_][\w-]*)((?:\s+(?:\"[^\"]*\"|[A-Za-z_][\w-]*))*)\s*\{")
+HEREDOC = re.compile(r"<<-?\s*([A-Za-z_]\w*)\s*$")
+OPENING = "{[("
+CLOSING = "}])"
+
+
+class _Scanner:
+    # counts the brackets a line opens or closes, leaving out strings, interpolations,
+    # comments and heredocs. Its state carries over from line to line
+    def __init__(self):
+        self.heredoc = None
+        self.comment = False
+
+    def depth_change(self, line):
+        if self.heredoc:
+            if line.strip() == self.heredoc:
+                self.heredoc = None
+            return 0
+        depth = 0
+        # modes is a stack of "code", "string" and "interp", interp keeps the depth it started at
+        modes = ["code"]
+        interp_depths = []
+        i = 0
+        while i < len(line):
+            c = line[i]
+            two = line[i:i + 2]
+            if self.comment:
+                if two == "*/":
+                    self.comment = False
+                    i += 1
+            elif modes[-1] == "string":
+                if c == "\\":
+                    i += 1
+                elif two == "${" or two == "%{":
+                    modes.append("interp")
+                    interp_depths.append(depth)
+                    depth += 1
+                    i += 1
+                elif c == "\"":
+                    modes.pop()
+            elif c == "\"":
+                modes.append("string")
+            elif c == "#" or two == "//":
+                break
+            elif two == "/*":
+                self.comment = True
+                i += 1
+            elif two == "<<" and modes[-1] == "code" and HEREDOC.match(line, i):
+                self.heredoc = HEREDOC.match(line, i).group(1)
+                break
+            elif c in OPENING:
+                depth += 1
+            elif c in CLOSING:
+                depth -= 1
+                if modes[-1] == "interp" and depth == interp_depths[-1]:
+                    modes.pop()
+                    interp_depths.pop()
+            i += 1
+        return depth
+
+
+class Attribute:
+    # name = value, lines holds every line of a value spread over several lines
+    def __init__(self, name, lines):
+        self.name = name
+        self.lines = lines
+
+    def render(self):
+        return "".join(self.lines)
+
+
+class Text:
+    # blank lines, comments and anything else kept as it is
+    def __init__(self, lines):
+        self.lines = lines
+
+    def render(self):
+        return "".join(self.lines)
+
+
+class Block:
+    # type "label" "label" { items }, a block opened and closed on one line has no items
+    # and keeps its line as the header
+    def __init__(self, type, labels, header, items=None, footer=""):
+        self.type = type
+        self.labels = labels
+        self.header = header
+        self.items = items or []
+        self.footer = footer
+
+    def blocks(self, type=None):
+        return [item for item in self.items if isinstance(item, Block) and type in (None, item.type)]
+
+    def attribute(self, name):
+        return next((item for item in self.items if isinstance(item, Attribute) and item.name == name), None)
+
+    def remove(self, *names):
+        # drops the attributes of this block with those names, nested blocks keep theirs
+        removed = [item for item in self.items if isinstance(item, Attribute) and item.name in names]
+        self.items = [item for item in self.items if item not in removed]
+        return removed
+
+    def set(self, name, value):
+        # replaces the attribute, or adds it as the first one of the block. False when it
+        # already had that value
+        line = f"{self._indent()}{name} = {value}\n"
+        existing = self.attribute(name)
+        if existing and existing.render().strip() == line.strip():
+            return False
+        if existing:
+            existing.lines = [line]
+        else:
+            self.items.insert(0, Attribute(name, [line]))
+        return True
+
+    def _indent(self):
+        for item in self.items:
+            if isinstance(item, (Attribute, Block)):
+                first = item.lines[0] if isinstance(item, Attribute) else item.header
+                return first[:len(first) - len(first.lstrip())]
+        return self.header[:len(self.header) - len(self.header.lstrip())] + "  "
+
+    def render(self):
+        return self.header + "".join(item.render() for item in self.items) + self.footer
+
+
+class Document(Block):
+    # the top level of a .tf file, a block without header or footer
+    def __init__(self, items):
+        super().__init__(None, (), "", items)
+
+    def resources(self, resource_type):
+        return [b for b in self.blocks("resource") if b.labels[:1] == (resource_type,)]
+
+
+def _labels(text):
+    return tuple(label.strip("\"") for label in text.split())
+
+
+def _parse_items(lines, i, scanner, nested):
+    # reads items until the } closing a nested block, returns (items, footer, next line)
+    items = []
+    while i < len(lines):
+        line = lines[i]
+        change = scanner.depth_change(line)
+        if nested and change < 0 and line.lstrip().startswith("}"):
+            return items, line, i + 1
+        attribute = ATTRIBUTE.match(line)
+        block = None if attribute else BLOCK.match(line)
+        if block and change > 0:
+            nested_items, footer, i = _parse_items(lines, i + 1, scanner, True)
+            items.append(Block(block.group(1), _labels(block.group(2)), line, nested_items, footer))
+            continue
+        # an attribute or anything else runs on until its brackets and heredoc are closed
+        end = i + 1
+        depth = change
+        while end < len(lines) and (depth > 0 or scanner.heredoc):
+            depth += scanner.depth_change(lines[end])
+            end += 1
+        if attribute:
+            items.append(Attribute(attribute.group(1), lines[i:end]))
+        elif block:
+            items.append(Block(block.group(1), _labels(block.group(2)), "".join(lines[i:end])))
+        else:
+            items.append(Text(lines[i:end]))
+        i = end
+    return items, "", i
+
+
+def parse(text):
+    items, _, _ = _parse_items(text.splitlines(keepends=True), 0, _Scanner(), False)
+    return Document(items)
+
+
+def write_atomic(path, text):
+    # a crash mid write leaves the old file, never half of the new one
+    directory = os.path.dirname(path) or "."
+    with tempfile.NamedTemporaryFile("w", dir=directory, prefix=".", suffix=".tmp", delete=False) as f:
+        f.write(text)
+    # the temporary file is only readable by its owner, the new one keeps the old mode
+    if os.path.exists(path):
+        os.chmod(f.name, os.stat(path).st_mode & 0o7777)
+    os.replace(f.name, path)
+
+
+def transform_file(path, rules):
+    # rules is a list of (resource_type, rule), every rule(path, block) changes the resource
+    # blocks of its type in place. The file is read and parsed once and only written back
+    # if a rule changed it
+    with open(path) as f:
+        text = f.read()
+    document = parse(text)
+    for resource_type, rule in rules:
+        for block in document.resources(resource_type):
+            rule(path, block)
+    transformed = document.render()
+    if transformed != text:
+        write_atomic(path, transformed)
+        return True
+    return False
+
+
+def transform_tree(root, filename, rules):
+    # reapplies the rules to every generated file with that name under root
+    paths = [os.path.join(d, filename) for d, _, files in os.walk(root) if filename in files]
+    return sum(transform_file(path, rules) for path in paths), len(paths)
@@ -1,11 +1,20 @@
+import argparse
 import csv
+import hashlib
+import json
 import logging
 import os
-import subprocess
+import shutil
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from math import fabs
 
 import boto3
+from rds_inventory import cache
 
+import hcl
+from runner import COMMANDS
 from upgrade_terraform import (do_tf013_init, do_tf013_plan, do_tf013_refresh,
                                do_tf13_upgrade, do_tf_fmt,
                                do_tf_init_reconfigure,
@@ -22,10 +31,32 @@ REGION = os.environ.get("REGION")
 AWS_PROFILE = os.environ.get("AWS_PROFILE")
 RDS_CLIENT = boto3.Session(region_name=REGION, profile_name=AWS_PROFILE).client("rds")
 REPORTS_DIR = "./reports"
+# groups imported at the same time, every group works in its own rds/{profile}/{region}/{group}
+GENERATE_WORKERS = int(os.environ.get("GENERATE_WORKERS", 4))
+# the outcome of the last run of every group, --rerun-failed picks the failed ones from here
+GENERATE_SUMMARY = f"{REPORTS_DIR}/{AWS_PROFILE}-{REGION}.generate-summary.json"
+# the fingerprint of every group as of its last successful import, groups that still match are skipped
+GROUPS_DIR = f"rds/{AWS_PROFILE}/{REGION}"
+MANIFEST = f"{GROUPS_DIR}/manifest.json"
+# the timeline of the last run, every group and step with its wall and cpu time
+TRACE = f"{REPORTS_DIR}/{AWS_PROFILE}-{REGION}.trace.json"
+# describe_db_instances fields that end up in the generated terraform, statuses and
+# timestamps are left out as they change without the terraform changing
+FINGERPRINT_ATTRIBUTES = [
+    "DBInstanceClass", "Engine", "EngineVersion", "AllocatedStorage", "MaxAllocatedStorage", "StorageType", "Iops",
+    "StorageEncrypted", "KmsKeyId", "MultiAZ", "AvailabilityZone", "PubliclyAccessible", "DBName", "MasterUsername",
+    "BackupRetentionPeriod", "PreferredBackupWindow", "PreferredMaintenanceWindow", "AutoMinorVersionUpgrade",
+    "DeletionProtection", "CopyTagsToSnapshot", "MonitoringInterval", "MonitoringRoleArn",
+    "PerformanceInsightsEnabled", "IAMDatabaseAuthenticationEnabled", "CACertificateIdentifier",
+    "ReadReplicaSourceDBInstanceIdentifier", "EnabledCloudwatchLogsExports", "TagList",
+]
+# every step below reads the instances from here, shared with the other rds tools. Only
+# generate_terraform lists them afresh, the rest may use a snapshot up to $RDS_INVENTORY_TTL old
+INVENTORY_CACHE = cache.new_inventory_cache()
 
 
 def _get_rds_instances():
-    return RDS_CLIENT.describe_db_instances()["DBInstances"]
+    return INVENTORY_CACHE.db_instances(RDS_CLIENT, AWS_PROFILE, REGION)
 
 
 def _make_terraformer_rds_import_command(**kwargs):
@@ -112,102 +143,239 @@ def _create_rds_with_replica_pgs_csv():
         ])
 
 
-def _add_text_in_tf(tf_filepath, resource_type, text):
-    with open(tf_filepath, "r") as rtf, open(f"{tf_filepath}-new", "w") as wtf:
-        for line in rtf:
-            wtf.write(line)
-            if f"resource \"{resource_type}\"" in line:
-                logging.info(f"adding {text} in {tf_filepath}")
-                wtf.write(text+"\n")
-    os.remove(tf_filepath)
-    os.rename(f"{tf_filepath}-new", tf_filepath)
-
-
-def _remove_text_from_tf(tf_filepath, text):
-    with open(tf_filepath, "r") as rtf, open(f"{tf_filepath}-new", "w") as wtf:
-        for line in rtf:
-            without_space_line = line.replace(" ", "")
-            without_space_text = text.replace(" ", "")
-            if without_space_line.startswith(without_space_text):
-                logging.info(f"removing line {line} from {tf_filepath}")
-                continue
-            wtf.write(line)
-    os.remove(tf_filepath)
-    os.rename(f"{tf_filepath}-new", tf_filepath)
-
-
-def _fix_replica_tf(tf_filepath):
-    replicate_optional_lines = []
-    is_replica = False
-    with open(tf_filepath, "r") as rtf, open(f"{tf_filepath}-new", "w") as wtf:
-        for line in rtf:
-            if "resource \"aws_db_instance\"" in line:
-                replicate_optional_lines = []
-                is_replica = False
-
-            without_space_line = line.replace(" ", "")
-            if without_space_line.startswith("replicate_source_db="):
-                is_replica = True
-
-            if without_space_line.startswith("engine=") or without_space_line.startswith("engine_version=") or without_space_line.startswith("username=") or without_space_line.startswith("db_name="):
-                replicate_optional_lines.append(line)
-            elif is_replica and without_space_line.startswith("vpc_security_group_ids="):
-                wtf.write(line)
-                replicate_optional_lines = []
-            elif not is_replica and without_space_line.startswith("vpc_security_group_ids="):
-                wtf.write(line)
-                for op_line in replicate_optional_lines:
-                    wtf.write(op_line)
-            else:
-                wtf.write(line)
-    os.remove(tf_filepath)
-    os.rename(f"{tf_filepath}-new", tf_filepath)
+# aws refuses these on a replica, they all come from its source instance
+REPLICA_INHERITED_ATTRIBUTES = ["engine", "engine_version", "username", "db_name"]
+
+
+def _fix_replica(tf_filepath, db_instance):
+    if db_instance.attribute("replicate_source_db"):
+        for attribute in db_instance.remove(*REPLICA_INHERITED_ATTRIBUTES):
+            logging.info(f"removing {attribute.name} of replica {db_instance.labels[1]} from {tf_filepath}")
+
+
+def _add_apply_immediately(tf_filepath, db_instance):
+    if db_instance.set("apply_immediately", "false"):
+        logging.info(f"adding apply_immediately = false in {tf_filepath}")
+
+
+def _remove_name(tf_filepath, db_instance):
+    # the deprecated name of the database, nested blocks and other attributes are left alone
+    if db_instance.remove("name"):
+        logging.info(f"removing name from {tf_filepath}")
+
+
+DB_INSTANCE_RULES = [
+    ("aws_db_instance", _fix_replica),
+    ("aws_db_instance", _add_apply_immediately),
+    ("aws_db_instance", _remove_name),
+]
+
+
+# step is where a failed group stopped, exit_code is set when a command failed there
+GroupResult = namedtuple("GroupResult", ["group", "ok", "step", "exit_code", "error", "seconds"])
+
+
+class StepFailed(Exception):
+    def __init__(self, step, exit_code):
+        super().__init__(f"{step} failed with exit code {exit_code}")
+        self.step = step
+        self.exit_code = exit_code
+
+
+def _check(step, exit_code):
+    if exit_code:
+        raise StepFailed(step, exit_code)
+
+
+def _swap_in(work_dir, group_dir):
+    # the old directory is moved aside first as os.replace can't replace a non empty one
+    old_dir = f"{work_dir}.old"
+    shutil.rmtree(old_dir, ignore_errors=True)
+    if os.path.exists(group_dir):
+        os.replace(group_dir, old_dir)
+    os.replace(work_dir, group_dir)
+    shutil.rmtree(old_dir, ignore_errors=True)
+
+
+def _generate_group(r, v):
+    # everything one group needs, a failing command raises StepFailed. The group is imported
+    # into a sibling directory and only replaces the one in GROUPS_DIR once every step worked,
+    # so a failed run leaves the last good terraform as it was
+    db_instances = ":".join(v["replicas"])+f":{r}" if len(v["replicas"]) else r
+    db_parameter_groups = ":".join(v["pgs"])
+    filtered_ogs = list(filter(lambda og: "default" not in og, v["ogs"]))
+    db_option_group = ":".join(filtered_ogs) if len(filtered_ogs) else "exclude"
+    path_pattern = f"{GROUPS_DIR}/{r}"
+    work_dir = f"{GROUPS_DIR}/.{r}.new"
+    terraformer_command = _make_terraformer_rds_import_command(
+        db_instances=db_instances,
+        db_parameter_groups=db_parameter_groups,
+        db_option_group=db_option_group,
+        path_pattern=work_dir
+    )
+    # what a failed earlier run left behind
+    shutil.rmtree(work_dir, ignore_errors=True)
+    logging.info(f"Executing {terraformer_command}")
+    _check("terraformer", COMMANDS.run("terraformer", terraformer_command))
+    with COMMANDS.step("fix db_instance.tf"):
+        hcl.transform_file(f"{work_dir}/db_instance.tf", DB_INSTANCE_RULES)
+    _check("0.13upgrade", do_tf13_upgrade(work_dir))
+    _check("fmt", do_tf_fmt(work_dir))
+    _check("init", do_tf013_init(work_dir))
+    _check("plan", do_tf013_plan(work_dir))
+    _check("refresh", do_tf013_refresh(work_dir))
+    replace_existing_provider_tf(f"{work_dir}/provider.tf", tf_s3_backend={
+        "bucket": "stage-mybuket" if AWS_PROFILE == "stage" else "prod-mybucket",
+        "key": f"{path_pattern}-tfstate",
+        "region": "ap-southeast-1"
+    })
+    _check("init -reconfigure", do_tf_init_reconfigure(work_dir))
+    os.remove(f"{work_dir}/terraform.tfstate")
+    os.remove(f"{work_dir}/terraform.tfstate.backup")
+    os.remove(f"{work_dir}/variables.tf")
+    os.remove(f"{work_dir}/versions.tf")
+    _check("init -reconfigure", do_tf_init_reconfigure(work_dir))
+    os.remove(f"{work_dir}/provider.tf-backup")
+    _swap_in(work_dir, path_pattern)
+
+
+def _run_group(r, v):
+    # a failure only ends its own group, it's kept in the result instead of raised
+    started = time.monotonic()
+    try:
+        with COMMANDS.group(r):
+            _generate_group(r, v)
+    except StepFailed as e:
+        logging.error(f"{r}: {e}")
+        return GroupResult(r, False, e.step, e.exit_code, str(e), time.monotonic() - started)
+    except Exception as e:
+        logging.exception(f"{r}: failed")
+        return GroupResult(r, False, None, None, repr(e), time.monotonic() - started)
+    logging.info(f"{r}: done")
+    return GroupResult(r, True, None, None, None, time.monotonic() - started)
+
+
+def _read_json(path, default):
+    if not os.path.exists(path):
+        return default
+    with open(path) as f:
+        return json.load(f)
+
+
+def _write_json(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(f"{path}-new", "w") as f:
+        json.dump(data, f, indent=2, sort_keys=True)
+    os.replace(f"{path}-new", path)
+
+
+def _read_summary(summary_path=GENERATE_SUMMARY):
+    return {g["group"]: g for g in _read_json(summary_path, [])}
+
+
+def _write_summary(results, summary_path=GENERATE_SUMMARY):
+    # merged with the last summary, so a rerun of a few groups keeps the outcome of the others
+    summary = _read_summary(summary_path)
+    summary.update({r.group: r._asdict() for r in results})
+    _write_json(summary_path, sorted(summary.values(), key=lambda g: g["group"]))
+
+
+def _instance_fingerprint(rds):
+    fingerprint = {k: rds.get(k) for k in FINGERPRINT_ATTRIBUTES}
+    # only the names, the apply and membership statuses come and go
+    fingerprint["DBParameterGroups"] = sorted(pg["DBParameterGroupName"] for pg in rds.get("DBParameterGroups", []))
+    fingerprint["OptionGroupMemberships"] = sorted(og["OptionGroupName"] for og in rds.get("OptionGroupMemberships", []))
+    fingerprint["VpcSecurityGroups"] = sorted(sg["VpcSecurityGroupId"] for sg in rds.get("VpcSecurityGroups", []))
+    fingerprint["DBSubnetGroup"] = rds.get("DBSubnetGroup", {}).get("DBSubnetGroupName")
+    return fingerprint
+
+
+def group_fingerprints(rds_resources_group):
+    # a hash of the instances, parameter groups and option groups of every group
+    instances = {rds["DBInstanceIdentifier"]: rds for rds in _get_rds_instances()}
+    fingerprints = {}
+    for r, v in rds_resources_group.items():
+        state = {
+            "pgs": sorted(v["pgs"]),
+            "ogs": sorted(v["ogs"]),
+            "instances": {i: _instance_fingerprint(instances.get(i, {})) for i in sorted([r] + v["replicas"])},
+        }
+        fingerprints[r] = hashlib.sha256(json.dumps(state, sort_keys=True, default=str).encode()).hexdigest()
+    return fingerprints
+
+
+def _update_manifest(fingerprints, removed, manifest_path=MANIFEST):
+    manifest = _read_json(manifest_path, {})
+    manifest.update(fingerprints)
+    for r in removed:
+        manifest.pop(r, None)
+    _write_json(manifest_path, manifest)
+
+
+def changed_groups(rds_resources_group, fingerprints, manifest_path=MANIFEST):
+    # new groups, groups whose fingerprint moved on and groups whose directory is gone
+    manifest = _read_json(manifest_path, {})
+    return [
+        r for r in rds_resources_group
+        if manifest.get(r) != fingerprints[r] or not os.path.isdir(f"{GROUPS_DIR}/{r}")
+    ]
 
 
-def generate_terraform():
+def failed_groups(summary_path=GENERATE_SUMMARY):
+    return [g for g, result in _read_summary(summary_path).items() if not result["ok"]]
+
+
+def generate_terraform(groups=None, workers=GENERATE_WORKERS, force=False, trace_path=TRACE, slowest=10):
+    # groups limits the run to those primaries, without them only the groups that changed
+    # since their last successful import are imported, or every group with force. A snapshot
+    # taken before a change would fingerprint the group as unchanged, so it is listed again
+    INVENTORY_CACHE.invalidate(AWS_PROFILE, REGION)
     rds_resources_group = group_rds_resources()
-    for r, v in rds_resources_group.items():
-        db_instances = ":".join(v["replicas"])+f":{r}" if len(v["replicas"]) else r
-        db_parameter_groups = ":".join(v["pgs"])
-        filtered_ogs = list(filter(lambda og: "default" not in og, v["ogs"]))
-        db_option_group = ":".join(filtered_ogs) if len(filtered_ogs) else "exclude"
-        path_pattern = f"rds/{AWS_PROFILE}/{REGION}/{r}"
-        terraformer_command = _make_terraformer_rds_import_command(
-            db_instances=db_instances,
-            db_parameter_groups=db_parameter_groups,
-            db_option_group=db_option_group,
-            path_pattern=path_pattern
-        )
-        logging.info(f"Executing {terraformer_command}")
-        exit_code = subprocess.call(terraformer_command, shell=True)
-        if exit_code:
-            logging.error(f"Failed with exit code {exit_code}")
-            break
-        _fix_replica_tf(f"{path_pattern}/db_instance.tf")
-        _add_text_in_tf(f"{path_pattern}/db_instance.tf", "aws_db_instance", "apply_immediately = false")
-        _remove_text_from_tf(f"{path_pattern}/db_instance.tf", "name=")
-        do_tf13_upgrade(path_pattern)
-        do_tf_fmt(path_pattern)
-        do_tf013_init(path_pattern)
-        do_tf013_plan(path_pattern)
-        do_tf013_refresh(path_pattern)
-        replace_existing_provider_tf(f"{path_pattern}/provider.tf", tf_s3_backend={
-            "bucket": "stage-mybuket" if AWS_PROFILE == "stage" else "prod-mybucket",
-            "key": f"{path_pattern}-tfstate",
-            "region": "ap-southeast-1"
-        })
-        do_tf_init_reconfigure(path_pattern)
-        os.remove(f"{path_pattern}/terraform.tfstate")
-        os.remove(f"{path_pattern}/terraform.tfstate.backup")
-        os.remove(f"{path_pattern}/variables.tf")
-        os.remove(f"{path_pattern}/versions.tf")
-        do_tf_init_reconfigure(path_pattern)
-        os.remove(f"{path_pattern}/provider.tf-backup")
-
-
-def generate_atlantis_config():
+    fingerprints = group_fingerprints(rds_resources_group)
+    removed = set(_read_json(MANIFEST, {})) - rds_resources_group.keys()
+    if removed:
+        logging.warning(f"not in the inventory anymore, their directories in {GROUPS_DIR} can go: "
+                        f"{', '.join(sorted(removed))}")
+    if groups is not None:
+        missing = set(groups) - rds_resources_group.keys()
+        if missing:
+            logging.warning(f"not in the inventory anymore, skipping: {', '.join(sorted(missing))}")
+        rds_resources_group = {r: v for r, v in rds_resources_group.items() if r in groups}
+    elif not force:
+        changed = changed_groups(rds_resources_group, fingerprints)
+        logging.info(f"{len(rds_resources_group) - len(changed)} groups unchanged, {len(changed)} to import")
+        rds_resources_group = {r: rds_resources_group[r] for r in changed}
+    results = []
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(_run_group, r, v) for r, v in rds_resources_group.items()]
+        for f in as_completed(futures):
+            results.append(f.result())
+            logging.info(f"{len(results)}/{len(futures)} groups finished")
+    _write_summary(results)
+    _update_manifest({r.group: fingerprints[r.group] for r in results if r.ok}, removed)
+    if results:
+        COMMANDS.write_trace(trace_path)
+        COMMANDS.log_slowest(slowest)
+        logging.info(f"timeline of every group written to {trace_path}")
+    _log_summary(results)
+    return results
+
+
+def _log_summary(results):
+    failed = sorted((r for r in results if not r.ok), key=lambda r: r.group)
+    logging.info(f"{len(results) - len(failed)} groups generated, {len(failed)} failed")
+    for r in failed:
+        logging.error(f"{r.group}: {r.error}")
+    if failed:
+        logging.info(f"rerun only the failed groups with --rerun-failed, see {GENERATE_SUMMARY}")
+
+
+def generate_atlantis_config(groups=None):
+    # groups limits the projects printed, e.g. to the ones a run just imported
     rds_resources_group = group_rds_resources()
     for k in rds_resources_group.keys():
+        if groups is not None and k not in groups:
+            continue
         print(f"- name: rds-prod-{REGION}-{k}")
         print(f"  dir: rds/prod/{REGION}/{k}")
         print("  workspace: default")
@@ -222,7 +390,37 @@ def create_reports():
     _create_rds_with_replica_pgs_csv()
 
 
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="import rds instances of $AWS_PROFILE in $REGION with terraformer")
+    parser.add_argument("--workers", type=int, default=GENERATE_WORKERS,
+                        help="groups imported at the same time, $GENERATE_WORKERS or 4 by default")
+    parser.add_argument("--group", action="append", help="only import the group of this primary, can be repeated")
+    parser.add_argument("--rerun-failed", action="store_true", help="only import the groups that failed last run")
+    parser.add_argument("--all", action="store_true",
+                        help="import every group, not only the ones changed since their last import")
+    parser.add_argument("--atlantis-delta", action="store_true",
+                        help="only print the atlantis projects of the groups imported by this run")
+    parser.add_argument("--trace", default=TRACE, help="chrome trace json the timeline of the run is written to")
+    parser.add_argument("--slowest", type=int, default=10, help="slowest steps and groups logged at the end")
+    parser.add_argument("--fix-only", action="store_true",
+                        help="only reapply the db_instance.tf fixes to the groups already imported")
+    return parser.parse_args(argv)
+
+
 if __name__ == "__main__":
+    args = parse_args()
+    if args.fix_only:
+        started = time.monotonic()
+        changed, total = hcl.transform_tree(GROUPS_DIR, "db_instance.tf", DB_INSTANCE_RULES)
+        logging.info(f"{changed} of {total} db_instance.tf changed in {time.monotonic() - started:.2f}s")
+        raise SystemExit()
+    groups = args.group
+    if args.rerun_failed:
+        groups = (groups or []) + failed_groups()
     create_reports()
-    generate_terraform()
-    generate_atlantis_config()
+    results = []
+    if args.rerun_failed and not groups:
+        logging.info("no failed groups to rerun")
+    else:
+        results = generate_terraform(groups, args.workers, args.all, args.trace, args.slowest)
+    generate_atlantis_config([r.group for r in results if r.ok] if args.atlantis_delta else None)
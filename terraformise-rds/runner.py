@@ -0,0 +1,125 @@
+import json
+import logging
+import os
+import subprocess
+import sys
+import threading
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+
+# wall and cpu are in seconds, started is the offset from the start of the run. cpu of a
+# command is the user and system time of the shell and everything it waited for, exit_code
+# and output_bytes are None for python steps
+Step = namedtuple(
+    "Step", ["group", "name", "command", "started", "wall", "cpu", "exit_code", "output_bytes", "thread"]
+)
+CHUNK_SIZE = 65536
+
+
+class CommandRunner:
+    # runs the commands of every group and keeps a Step for each, the group is the one
+    # the calling thread is in
+    def __init__(self):
+        self.steps = []
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.started = time.monotonic()
+
+    def _record(self, name, command, started, wall, cpu, exit_code=None, output_bytes=None):
+        step = Step(
+            getattr(self.local, "group", None), name, command, started - self.started, wall, cpu, exit_code,
+            output_bytes, threading.current_thread().name
+        )
+        with self.lock:
+            self.steps.append(step)
+        return step
+
+    @contextmanager
+    def group(self, name):
+        # steps run inside are the group's, the group itself is kept as a step named ""
+        self.local.group = name
+        started = time.monotonic()
+        cpu = time.thread_time()
+        try:
+            yield
+        finally:
+            # the python work of the group plus the cpu of every command it ran
+            with self.lock:
+                commands_cpu = sum(s.cpu for s in self.steps if s.group == name and s.command is not None)
+            self._record("", None, started, time.monotonic() - started, time.thread_time() - cpu + commands_cpu)
+            self.local.group = None
+
+    @contextmanager
+    def step(self, name):
+        # a step done in python, its cpu is the one of the calling thread
+        started = time.monotonic()
+        cpu = time.thread_time()
+        try:
+            yield
+        finally:
+            self._record(name, None, started, time.monotonic() - started, time.thread_time() - cpu)
+
+    def run(self, name, command, cwd=None, env=None):
+        # like subprocess.call(command, shell=True), the output still goes to stdout but is
+        # counted on the way
+        started = time.monotonic()
+        process = subprocess.Popen(command, cwd=cwd, env=env, shell=True, stdout=subprocess.PIPE,
+                                   stderr=subprocess.STDOUT)
+        output_bytes = 0
+        while chunk := os.read(process.stdout.fileno(), CHUNK_SIZE):
+            output_bytes += len(chunk)
+            sys.stdout.buffer.write(chunk)
+            sys.stdout.buffer.flush()
+        process.stdout.close()
+        # wait4 gives the resource usage of this child alone, other groups run theirs meanwhile
+        _, status, usage = os.wait4(process.pid, 0)
+        process.returncode = os.waitstatus_to_exitcode(status)
+        self._record(name, command, started, time.monotonic() - started, usage.ru_utime + usage.ru_stime,
+                     process.returncode, output_bytes)
+        return process.returncode
+
+    def write_trace(self, path):
+        # the chrome trace event format, chrome://tracing or ui.perfetto.dev open it. Every
+        # worker thread is a row, its steps nest under the group they ran in
+        threads = {}
+        events = []
+        for step in sorted(self.steps, key=lambda s: (s.started, -s.wall)):
+            tid = threads.setdefault(step.thread, len(threads) + 1)
+            args = {"cpu_s": round(step.cpu, 3)}
+            if step.command is not None:
+                args.update(command=step.command, exit_code=step.exit_code, output_bytes=step.output_bytes)
+            events.append({
+                "name": step.name or step.group, "cat": "group" if not step.name else "step", "ph": "X", "pid": 1,
+                "tid": tid, "ts": round(step.started * 1e6), "dur": round(step.wall * 1e6), "args": args,
+            })
+        events.extend(
+            {"name": "thread_name", "ph": "M", "pid": 1, "tid": tid, "args": {"name": thread}}
+            for thread, tid in threads.items()
+        )
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(f"{path}-new", "w") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+        os.replace(f"{path}-new", path)
+
+    def log_slowest(self, top=10):
+        steps = [s for s in self.steps if s.name]
+        groups = [s for s in self.steps if not s.name]
+        totals = {}
+        for s in steps:
+            wall, cpu, count = totals.get(s.name, (0.0, 0.0, 0))
+            totals[s.name] = (wall + s.wall, cpu + s.cpu, count + 1)
+        logging.info("step totals:")
+        for name, (wall, cpu, count) in sorted(totals.items(), key=lambda t: -t[1][0]):
+            logging.info(f"\t{name:<20}{count:>6} runs{wall:>10.1f}s wall{cpu:>10.1f}s cpu")
+        logging.info(f"slowest {top} steps:")
+        for s in sorted(steps, key=lambda s: -s.wall)[:top]:
+            output = "" if s.output_bytes is None else f"{s.output_bytes:>10} bytes out"
+            exit_code = "" if s.exit_code is None else f"  exit {s.exit_code}"
+            logging.info(f"\t{s.group or '-':<30}{s.name:<20}{s.wall:>8.1f}s wall{s.cpu:>8.1f}s cpu{output}{exit_code}")
+        logging.info(f"slowest {top} groups:")
+        for s in sorted(groups, key=lambda s: -s.wall)[:top]:
+            logging.info(f"\t{s.group:<30}{s.wall:>8.1f}s wall{s.cpu:>8.1f}s cpu")
+
+
+COMMANDS = CommandRunner()
@@ -0,0 +1,136 @@
+import os
+import tempfile
+import unittest
+
+import hcl
+
+os.environ.setdefault("REGION", "ap-southeast-1")
+import rds  # noqa: E402
+
+# usage: python -m unittest discover tests
+# terraformer output with everything the scanner has to step over: comments, strings and
+# heredocs holding brackets, interpolations and one line blocks
+DB_INSTANCE_TF = """# generated by terraformer
+resource "aws_db_instance" "tfer--orders" {
+  allocated_storage = "100"
+  engine            = "postgres"
+  engine_version    = "13.4"
+  identifier        = "orders"
+  name              = "orders"
+  name_prefix       = "orders-"
+  username          = "app"
+
+  tags = {
+    Name  = "orders"
+    Owner = "team-${var.team}-{db}"
+  }
+
+  /* a comment with { and
+     } in it */
+  policy = <<POLICY
+{
+  "Statement": [{"Effect": "Allow"}
+POLICY
+
+  timeouts { create = "1h" }
+
+  restore_to_point_in_time {
+    name                          = "nested"
+    source_db_instance_identifier = "orders-old"
+  }
+}
+
+resource "aws_db_instance" "tfer--orders-replica" {
+  db_name             = "orders"
+  engine              = "postgres"
+  engine_version      = "13.4"
+  identifier          = "orders-replica"
+  replicate_source_db = "orders"
+  username            = "app" # set by aws from the source
+  description         = "}"
+}
+
+resource "aws_db_parameter_group" "tfer--orders" {
+  name = "orders"
+}
+"""
+
+
+class HclTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, "db_instance.tf")
+        with open(self.path, "w") as f:
+            f.write(DB_INSTANCE_TF)
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def read(self):
+        with open(self.path) as f:
+            return f.read()
+
+    def resource(self, text, name):
+        return next(b for b in hcl.parse(text).resources("aws_db_instance") if b.labels[1] == name)
+
+    def test_round_trip(self):
+        self.assertEqual(hcl.parse(DB_INSTANCE_TF).render(), DB_INSTANCE_TF)
+        mtime = os.stat(self.path).st_mtime_ns
+        self.assertFalse(hcl.transform_file(self.path, [("aws_db_instance", lambda path, block: None)]))
+        self.assertEqual(self.read(), DB_INSTANCE_TF)
+        self.assertEqual(os.stat(self.path).st_mtime_ns, mtime)
+
+    def test_structure(self):
+        document = hcl.parse(DB_INSTANCE_TF)
+        self.assertEqual([b.labels for b in document.blocks("resource")], [
+            ("aws_db_instance", "tfer--orders"), ("aws_db_instance", "tfer--orders-replica"),
+            ("aws_db_parameter_group", "tfer--orders"),
+        ])
+        orders = document.resources("aws_db_instance")[0]
+        self.assertEqual([b.type for b in orders.blocks()], ["timeouts", "restore_to_point_in_time"])
+        self.assertIn("{\"Effect\": \"Allow\"}", orders.attribute("policy").render())
+        self.assertEqual(len(orders.attribute("tags").lines), 4)
+
+    def test_heredoc_brackets(self):
+        text = "resource \"a\" \"b\" {\n  x = <<-EOT\n    }}} {\n  EOT\n  y = 1\n}\nresource \"a\" \"c\" {\n}\n"
+        document = hcl.parse(text)
+        self.assertEqual(document.render(), text)
+        first, second = document.blocks("resource")
+        self.assertEqual([i.name for i in first.items if isinstance(i, hcl.Attribute)], ["x", "y"])
+        self.assertEqual(second.labels, ("a", "c"))
+
+    def test_remove_name(self):
+        self.assertTrue(hcl.transform_file(self.path, [("aws_db_instance", rds._remove_name)]))
+        text = self.read()
+        orders = self.resource(text, "tfer--orders")
+        self.assertIsNone(orders.attribute("name"))
+        self.assertIsNotNone(orders.attribute("name_prefix"))
+        self.assertIsNotNone(orders.blocks("restore_to_point_in_time")[0].attribute("name"))
+        # other resource types keep theirs
+        self.assertEqual(text, DB_INSTANCE_TF.replace("  name              = \"orders\"\n", "", 1))
+
+    def test_replica_inherited_attributes(self):
+        self.assertTrue(hcl.transform_file(self.path, [("aws_db_instance", rds._fix_replica)]))
+        text = self.read()
+        replica = self.resource(text, "tfer--orders-replica")
+        for name in rds.REPLICA_INHERITED_ATTRIBUTES:
+            self.assertIsNone(replica.attribute(name), name)
+        self.assertEqual(replica.attribute("description").render().strip(), "description         = \"}\"")
+        # the source instance isn't a replica
+        orders = self.resource(text, "tfer--orders")
+        self.assertIsNotNone(orders.attribute("engine"))
+        self.assertIsNotNone(orders.attribute("username"))
+
+    def test_db_instance_rules(self):
+        self.assertTrue(hcl.transform_file(self.path, rds.DB_INSTANCE_RULES))
+        once = self.read()
+        for name in ["tfer--orders", "tfer--orders-replica"]:
+            self.assertEqual(self.resource(once, name).attribute("apply_immediately").render().strip(),
+                             "apply_immediately = false")
+        # a second pass has nothing left to change
+        self.assertFalse(hcl.transform_file(self.path, rds.DB_INSTANCE_RULES))
+        self.assertEqual(self.read(), once)
+
+
+if __name__ == "__main__":
+    unittest.main()
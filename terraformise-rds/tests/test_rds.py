@@ -0,0 +1,154 @@
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from botocore.stub import Stubber
+from rds_inventory import cache
+
+os.environ.setdefault("REGION", "ap-southeast-1")
+import rds  # noqa: E402
+
+
+def db_instance(identifier, instance_class="db.t3.medium", source=None, replicas=()):
+    instance = {
+        "DBInstanceIdentifier": identifier,
+        "DBInstanceClass": instance_class,
+        "Engine": "postgres",
+        "EngineVersion": "13.4",
+        "DBInstanceStatus": "available",
+        "DBParameterGroups": [{"DBParameterGroupName": f"{identifier}-pg", "ParameterApplyStatus": "in-sync"}],
+        "OptionGroupMemberships": [{"OptionGroupName": "default:postgres-13", "Status": "in-sync"}],
+        "ReadReplicaDBInstanceIdentifiers": list(replicas),
+    }
+    if source is not None:
+        instance["ReadReplicaSourceDBInstanceIdentifier"] = source
+    return instance
+
+
+INSTANCES = [
+    db_instance("orders", replicas=["orders-replica"]),
+    db_instance("orders-replica", source="orders"),
+    db_instance("users"),
+    db_instance("billing"),
+]
+
+
+class ChangedGroupsTest(unittest.TestCase):
+    # runs in a temporary directory, where GROUPS_DIR, the manifest and the reports go
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.dir = tempfile.TemporaryDirectory()
+        os.chdir(self.dir.name)
+        self.inventory_cache = cache.new_inventory_cache(os.path.join(self.dir.name, "inventory"), 900)
+        patchers = [
+            mock.patch.object(rds, "INVENTORY_CACHE", self.inventory_cache),
+            # the import of a group itself is terraformer and terraform, only the choice of groups is tested
+            mock.patch.object(rds, "_run_group", side_effect=self.run_group),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.stubber = Stubber(rds.RDS_CLIENT)
+        self.stubber.activate()
+        self.addCleanup(self.stubber.deactivate)
+        self.imported = []
+        self.failing = set()
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        self.dir.cleanup()
+
+    def run_group(self, r, v):
+        self.imported.append(r)
+        ok = r not in self.failing
+        if ok:
+            os.makedirs(f"{rds.GROUPS_DIR}/{r}", exist_ok=True)
+        return rds.GroupResult(r, ok, None if ok else "plan", None if ok else 1, None, 0.0)
+
+    def list_instances(self, instances):
+        self.stubber.add_response("describe_db_instances", {"DBInstances": instances})
+
+    def generate(self, instances, **kwargs):
+        self.list_instances(instances)
+        self.imported = []
+        rds.generate_terraform(trace_path=os.path.join(self.dir.name, "trace.json"), **kwargs)
+        self.stubber.assert_no_pending_responses()
+        return sorted(self.imported)
+
+    def manifest(self):
+        with open(rds.MANIFEST) as f:
+            return json.load(f)
+
+    def test_group_fingerprints(self):
+        self.list_instances(INSTANCES)
+        groups = rds.group_rds_resources()
+        self.assertEqual(sorted(groups), ["billing", "orders", "users"])
+        self.assertEqual(groups["orders"]["replicas"], ["orders-replica"])
+        fingerprints = rds.group_fingerprints(groups)
+        self.assertEqual(fingerprints, rds.group_fingerprints(groups))
+
+        # statuses don't count, the class of a replica does
+        changed = [dict(i) for i in INSTANCES]
+        changed[1]["DBInstanceClass"] = "db.r5.large"
+        changed[2]["DBInstanceStatus"] = "modifying"
+        changed[2]["DBParameterGroups"] = [{"DBParameterGroupName": "users-pg", "ParameterApplyStatus": "pending-reboot"}]
+        self.inventory_cache.invalidate(rds.AWS_PROFILE, rds.REGION)
+        self.list_instances(changed)
+        changed_fingerprints = rds.group_fingerprints(groups)
+        self.assertNotEqual(changed_fingerprints["orders"], fingerprints["orders"])
+        self.assertEqual(changed_fingerprints["users"], fingerprints["users"])
+        self.assertEqual(changed_fingerprints["billing"], fingerprints["billing"])
+
+    def test_changed_groups(self):
+        groups = {"orders": {}, "users": {}, "billing": {}, "new": {}}
+        fingerprints = {"orders": "a", "users": "b", "billing": "c", "new": "d"}
+        os.makedirs(os.path.dirname(rds.MANIFEST), exist_ok=True)
+        with open(rds.MANIFEST, "w") as f:
+            json.dump({"orders": "a", "users": "old", "billing": "c"}, f)
+        for r in ["orders", "users"]:
+            os.makedirs(f"{rds.GROUPS_DIR}/{r}")
+        # users changed, billing's directory is gone and new was never imported
+        self.assertEqual(rds.changed_groups(groups, fingerprints), ["users", "billing", "new"])
+
+    def test_generate_terraform(self):
+        self.assertEqual(self.generate(INSTANCES), ["billing", "orders", "users"])
+        manifest = self.manifest()
+        self.assertEqual(sorted(manifest), ["billing", "orders", "users"])
+
+        # nothing changed, nothing imported
+        self.assertEqual(self.generate(INSTANCES), [])
+        self.assertEqual(self.manifest(), manifest)
+
+        # a changed instance, a removed directory, a new group and a removed one
+        changed = [dict(i) for i in INSTANCES if i["DBInstanceIdentifier"] != "billing"]
+        changed[0]["EngineVersion"] = "13.7"
+        changed.append(db_instance("payments"))
+        os.rmdir(f"{rds.GROUPS_DIR}/users")
+        self.failing = {"payments"}
+        self.assertEqual(self.generate(changed), ["orders", "payments", "users"])
+        rewritten = self.manifest()
+        # billing left the inventory, payments failed and is tried again next run
+        self.assertEqual(sorted(rewritten), ["orders", "users"])
+        self.assertNotEqual(rewritten["orders"], manifest["orders"])
+        self.assertEqual(rewritten["users"], manifest["users"])
+        self.assertEqual(self.generate(changed), ["payments"])
+
+    def test_generate_terraform_lists_afresh(self):
+        self.generate(INSTANCES)
+        # the next run starts with the snapshot of this one on disk, fresh enough for the other
+        # tools but taken before the instance changed
+        self.inventory_cache.snapshots.clear()
+        changed = [dict(i) for i in INSTANCES]
+        changed[2]["DBInstanceClass"] = "db.r5.large"
+        self.assertEqual(self.generate(changed), ["users"])
+
+    def test_force_and_groups(self):
+        self.generate(INSTANCES)
+        self.assertEqual(self.generate(INSTANCES, force=True), ["billing", "orders", "users"])
+        self.assertEqual(self.generate(INSTANCES, groups=["users", "gone"]), ["users"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,9 +1,33 @@
+import hashlib
+import json
 import logging
 import os
-import subprocess
+import re
+import threading
+from functools import lru_cache
 
 from jinja2 import Template
 
+import hcl
+from runner import COMMANDS
+
+TERRAFORM = os.environ.get("TERRAFORM", "terraform")
+TERRAFORM013 = os.environ.get("TERRAFORM013", "terraform013")
+# every group links its providers from here instead of downloading its own copy
+PLUGIN_CACHE_DIR = os.path.expanduser(os.environ.get("TF_PLUGIN_CACHE_DIR", "~/.terraform.d/plugin-cache"))
+# a directory filled by `terraform providers mirror`, when set providers are only installed from it
+PROVIDER_MIRROR = os.environ.get("TF_PROVIDER_MIRROR")
+# the plugin cache isn't safe for two inits writing to it at once, only an init that may
+# install providers into it takes the lock
+INIT_LOCK = threading.Lock()
+# (binary, required providers) that an init already installed into the plugin cache, later
+# inits needing the same only link them and run without the lock
+CACHED_PROVIDERS = set()
+# the cli config of the user, the one written for the run starts from it
+USER_CLI_CONFIG = os.path.expanduser(os.environ.get("TF_CLI_CONFIG_FILE", "~/.terraformrc"))
+INIT_FINGERPRINT = ".terraform/init-fingerprint"
+REQUIREMENT = re.compile(r"(source|version)\s*=\s*\"([^\"]*)\"")
+
 
 def _quote_string(val):
     return f"\"{val}\""
@@ -43,37 +67,112 @@ def replace_existing_provider_tf(provider_tf_path, tf_s3_backend=None):
     logging.info("Successfully generated new provider.tf")
 
 
-def do_tf13_upgrade(tf_path):
-    command = "terraform013 0.13upgrade -yes"
+@lru_cache(maxsize=None)
+def _cli_config():
+    # built on the first command of the run, next to the plugin cache, both terraform 0.13 and 1.x read it. It is
+    # the config of the user with its plugin_cache_dir, and its provider_installation when there
+    # is a mirror, replaced
+    path = f"{PLUGIN_CACHE_DIR}.tfrc"
+    user_config = ""
+    if os.path.isfile(USER_CLI_CONFIG):
+        with open(USER_CLI_CONFIG) as f:
+            user_config = f.read()
+    document = hcl.parse(user_config)
+    document.remove("plugin_cache_dir")
+    if PROVIDER_MIRROR:
+        document.items = [item for item in document.items if item not in document.blocks("provider_installation")]
+    config = document.render()
+    if config and not config.endswith("\n"):
+        config += "\n"
+    config += f"plugin_cache_dir = {json.dumps(PLUGIN_CACHE_DIR)}\n"
+    if PROVIDER_MIRROR:
+        mirror = json.dumps(os.path.abspath(os.path.expanduser(PROVIDER_MIRROR)))
+        config += f"provider_installation {{\n  filesystem_mirror {{\n    path = {mirror}\n  }}\n}}\n"
+    if not os.path.exists(path) or open(path).read() != config:
+        os.makedirs(PLUGIN_CACHE_DIR, exist_ok=True)
+        hcl.write_atomic(path, config)
+    return path
+
+
+def _terraform_env():
+    env = dict(os.environ)
+    env["TF_CLI_CONFIG_FILE"] = _cli_config()
+    env["TF_PLUGIN_CACHE_DIR"] = PLUGIN_CACHE_DIR
+    return env
+
+
+def _call(step, command, tf_path):
     logging.info(f"Executing - {command} in {tf_path}")
-    return subprocess.call(command, cwd=tf_path, shell=True)
+    return COMMANDS.run(step, command, cwd=tf_path, env=_terraform_env())
+
+
+def _init_requirements(tf_path, binary):
+    # all init depends on: the binary, the backends and the providers required over every file.
+    # Returns the fingerprint of all three and the key of the binary and providers alone, None
+    # when no provider is required, those inits may still install the ones they use
+    backends = []
+    providers = {}
+    for name in sorted(os.listdir(tf_path)):
+        if not name.endswith(".tf"):
+            continue
+        with open(os.path.join(tf_path, name)) as f:
+            document = hcl.parse(f.read())
+        for terraform in document.blocks("terraform"):
+            backends.extend(" ".join(backend.render().split()) for backend in terraform.blocks("backend"))
+            for required in terraform.blocks("required_providers"):
+                for item in required.items:
+                    if isinstance(item, hcl.Attribute):
+                        providers.setdefault(item.name, set()).update(REQUIREMENT.findall(item.render()))
+    providers = {name: sorted(r) for name, r in sorted(providers.items())}
+    fingerprint = hashlib.sha256(json.dumps([binary, sorted(backends), providers]).encode()).hexdigest()
+    return fingerprint, json.dumps([binary, providers]) if providers else None
+
+
+def _init(step, command, tf_path, binary):
+    # skipped when the last init of this directory saw the same backend and providers
+    fingerprint_path = os.path.join(tf_path, INIT_FINGERPRINT)
+    fingerprint, providers = _init_requirements(tf_path, binary)
+    if os.path.exists(fingerprint_path):
+        with open(fingerprint_path) as f:
+            if f.read() == fingerprint:
+                logging.info(f"Skipping - {command} in {tf_path}, backend and providers unchanged")
+                return 0
+    exit_code = None
+    if providers not in CACHED_PROVIDERS:
+        with INIT_LOCK:
+            # an init that waited for the lock may find its providers cached by the one before
+            if providers not in CACHED_PROVIDERS:
+                exit_code = _call(step, command, tf_path)
+                if not exit_code and providers is not None:
+                    CACHED_PROVIDERS.add(providers)
+    if exit_code is None:
+        exit_code = _call(step, command, tf_path)
+    if not exit_code:
+        os.makedirs(os.path.dirname(fingerprint_path), exist_ok=True)
+        hcl.write_atomic(fingerprint_path, fingerprint)
+    return exit_code
+
+
+def do_tf13_upgrade(tf_path):
+    return _call("0.13upgrade", f"{TERRAFORM013} 0.13upgrade -yes", tf_path)
 
 
 def do_tf013_init(tf_path):
-    command = "terraform013 init"
-    logging.info(f"Executing - {command} in {tf_path}")
-    return subprocess.call(command, cwd=tf_path, shell=True)
+    return _init("init", f"{TERRAFORM013} init", tf_path, TERRAFORM013)
 
 
 def do_tf013_plan(tf_path):
-    command = f"AWS_PROFILE={os.environ.get('AWS_PROFILE')} terraform013 plan"
-    logging.info(f"Executing - {command} in {tf_path}")
-    return subprocess.call(command, cwd=tf_path, shell=True)
+    return _call("plan", f"AWS_PROFILE={os.environ.get('AWS_PROFILE')} {TERRAFORM013} plan", tf_path)
 
 
 def do_tf013_refresh(tf_path):
-    command = f"AWS_PROFILE={os.environ.get('AWS_PROFILE')} terraform013 refresh"
-    logging.info(f"Executing - {command} in {tf_path}")
-    return subprocess.call(command, cwd=tf_path, shell=True)
+    return _call("refresh", f"AWS_PROFILE={os.environ.get('AWS_PROFILE')} {TERRAFORM013} refresh", tf_path)
 
 
 def do_tf_fmt(tf_path):
-    command = "terraform fmt",
-    logging.info(f"Executing - {command} in {tf_path}")
-    return subprocess.call(command, cwd=tf_path, shell=True)
+    return _call("fmt", f"{TERRAFORM} fmt", tf_path)
 
 
 def do_tf_init_reconfigure(tf_path):
-    command = f"AWS_PROFILE={os.environ.get('AWS_PROFILE')} terraform init -reconfigure"
-    logging.info(f"Executing - {command} in {tf_path}")
-    return subprocess.call(command, cwd=tf_path, shell=True)
+    command = f"AWS_PROFILE={os.environ.get('AWS_PROFILE')} {TERRAFORM} init -reconfigure"
+    return _init("init -reconfigure", command, tf_path, TERRAFORM)